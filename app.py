@@ -4,7 +4,6 @@ from flask_migrate import Migrate
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
 from dotenv import load_dotenv
-from concurrent.futures import ThreadPoolExecutor
 import os
 
 # Import custom modules
@@ -18,16 +17,6 @@ load_dotenv()
 
 app = Flask(__name__)
 
-# ✅ Initialize executor globally
-executor = ThreadPoolExecutor(max_workers=5)
-
-@app.teardown_appcontext
-def shutdown_executor(exception=None):
-    """Shutdown executor when the app stops."""
-    global executor
-    if executor:
-        executor.shutdown(wait=False)
-
 # Enable CORS for the entire app
 CORS(app, supports_credentials=True, origins=['http://localhost:5173'], 
      methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"], 
@@ -0,0 +1,41 @@
+import os
+from collections import Counter
+
+from sqlalchemy import literal_column, or_
+from sqlalchemy.dialects.postgresql import insert
+
+from models import IndexedFile
+
+UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH_SIZE", "1000"))  # Rows per multi-row INSERT ... ON CONFLICT
+
+
+def bulk_upsert(session, records, update_columns, compare_columns=None, batch_size=UPSERT_BATCH_SIZE):
+    """Upsert IndexedFile mappings keyed on filepath with one multi-row statement per batch.
+
+    `update_columns` are the columns a conflicting row takes from the new record.
+    With `compare_columns`, an existing row is only rewritten when one of them
+    differs, so re-syncing unchanged files writes nothing (no WAL, no dead
+    tuples). Columns left out of `update_columns` (e.g. is_favorite) keep the
+    value they have. Returns (counts, written) where counts has "inserted",
+    "updated" and "unchanged" (skipped) and written lists the filepaths of
+    inserted or updated rows. Records within a batch must share the same keys.
+    """
+    records = list({record["filepath"]: record for record in records}.values())  # One row can't be hit twice per statement
+    counts = Counter(inserted=0, updated=0, unchanged=0)
+    written = []
+    for start in range(0, len(records), batch_size):
+        chunk = records[start:start + batch_size]
+        stmt = insert(IndexedFile).values(chunk)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["filepath"],
+            set_={column: stmt.excluded[column] for column in update_columns},
+            where=or_(*(getattr(IndexedFile, column).is_distinct_from(stmt.excluded[column])
+                        for column in compare_columns)) if compare_columns else None,
+        ).returning(IndexedFile.filepath, literal_column("(xmax = 0)").label("inserted"))  # xmax is 0 for fresh rows
+        rows = session.execute(stmt).all()
+        inserted = sum(1 for row in rows if row.inserted)
+        counts["inserted"] += inserted
+        counts["updated"] += len(rows) - inserted
+        counts["unchanged"] += len(chunk) - len(rows)
+        written.extend(row.filepath for row in rows)
+    return counts, written
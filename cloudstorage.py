@@ -17,6 +17,10 @@ from googleapiclient.discovery import build
 from google.oauth2.credentials import Credentials
 from jwt import decode, exceptions
 from dotenv import load_dotenv
+from outbox import enqueue_outbox, notify_outbox
+from google_clients import google_clients
+from token_cache import token_cache, expires_at
+from file_search import es_writer
 
 load_dotenv()
 
@@ -39,45 +43,9 @@ DROPBOX_TOKEN_URL = "https://api.dropbox.com/oauth2/token"
 AUTO_SYNC_INTERVAL = 600  # seconds
 
 # --------------------------
-# Helper Functions for Token Refresh
+# Token refresh helpers live in token_cache.py
 # --------------------------
 
-def refresh_access_token(refresh_token):
-    """Refresh Google OAuth Access Token using the stored refresh token."""
-    data = {
-        "client_id": CLIENT_ID,
-        "client_secret": CLIENT_SECRET,
-        "refresh_token": refresh_token,
-        "grant_type": "refresh_token",
-    }
-    try:
-        response = requests.post(TOKEN_URL, data=data)
-        response_data = response.json()
-        if "access_token" in response_data:
-            return response_data["access_token"]
-        return None
-    except Exception as e:
-        print(f"Error refreshing Google token: {e}")
-        return None
-
-def refresh_dropbox_access_token(refresh_token):
-    """Refresh Dropbox Access Token using the stored refresh token."""
-    data = {
-        "client_id": DROPBOX_CLIENT_ID,
-        "client_secret": DROPBOX_CLIENT_SECRET,
-        "refresh_token": refresh_token,
-        "grant_type": "refresh_token",
-    }
-    try:
-        response = requests.post(DROPBOX_TOKEN_URL, data=data)
-        response_data = response.json()
-        if "access_token" in response_data:
-            return response_data["access_token"]
-        return None
-    except Exception as e:
-        print(f"Error refreshing Dropbox token: {e}")
-        return None
-
 # --------------------------
 # Callback Endpoints
 # --------------------------
@@ -119,20 +87,24 @@ def google_callback():
     if existing_account:
         existing_account.access_token = tokens["access_token"]
         existing_account.refresh_token = tokens["refresh_token"]
+        existing_account.token_expires_at = expires_at(tokens.get("expires_in"))
         existing_account.last_synced = datetime.utcnow()
+        account = existing_account
     else:
-        new_account = CloudStorageAccount(
+        account = CloudStorageAccount(
             user_id=user_id,
             provider="Google Drive",
             email=email,
             permissions="Read files, Search files, Access metadata",
             access_token=tokens["access_token"],
             refresh_token=tokens["refresh_token"],
+            token_expires_at=expires_at(tokens.get("expires_in")),
             last_synced=datetime.utcnow()
         )
-        db.session.add(new_account)
+        db.session.add(account)
 
     db.session.commit()
+    token_cache.put(account.id, account.provider, account.access_token, account.token_expires_at)
     frontend_redirect_url = f"{FRONTEND_REDIRECT_URI}?status=success&email={email}"
     return redirect(frontend_redirect_url)
 
@@ -172,53 +144,46 @@ def dropbox_callback():
         return jsonify({"error": "User not authenticated"}), 401
 
     existing_account = CloudStorageAccount.query.filter_by(user_id=user_id, email=email, provider="Dropbox").first()
+    # Short-lived tokens come with expires_in (and a refresh_token when offline access was requested)
+    token_expires_at = expires_at(tokens["expires_in"]) if "expires_in" in tokens else None
     if existing_account:
         existing_account.access_token = tokens["access_token"]
+        existing_account.refresh_token = tokens.get("refresh_token", existing_account.refresh_token)
+        existing_account.token_expires_at = token_expires_at
         existing_account.last_synced = datetime.utcnow()
+        account = existing_account
     else:
-        new_account = CloudStorageAccount(
+        account = CloudStorageAccount(
             user_id=user_id,
             provider="Dropbox",
             email=email,
             permissions="Read files, Search files",  # Adjust permissions as needed
             access_token=tokens["access_token"],
+            refresh_token=tokens.get("refresh_token"),
+            token_expires_at=token_expires_at,
             last_synced=datetime.utcnow()
         )
-        db.session.add(new_account)
+        db.session.add(account)
 
     db.session.commit()
+    token_cache.put(account.id, account.provider, account.access_token, account.token_expires_at)
     frontend_redirect_url = f"{FRONTEND_REDIRECT_URI}?status=success&email={email}"
     return redirect(frontend_redirect_url)
 
 # --------------------------
-# Fetch Connected Cloud Storage Accounts & Refresh Tokens
+# Fetch Connected Cloud Storage Accounts
 # --------------------------
 @cloud_storage_bp.route("/cloud-accounts/<user_id>", methods=["GET"])
 def get_cloud_accounts(user_id):
+    """List linked accounts. Tokens are kept fresh by the background refresher, not on page load."""
     try:
+        token_cache.start(current_app._get_current_object())
+
         accounts = CloudStorageAccount.query.filter_by(user_id=user_id).all()
         if not accounts:
             return jsonify({"message": "No cloud accounts found"}), 404
 
-        updated_accounts = []
-        for account in accounts:
-            if account.provider == "Google Drive":
-                new_access_token = refresh_access_token(account.refresh_token)
-                if new_access_token:
-                    account.access_token = new_access_token
-                    account.last_synced = datetime.utcnow()
-                    db.session.commit()
-            elif account.provider == "Dropbox":
-                new_access_token = refresh_dropbox_access_token(account.refresh_token)
-                if new_access_token:
-                    account.access_token = new_access_token
-                    account.last_synced = datetime.utcnow()
-                    db.session.commit()
-            # OneDrive removed
-
-            updated_accounts.append(account.to_dict())
-
-        return jsonify(updated_accounts), 200
+        return jsonify([account.to_dict() for account in accounts]), 200
 
     except Exception as e:
         print(f"Error fetching cloud accounts: {e}")
@@ -235,12 +200,17 @@ def delete_cloud_account(account_id):
         if not account:
             return jsonify({"error": "Account not found"}), 404
 
-        # Delete all files associated with this cloud account
+        # Delete all files associated with this cloud account (and, through the outbox, their search documents)
+        removed = [filepath for (filepath,) in db.session.query(IndexedFile.filepath).filter_by(account_id=account_id)]
         IndexedFile.query.filter_by(account_id=account_id).delete()
+        enqueue_outbox(db.session, removed)
 
         # Delete the cloud account itself
         db.session.delete(account)
         db.session.commit()
+        notify_outbox(es_writer)
+        google_clients.evict(account_id)
+        token_cache.evict(account_id)
 
         return jsonify({"message": "Cloud account and related indexed files deleted successfully!"}), 200
 
@@ -0,0 +1,54 @@
+import os
+import pickle
+import hashlib
+import logging
+
+CRAWL_SNAPSHOT_DIR = os.getenv("CRAWL_SNAPSHOT_DIR", os.path.join("instance", "crawl_snapshots"))
+
+
+def snapshot_path(user_id, root):
+    """Return the snapshot file for one user's crawl root."""
+    root_hash = hashlib.sha1(root.encode("utf-8", "surrogateescape")).hexdigest()[:16]
+    return os.path.join(CRAWL_SNAPSHOT_DIR, f"{user_id}_{root_hash}.pickle")
+
+
+def load_snapshot(user_id, root, rules_key=None):
+    """Load the directory snapshot saved by the last successful crawl, or None.
+
+    A snapshot recorded under different exclusion rules (`rules_key`) is not reused.
+    """
+    path = snapshot_path(user_id, root)
+    try:
+        with open(path, "rb") as f:
+            snapshot = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.warning(f"Discarding unreadable crawl snapshot {path}: {e}")
+        return None
+    if snapshot.get("root") != root or snapshot.get("rules") != rules_key:
+        return None
+    return snapshot["dirs"]
+
+
+def save_snapshot(user_id, root, dirs, rules_key=None):
+    """Atomically persist the directory snapshot of a crawl."""
+    path = snapshot_path(user_id, root)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump({"root": root, "rules": rules_key, "dirs": dirs}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def delete_snapshot(user_id, root):
+    """Forget the snapshot so the next crawl lists every directory again."""
+    try:
+        os.remove(snapshot_path(user_id, root))
+    except FileNotFoundError:
+        pass
+
+
+def snapshot_entries(dirs):
+    """Map every path recorded in a snapshot to its CrawlEntry."""
+    return {entry.path: entry for _, entries, _ in dirs.values() for entry in entries}
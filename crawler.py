@@ -0,0 +1,258 @@
+import os
+import queue
+import logging
+import threading
+from collections import deque, namedtuple
+
+from exclusions import DEFAULT_EXCLUSIONS
+
+CRAWL_WORKERS = int(os.getenv("CRAWL_WORKERS", "8"))  # Parallel directory readers
+CRAWL_QUEUE_SIZE = 256  # Max listed directories buffered ahead of the consumer
+
+# One record per crawled file or folder, built from the DirEntry the kernel already returned
+CrawlEntry = namedtuple("CrawlEntry", ["name", "path", "is_folder", "size", "mtime", "inode", "device", "depth"])
+
+_DONE = object()
+
+
+def file_extension(name):
+    """Return the lowercase extension of a file name without the dot ('' if none)."""
+    head, dot, ext = name.rpartition(".")
+    return ext.lower() if dot and head else ""
+
+
+class CrawlFrontier:
+    """Directories of a running crawl whose entries have not all reached the consumer yet.
+
+    A directory joins the frontier when it is queued and leaves it once the
+    consumer has taken its last entry; its subdirectories join before that. So
+    at any moment, restarting a crawl from `paths()` repeats no consumed work
+    beyond the directories in flight and misses nothing.
+    """
+
+    def __init__(self):
+        self._paths = set()
+        self._lock = threading.Lock()
+
+    def add(self, paths):
+        with self._lock:
+            self._paths.update(paths)
+
+    def discard(self, path):
+        with self._lock:
+            self._paths.discard(path)
+
+    def paths(self):
+        """The frontier as a list of roots, dropping directories that lie below another one."""
+        with self._lock:
+            paths = set(self._paths)
+        return topmost_paths(paths)
+
+
+def topmost_paths(paths):
+    """Sorted `paths` without the ones that lie below another of them."""
+    paths = set(paths)
+    return sorted(path for path in paths if not _has_ancestor(path, paths))
+
+
+def _has_ancestor(path, paths):
+    parent = os.path.dirname(path)
+    while parent != path:
+        if parent in paths:
+            return True
+        path, parent = parent, os.path.dirname(parent)
+    return False
+
+
+class _Crawl:
+    """Shared state of one parallel crawl: per-worker deques plus a pending-directory counter."""
+
+    def __init__(self, roots, workers, rules, snapshot=None, record=None, failed=None, frontier=None, progress=None):
+        self.workers = max(1, workers)
+        self.rules = rules
+        self.snapshot = snapshot  # {dir path: (mtime, entries, subdir paths)} from the previous crawl
+        self.record = record  # Same shape, filled in by this crawl
+        self.failed = failed  # Directories that could not be listed
+        self.frontier = frontier
+        self.progress = progress
+        if frontier is not None:
+            frontier.add(roots)
+        self.deques = [deque() for _ in range(self.workers)]
+        for i, root in enumerate(roots):
+            self.deques[i % self.workers].append((root, rules.depth(root)))
+        self.pending = len(roots)  # Directories queued or being listed
+        self.cond = threading.Condition()
+        self.out = queue.Queue(maxsize=CRAWL_QUEUE_SIZE)
+        self.stopped = threading.Event()
+
+    def _take(self, index):
+        """Pop from our own deque (newest first), otherwise steal the oldest directory of another worker."""
+        try:
+            return self.deques[index].pop()
+        except IndexError:
+            pass
+        for offset in range(1, self.workers):
+            try:
+                return self.deques[(index + offset) % self.workers].popleft()
+            except IndexError:
+                continue
+        return None
+
+    def _next(self, index):
+        while not self.stopped.is_set():
+            work = self._take(index)
+            if work is not None:
+                return work
+            with self.cond:
+                if self.pending == 0:
+                    return None
+                self.cond.wait(0.05)
+        return None
+
+    def _emit(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.out.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _list(self, path, depth):
+        """List one directory, or reuse the previous listing if the directory mtime has not moved."""
+        if self.snapshot is None and self.record is None:
+            entries, subdirs = self._scan(path, depth)
+            return entries or [], subdirs
+        try:
+            mtime = os.lstat(path).st_mtime
+        except OSError:
+            if self.failed is not None:
+                self.failed.append(path)
+            return [], []
+        previous = self.snapshot.get(path) if self.snapshot else None
+        if previous is not None and previous[0] == mtime:
+            entries, subdirs = self._restat(previous[1]), previous[2]
+        else:
+            entries, subdirs = self._scan(path, depth)
+            if entries is None:
+                return [], []  # Not recorded, so the next crawl lists it again
+            subdirs = [subdir for subdir, _ in subdirs]
+        if self.record is not None:
+            self.record[path] = (mtime, entries, subdirs)
+        return entries, [(subdir, depth + 1) for subdir in subdirs]
+
+    def _restat(self, entries):
+        """Refresh the size and mtime of replayed files; editing a file in place does not touch its directory."""
+        fresh = []
+        for entry in entries:
+            if not entry.is_folder:
+                try:
+                    st = os.lstat(entry.path)
+                except OSError:
+                    continue  # Vanished since the directory was last listed
+                if (st.st_size, st.st_mtime, st.st_ino) != (entry.size, entry.mtime, entry.inode):
+                    if self.rules.skip_file(entry.name, entry.path, st.st_size):
+                        continue
+                    entry = entry._replace(size=st.st_size, mtime=st.st_mtime, inode=st.st_ino, device=st.st_dev)
+            fresh.append(entry)
+        return fresh
+
+    def _scan(self, path, depth):
+        """Read one directory with os.scandir, returning its entries (None if unreadable) and subdirectories."""
+        rules = self.rules
+        descend = rules.descend(depth + 1)
+        entries, subdirs = [], []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    name = entry.name
+                    try:
+                        is_folder = entry.is_dir()
+                        if is_folder and rules.skip_dir(name, entry.path):
+                            continue  # Pruned: the subtree is never listed
+                        st = entry.stat(follow_symlinks=False)
+                        if not is_folder and rules.skip_file(name, entry.path, st.st_size):
+                            continue
+                        if is_folder and descend and not entry.is_symlink():
+                            subdirs.append((entry.path, depth + 1))
+                    except OSError:
+                        continue  # Vanished or unreadable between listing and stat
+                    entries.append(CrawlEntry(name, entry.path, is_folder, st.st_size, st.st_mtime,
+                                              st.st_ino, st.st_dev, depth + 1))
+        except OSError as e:
+            logging.debug(f"Skipping unreadable directory {path}: {e}")
+            if self.failed is not None:
+                self.failed.append(path)
+            return None, []
+        return entries, subdirs
+
+    def run_worker(self, index):
+        try:
+            while True:
+                work = self._next(index)
+                if work is None:
+                    break
+                entries, subdirs = self._list(*work)
+                if self.progress is not None:
+                    self.progress.add("dirs_scanned")
+                if self.frontier is not None:
+                    self.frontier.add(subdir for subdir, _ in subdirs)
+                self.deques[index].extend(subdirs)
+                with self.cond:
+                    self.pending += len(subdirs) - 1
+                    self.cond.notify_all()
+                if entries or self.frontier is not None:
+                    self._emit((work[0], entries))
+        finally:
+            self._emit(_DONE)
+
+
+def crawl(roots, workers=None, rules=DEFAULT_EXCLUSIONS, snapshot=None, record=None, failed=None, frontier=None,
+          progress=None):
+    """Yield a CrawlEntry for every file and folder below `roots`, listing directories in parallel.
+
+    Subdirectories are spread over a bounded pool of threads; each worker keeps
+    its own deque and idle workers steal from the others. Output is buffered in a
+    bounded queue so a slow consumer throttles the crawl instead of growing memory.
+    Roots themselves are not yielded. `rules` (ExclusionRules) prune directories
+    before they are listed and filter files.
+
+    With `snapshot` (the `record` of an earlier crawl), a directory whose mtime is
+    unchanged is not listed again: its previous entries are replayed with their
+    files and subdirectories re-stat'ed, so files modified in place (which do not
+    bump their parent's mtime) are replayed with their new size and mtime. Pass an
+    empty dict as `record` to collect the snapshot for the next run.
+
+    Directories that cannot be listed are appended to `failed` (if given), so
+    callers can tell "gone" apart from "unreadable right now".
+
+    With a `frontier` (CrawlFrontier), the directories still to be consumed are
+    tracked as the crawl goes, so an interrupted crawl can be checkpointed and
+    later resumed by crawling `frontier.paths()`. Listed directories are counted
+    as "dirs_scanned" on `progress` (a ProgressCounters), if given.
+    """
+    if isinstance(roots, str):
+        roots = [roots]
+    state = _Crawl([os.path.abspath(root) for root in roots], workers or CRAWL_WORKERS, rules,
+                   snapshot, record, failed, frontier, progress)
+    threads = [
+        threading.Thread(target=state.run_worker, args=(i,), daemon=True, name=f"crawler-{i}")
+        for i in range(state.workers)
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        finished = 0
+        while finished < len(threads):
+            batch = state.out.get()
+            if batch is _DONE:
+                finished += 1
+                continue
+            path, entries = batch
+            yield from entries
+            if frontier is not None:
+                frontier.discard(path)
+    finally:
+        state.stopped.set()
+        with state.cond:
+            state.cond.notify_all()
@@ -0,0 +1,174 @@
+import logging
+import threading
+from collections import defaultdict
+
+from flask import current_app
+from sqlalchemy import select
+
+from models import db, IndexedFile, FileSizeGroup
+from hashing import cached_hash, schedule_hashing, HASH_MAX_FILE_SIZE
+
+DUPLICATE_STORAGE_TYPES = ("local", "google_drive", "dropbox")  # Also listed in the file_size_group triggers
+DUPLICATE_FETCH_SIZE = 1000
+
+duplicate_cache = {}  # user_id -> {size: (signature, [[file ids], ...])}
+duplicate_cache_lock = threading.Lock()
+
+
+def _candidates(user_id):
+    return (
+        IndexedFile.user_id == user_id,
+        IndexedFile.is_folder.is_(False),
+        IndexedFile.size > 0,
+        IndexedFile.storage_type.in_(DUPLICATE_STORAGE_TYPES),
+    )
+
+
+def size_signatures(session, user_id):
+    """{size: signature} for each file size shared by 2+ files.
+
+    Read from file_size_group, which triggers keep current: the signature changes whenever a
+    file of that size is added, removed, modified or hashed, so unchanged size groups can be
+    served from the cache.
+    """
+    rows = session.execute(
+        select(FileSizeGroup.size, FileSizeGroup.version)
+        .where(FileSizeGroup.user_id == user_id, FileSizeGroup.file_count > 1)
+    )
+    return dict(rows.all())
+
+
+def _local_keys(file, group, partials, missing):
+    """Content keys of a local file, using only cached hashes, and only when some other member could match.
+
+    Hashes not cached yet are added to `missing` ({algorithm: paths}) for background hashing.
+    """
+    keys = set()
+    has_dropbox = any(other.storage_type == "dropbox" for other in group)
+    has_drive = any(other.storage_type == "google_drive" for other in group)
+    partial = partials.get(file.id)
+    local_partial_match = partial is not None and sum(1 for p in partials.values() if p == partial) > 1
+    hashable = file.size <= HASH_MAX_FILE_SIZE  # Bigger files are never hashed, so cannot be matched
+
+    if file.content_hash:
+        keys.add(file.content_hash)
+    elif (has_dropbox or local_partial_match) and hashable:
+        file.content_hash = cached_hash(file.filepath)
+        if file.content_hash:
+            keys.add(file.content_hash)
+        else:
+            missing["content"].add(file.filepath)
+    if has_drive and hashable:
+        digest = cached_hash(file.filepath, algorithm="md5")
+        if digest:
+            keys.add(digest)
+        else:
+            missing["md5"].add(file.filepath)
+    return keys
+
+
+def resolve_size_group(group, missing):
+    """Split files of equal size into groups of identical content. Returns lists of file ids.
+
+    Local files whose hashes (partial or full) are not cached yet are left out and
+    added to `missing`; no file is read here.
+    """
+    local = [file for file in group if file.storage_type == "local"]
+    partials = {}  # file id -> cached partial hash (None until the background hashing computed it)
+    if any(not file.content_hash for file in local):
+        for file in local:
+            try:
+                partials[file.id] = cached_hash(file.filepath, algorithm="partial")
+            except OSError:
+                continue
+            if partials[file.id] is None and file.size <= HASH_MAX_FILE_SIZE:
+                missing["partial"].add(file.filepath)
+
+    # Union-find over content keys: files sharing any key are identical
+    parent = {file.id: file.id for file in group}
+
+    def find(file_id):
+        while parent[file_id] != file_id:
+            parent[file_id] = parent[parent[file_id]]
+            file_id = parent[file_id]
+        return file_id
+
+    owner = {}
+    for file in group:
+        if file.storage_type == "local":
+            if file.id not in partials and not file.content_hash:
+                continue  # Unreadable
+            try:
+                keys = _local_keys(file, group, partials, missing)
+            except OSError:
+                continue
+        elif file.storage_type == "dropbox":
+            keys = {file.content_hash or file.mime_type} - {None}
+        else:
+            keys = {file.content_hash} - {None}
+        for key in keys:
+            if key in owner:
+                parent[find(file.id)] = find(owner[key])
+            else:
+                owner[key] = file.id
+
+    members = defaultdict(list)
+    for file in group:
+        members[find(file.id)].append(file.id)
+    return [ids for ids in members.values() if len(ids) > 1]
+
+
+def find_duplicates(user_id):
+    """Return duplicate groups (lists of IndexedFile) for the user, recomputing only changed size groups."""
+    session = db.session
+    signatures = size_signatures(session, user_id)
+
+    with duplicate_cache_lock:
+        cached = duplicate_cache.get(user_id, {})
+    stale = [size for size, signature in signatures.items()
+             if cached.get(size, (None,))[0] != signature]
+
+    fresh = {size: (signatures[size], groups) for size, (signature, groups) in cached.items()
+             if size in signatures and size not in stale}
+    missing = {"partial": set(), "content": set(), "md5": set()}  # Hashes to compute in the background
+    waiting = set()  # Sizes resolved without some of their members' hashes
+    for start in range(0, len(stale), DUPLICATE_FETCH_SIZE):
+        sizes = stale[start:start + DUPLICATE_FETCH_SIZE]
+        by_size = defaultdict(list)
+        for file in session.scalars(select(IndexedFile).where(*_candidates(user_id), IndexedFile.size.in_(sizes))):
+            by_size[file.size].append(file)
+        for size, group in by_size.items():
+            pending = sum(map(len, missing.values()))
+            fresh[size] = (signatures[size], resolve_size_group(group, missing))
+            if sum(map(len, missing.values())) > pending:
+                waiting.add(size)
+        session.commit()  # Keep content hashes found in the cache
+
+    # Storing cached hashes changed some signatures; store the new ones so the next call is a cache hit.
+    # Sizes still waiting for hashes get no signature, so they are rescanned once the hashes exist.
+    if stale:
+        signatures = size_signatures(session, user_id)
+        fresh = {size: (None if size in waiting else signatures.get(size), groups)
+                 for size, (_, groups) in fresh.items()}
+    with duplicate_cache_lock:
+        duplicate_cache[user_id] = fresh
+    if waiting:
+        schedule_hashing(current_app._get_current_object(), user_id,
+                         paths={"partial": missing["partial"], "md5": missing["md5"]})
+
+    ids = [file_id for _, groups in fresh.values() for group in groups for file_id in group]
+    files = {}
+    for start in range(0, len(ids), DUPLICATE_FETCH_SIZE):
+        for file in session.scalars(select(IndexedFile).where(IndexedFile.id.in_(ids[start:start + DUPLICATE_FETCH_SIZE]))):
+            files[file.id] = file
+
+    result = []
+    for size, (_, groups) in fresh.items():
+        for group in groups:
+            members = [files[file_id] for file_id in group if file_id in files]
+            if len(members) > 1:
+                result.append(members)
+    result.sort(key=lambda members: members[0].size * (len(members) - 1), reverse=True)
+    logging.info(f"Found {len(result)} duplicate groups for user {user_id} ({len(stale)} size groups rescanned, "
+                 f"{len(waiting)} waiting for hashes)")
+    return result
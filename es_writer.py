@@ -0,0 +1,220 @@
+import os
+import json
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from elasticsearch import helpers, ApiError, ConnectionError, ConnectionTimeout
+from sqlalchemy import select, delete
+from sqlalchemy.orm import sessionmaker
+
+from models import db, EsDeadLetter
+
+ES_BULK_CHUNK_SIZE = int(os.getenv("ES_BULK_CHUNK_SIZE", "500"))  # Actions per bulk request
+ES_BULK_MAX_BYTES = int(os.getenv("ES_BULK_MAX_BYTES", str(10 * 1024 ** 2)))  # Payload per bulk request
+ES_BULK_MAX_CONCURRENCY = int(os.getenv("ES_BULK_MAX_CONCURRENCY", "4"))  # Bulk requests in flight at most
+ES_BULK_MAX_RETRIES = int(os.getenv("ES_BULK_MAX_RETRIES", "5"))  # Retries of rejected actions before dead-lettering
+ES_BULK_INITIAL_BACKOFF = 1.0  # Seconds, doubled per retry
+ES_BULK_MAX_BACKOFF = 60.0
+DEAD_LETTER_REPLAY_SIZE = 1000  # Dead letters re-sent per replay
+
+
+class BulkResult:
+    """Outcome of one EsBulkWriter.write call."""
+
+    def __init__(self):
+        self.acknowledged = 0
+        self.ignored = 0  # Deletes/updates of documents that do not exist
+        self.dead_lettered = 0
+
+    def merge(self, other):
+        self.acknowledged += other.acknowledged
+        self.ignored += other.ignored
+        self.dead_lettered += other.dead_lettered
+
+
+class _Concurrency:
+    """AIMD limit on bulk requests in flight: +1 after a window of clean requests, halved on a rejection."""
+
+    def __init__(self, maximum):
+        self.maximum = max(1, maximum)
+        self.limit = max(1, self.maximum // 2)
+        self.in_flight = 0
+        self.clean = 0
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        with self.cond:
+            while self.in_flight >= self.limit:
+                self.cond.wait()
+            self.in_flight += 1
+
+    def release(self, rejected):
+        with self.cond:
+            self.in_flight -= 1
+            if rejected:
+                self.limit = max(1, self.limit // 2)
+                self.clean = 0
+            else:
+                self.clean += 1
+                if self.clean >= self.limit and self.limit < self.maximum:
+                    self.limit += 1
+                    self.clean = 0
+            self.cond.notify_all()
+
+
+def _backoff(attempt):
+    delay = min(ES_BULK_MAX_BACKOFF, ES_BULK_INITIAL_BACKOFF * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class EsBulkWriter:
+    """Shared, back-pressured bulk writer for every Elasticsearch write path.
+
+    Actions (in `helpers.bulk` format) are consumed lazily and cut into chunks
+    by count and by payload bytes. Chunks are sent on a small thread pool whose
+    concurrency adapts to the cluster: 429 rejections halve it, clean requests
+    grow it back. The caller blocks while the limit is reached, so a fast
+    producer never piles chunks up in memory. Rejected and unreachable actions
+    are retried with jittered exponential backoff; actions that still fail, or
+    fail for good (mapping errors), go to the es_dead_letter table instead of
+    being dropped, and `replay_dead_letters` re-sends them later.
+    """
+
+    def __init__(self, es, chunk_size=ES_BULK_CHUNK_SIZE, max_bytes=ES_BULK_MAX_BYTES,
+                 max_concurrency=ES_BULK_MAX_CONCURRENCY, max_retries=ES_BULK_MAX_RETRIES):
+        self.es = es
+        self.chunk_size = chunk_size
+        self.max_bytes = max_bytes
+        self.max_retries = max_retries
+        self.concurrency = _Concurrency(max_concurrency)
+        self.pool = ThreadPoolExecutor(max_workers=self.concurrency.maximum, thread_name_prefix="es-bulk")
+
+    def write(self, actions):
+        """Send actions, returning a BulkResult once every chunk is acknowledged or dead-lettered.
+
+        Must run inside an app context when documents may be dead-lettered.
+        """
+        result, futures = BulkResult(), []
+        chunk, chunk_bytes = [], 0
+        for action in actions:
+            line, source = helpers.expand_action(action)
+            size = len(json.dumps(line)) + (len(json.dumps(source, default=str)) if source is not None else 0) + 2
+            if chunk and (len(chunk) >= self.chunk_size or chunk_bytes + size > self.max_bytes):
+                futures.append(self._submit(chunk))
+                chunk, chunk_bytes = [], 0
+            chunk.append((line, source))
+            chunk_bytes += size
+        if chunk:
+            futures.append(self._submit(chunk))
+
+        failures = []
+        for future in futures:
+            chunk_result, chunk_failures = future.result()
+            result.merge(chunk_result)
+            failures.extend(chunk_failures)
+        if failures:
+            self._dead_letter(failures)
+            result.dead_lettered += len(failures)
+        return result
+
+    def _submit(self, chunk):
+        self.concurrency.acquire()  # Back-pressure: wait for a free slot before building more
+        return self.pool.submit(self._send, chunk)
+
+    def _send(self, chunk):
+        result, failures = BulkResult(), []
+        pending, attempt, rejected = chunk, 0, False
+        try:
+            while pending:
+                body = []
+                for line, source in pending:
+                    body.append(line)
+                    if source is not None:
+                        body.append(source)
+                try:
+                    items = self.es.bulk(operations=body)["items"]
+                except (ConnectionError, ConnectionTimeout, ApiError) as e:
+                    status = getattr(e, "status_code", None) if isinstance(e, ApiError) else None
+                    if isinstance(e, ApiError) and status != 429:
+                        failures.extend((line, source, status, str(e)) for line, source in pending)
+                        break
+                    rejected = True
+                    if attempt >= self.max_retries:
+                        failures.extend((line, source, status, str(e)) for line, source in pending)
+                        break
+                    time.sleep(_backoff(attempt))
+                    attempt += 1
+                    continue
+
+                retry = []
+                for (line, source), item in zip(pending, items):
+                    op_type, info = next(iter(item.items()))
+                    status = info.get("status", 500)
+                    if 200 <= status < 300:
+                        result.acknowledged += 1
+                    elif status == 404 and op_type in ("delete", "update"):
+                        result.ignored += 1
+                    elif status == 429 and attempt < self.max_retries:
+                        retry.append((line, source))
+                    else:
+                        failures.append((line, source, status, json.dumps(info.get("error"), default=str)))
+                if retry:
+                    rejected = True
+                    time.sleep(_backoff(attempt))
+                    attempt += 1
+                pending = retry
+        finally:
+            self.concurrency.release(rejected)
+        return result, failures
+
+    def _dead_letter(self, failures):
+        logging.error(f"❌ {len(failures)} Elasticsearch action(s) failed; saved to the dead-letter table")
+        session = sessionmaker(bind=db.engine)()
+        try:
+            for line, source, status, error in failures:
+                op_type, meta = next(iter(line.items()))
+                session.add(EsDeadLetter(
+                    op_type=op_type, index=meta.get("_index"), doc_id=meta.get("_id"),
+                    action=json.dumps({"line": line, "source": source}, default=str),
+                    status=status, error=(error or "")[:2000],
+                ))
+            session.commit()
+        finally:
+            session.close()
+
+    def replay_dead_letters(self, limit=DEAD_LETTER_REPLAY_SIZE):
+        """Re-send dead-lettered actions, oldest first. Ones that fail again are dead-lettered anew."""
+        session = sessionmaker(bind=db.engine)()
+        try:
+            letters = session.execute(
+                select(EsDeadLetter.id, EsDeadLetter.action).order_by(EsDeadLetter.id).limit(limit)
+            ).all()
+        finally:
+            session.close()
+        if not letters:
+            return BulkResult()
+
+        actions = []
+        for _, action in letters:
+            action = json.loads(action)
+            (op_type, meta), source = next(iter(action["line"].items())), action["source"]
+            replayed = dict(meta, _op_type=op_type)
+            if op_type in ("index", "create"):
+                replayed["_source"] = source
+            elif op_type == "update":
+                replayed.update(source)
+            actions.append(replayed)
+        result = self.write(actions)
+
+        session = sessionmaker(bind=db.engine)()
+        try:
+            session.execute(delete(EsDeadLetter).where(EsDeadLetter.id.in_([row_id for row_id, _ in letters])))
+            session.commit()
+        finally:
+            session.close()
+        logging.info(f"Replayed {len(actions)} dead-lettered Elasticsearch action(s): "
+                     f"{result.acknowledged} acknowledged, {result.dead_lettered} failed again")
+        return result
@@ -0,0 +1,238 @@
+import os
+import re
+import time
+import hashlib
+import threading
+
+from models import db, ExclusionRule
+
+EXCLUDE_DIRS = {"AppData","node_modules", ".git", ".Trash", "System Volume Information",".venv",".gradle", "Library", ".cache", ".config", ".idea", ".vscode",
+                "__pycache__", "target", "dist"}
+EXCLUDE_FILES = {".DS_Store", "thumbs.db"}
+
+# Built-in rules every crawl starts from; stored rules add to them ("!dist/" re-includes a default)
+DEFAULT_GLOBS = [f"{name}/" for name in sorted(EXCLUDE_DIRS)] + sorted(EXCLUDE_FILES) + [".*"]
+
+RULE_KINDS = ("glob", "max_size", "allow_ext", "deny_ext", "max_depth")
+EXCLUSION_CACHE_SECONDS = float(os.getenv("EXCLUSION_CACHE_SECONDS", "60"))  # Stored rules are re-read this often
+
+_cache = {}  # (user_id, root) -> (loaded at, ExclusionRules)
+_cache_lock = threading.Lock()
+
+
+def glob_to_regex(pattern):
+    """Translate a .gitignore-style glob ("**" spans directories, "*" and "?" do not) into a regex."""
+    out, i = [], 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            out.append(".*")
+            i += 2
+            continue
+        if c == "*":
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            end = pattern.find("]", i + 1)
+            if end == -1:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1:end]
+                out.append("[" + ("^" + body[1:] if body.startswith("!") else body) + "]")
+                i = end
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "".join(out)
+
+
+class _Patterns:
+    """One set of globs, compiled to set lookups for plain names and one alternation per pattern shape."""
+
+    def __init__(self, globs):
+        names = {True: set(), False: set()}   # dirs only? -> literal names
+        name_res = {True: [], False: []}       # dirs only? -> basename regexes
+        path_res = {True: [], False: []}       # dirs only? -> root-relative path regexes
+        for glob in globs:
+            dirs_only = glob.endswith("/")
+            glob = glob.rstrip("/")
+            if not glob:
+                continue
+            if "/" in glob:
+                path_res[dirs_only].append(glob_to_regex(glob.lstrip("/")))
+            elif any(c in glob for c in "*?["):
+                name_res[dirs_only].append(glob_to_regex(glob))
+            else:
+                names[dirs_only].add(glob)
+        self.names_any, self.names_dir = names[False], names[True]
+        self.name_any, self.name_dir = self._compile(name_res[False]), self._compile(name_res[True])
+        # File names match case-insensitively ("thumbs.db" excludes Thumbs.db); directory names do not
+        self.names_file = {name.lower() for name in names[False]}
+        self.name_file = self._compile(name_res[False], re.IGNORECASE)
+        self.path_any, self.path_dir = self._compile(path_res[False]), self._compile(path_res[True])
+        self.needs_path = bool(path_res[False] or path_res[True])
+
+    @staticmethod
+    def _compile(regexes, flags=0):
+        return re.compile("|".join(f"(?:{regex})" for regex in regexes) + r"\Z", flags) if regexes else None
+
+    def match(self, name, relative, is_dir):
+        if is_dir:
+            if name in self.names_any or name in self.names_dir:
+                return True
+            if self.name_any is not None and self.name_any.match(name):
+                return True
+            if self.name_dir is not None and self.name_dir.match(name):
+                return True
+        else:
+            if name.lower() in self.names_file:
+                return True
+            if self.name_file is not None and self.name_file.match(name):
+                return True
+        if relative is not None:
+            if self.path_any is not None and self.path_any.match(relative):
+                return True
+            if is_dir and self.path_dir is not None and self.path_dir.match(relative):
+                return True
+        return False
+
+
+class ExclusionRules:
+    """Exclusion rules for one crawl root, compiled once and matched per directory entry.
+
+    Globs follow .gitignore: a pattern without "/" matches a name at any depth,
+    one containing "/" is anchored to the root, a trailing "/" only matches
+    directories and "!pattern" re-includes what an earlier pattern excluded.
+    Excluded directories are dropped before they are listed, so their whole
+    subtree costs nothing. Files can also be filtered by size and extension, and
+    `max_depth` stops the crawl from descending below that many levels.
+    """
+
+    def __init__(self, root, globs=(), max_size=None, allow_ext=(), deny_ext=(), max_depth=None):
+        self.root = os.path.abspath(root)
+        globs = list(globs)
+        self.exclude = _Patterns([glob for glob in globs if not glob.startswith("!")])
+        self.include = _Patterns([glob[1:] for glob in globs if glob.startswith("!")])
+        self.needs_path = self.exclude.needs_path or self.include.needs_path
+        self.max_size = max_size
+        self.allow_ext = {ext.lower().lstrip(".") for ext in allow_ext}
+        self.deny_ext = {ext.lower().lstrip(".") for ext in deny_ext}
+        self.max_depth = max_depth
+        spec = repr((sorted(globs), max_size, sorted(self.allow_ext), sorted(self.deny_ext), max_depth))
+        self.key = hashlib.sha1(spec.encode("utf-8")).hexdigest()  # Changes whenever the rules do
+
+    def _relative(self, path):
+        if not self.needs_path or not path.startswith(self.root.rstrip(os.sep) + os.sep):
+            return None
+        return path[len(self.root):].lstrip(os.sep).replace(os.sep, "/")
+
+    def _excluded(self, name, path, is_dir):
+        relative = self._relative(path)
+        return self.exclude.match(name, relative, is_dir) and not self.include.match(name, relative, is_dir)
+
+    def skip_dir(self, name, path):
+        return self._excluded(name, path, True)
+
+    def skip_file(self, name, path, size=None):
+        if size is not None and self.max_size is not None and size > self.max_size:
+            return True
+        if self.allow_ext or self.deny_ext:
+            head, dot, ext = name.rpartition(".")
+            ext = ext.lower() if dot and head else ""
+            if ext in self.deny_ext or (self.allow_ext and ext not in self.allow_ext):
+                return True
+        return self._excluded(name, path, False)
+
+    def depth(self, path):
+        """Levels between the root and `path` (0 for the root itself or a path outside it)."""
+        relative = os.path.relpath(path, self.root)
+        if relative == "." or relative.startswith(".."):
+            return 0
+        return relative.count(os.sep) + 1
+
+    def descend(self, depth):
+        """Whether a directory `depth` levels below the root is listed."""
+        return self.max_depth is None or depth < self.max_depth
+
+    def excludes_path(self, path):
+        """Check one path (file or folder, possibly gone) the way a crawl from the root would reach it."""
+        relative = os.path.relpath(path, self.root)
+        if relative == "." or relative.startswith(".."):
+            return False
+        parts = relative.split(os.sep)
+        current = self.root
+        for depth, part in enumerate(parts[:-1], start=1):
+            current = os.path.join(current, part)
+            if self.skip_dir(part, current) or not self.descend(depth):
+                return True
+        name = parts[-1]
+        return self.skip_dir(name, path) or self._excluded(name, path, False)
+
+    @classmethod
+    def from_rules(cls, root, rules):
+        """Compile the defaults plus stored ExclusionRule rows (global ones first, then the user's)."""
+        globs, allow_ext, deny_ext = list(DEFAULT_GLOBS), [], []
+        max_size = max_depth = None
+        for rule in sorted(rules, key=lambda rule: (rule.user_id is not None, rule.id or 0)):
+            if rule.kind == "glob":
+                globs.append(rule.value)
+            elif rule.kind == "allow_ext":
+                allow_ext.append(rule.value)
+            elif rule.kind == "deny_ext":
+                deny_ext.append(rule.value)
+            elif rule.kind == "max_size":
+                max_size = int(rule.value) if max_size is None else min(max_size, int(rule.value))
+            elif rule.kind == "max_depth":
+                max_depth = int(rule.value) if max_depth is None else min(max_depth, int(rule.value))
+        return cls(root, globs, max_size, allow_ext, deny_ext, max_depth)
+
+
+DEFAULT_EXCLUSIONS = ExclusionRules(os.sep, DEFAULT_GLOBS)
+
+
+def validate_rule(kind, value):
+    """Return an error message for an invalid rule, or None."""
+    if kind not in RULE_KINDS:
+        return f"kind must be one of {', '.join(RULE_KINDS)}"
+    value = str(value or "").strip()
+    if not value:
+        return "value is required"
+    if kind in ("max_size", "max_depth"):
+        if not value.isdigit():
+            return f"{kind} must be a non-negative integer"
+    elif kind == "glob":
+        try:
+            re.compile(glob_to_regex(value.lstrip("!").rstrip("/").lstrip("/")))
+        except re.error as e:
+            return f"Invalid glob: {e}"
+    return None
+
+
+def load_exclusions(user_id, root):
+    """Compiled rules (defaults + global + the user's) for a crawl root, cached for EXCLUSION_CACHE_SECONDS."""
+    root = os.path.abspath(root)
+    key = (str(user_id), root)
+    now = time.monotonic()
+    with _cache_lock:
+        cached = _cache.get(key)
+    if cached is not None and now - cached[0] < EXCLUSION_CACHE_SECONDS:
+        return cached[1]
+    rows = db.session.query(ExclusionRule).filter(
+        (ExclusionRule.user_id == user_id) | (ExclusionRule.user_id.is_(None))
+    ).all()
+    rules = ExclusionRules.from_rules(root, rows)
+    with _cache_lock:
+        _cache[key] = (now, rules)
+    return rules
+
+
+def invalidate_exclusions(user_id=None):
+    """Drop cached rules of one user (or everyone, after a global rule changed)."""
+    with _cache_lock:
+        for key in [key for key in _cache if user_id is None or key[0] == str(user_id)]:
+            del _cache[key]
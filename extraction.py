@@ -0,0 +1,371 @@
+import io
+import os
+import re
+import dbm
+import html
+import time
+import zlib
+import logging
+import threading
+import zipfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from sqlalchemy import select, update, bindparam
+from sqlalchemy.orm import sessionmaker
+
+from models import db, IndexedFile
+from outbox import upsert_action
+
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", "2"))
+EXTRACT_MAX_FILE_SIZE = int(os.getenv("EXTRACT_MAX_FILE_SIZE", str(50 * 1024 ** 2)))  # Bigger files are not read
+EXTRACT_MAX_CHARS = int(os.getenv("EXTRACT_MAX_CHARS", str(1024 ** 2)))  # Text kept per file
+EXTRACT_TIMEOUT = float(os.getenv("EXTRACT_TIMEOUT", "30"))  # Seconds per file
+EXTRACT_DISABLED_TYPES = {t.strip().lower() for t in os.getenv("EXTRACT_DISABLED_TYPES", "").split(",") if t.strip()}
+EXTRACT_BATCH_SIZE = 100  # Files per ES bulk request / DB update
+EXTRACT_CACHE_PATH = os.getenv("EXTRACT_CACHE_PATH", os.path.join("instance", "extract_cache"))
+
+EXTRACTORS = {}  # filetype -> callable(source, deadline) -> str
+
+_pool = None
+_pool_lock = threading.Lock()
+_cache = None
+_cache_lock = threading.Lock()
+
+
+class ExtractionTimeout(Exception):
+    pass
+
+
+def extractor(*filetypes):
+    """Register an extractor for one or more filetypes, unless disabled by EXTRACT_DISABLED_TYPES."""
+    def register(func):
+        for filetype in filetypes:
+            if filetype not in EXTRACT_DISABLED_TYPES:
+                EXTRACTORS[filetype] = func
+        return func
+    return register
+
+
+def _open(source):
+    return io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else open(source, "rb")
+
+
+def _check(deadline):
+    if time.monotonic() > deadline:
+        raise ExtractionTimeout()
+
+
+_TAG_RE = re.compile(r"<[^>]+>")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def _strip_markup(markup):
+    return _SPACE_RE.sub(" ", html.unescape(_TAG_RE.sub(" ", markup))).strip()
+
+
+@extractor("txt", "md", "csv", "tsv", "log", "json", "xml", "yml", "yaml", "ini", "cfg", "toml", "rst", "tex",
+           "py", "js", "ts", "jsx", "tsx", "java", "c", "h", "cpp", "hpp", "cs", "go", "rs", "rb", "php", "sh",
+           "sql", "css", "kt", "swift", "scala", "r", "m")
+def extract_plain_text(source, deadline):
+    with _open(source) as f:
+        data = f.read(EXTRACT_MAX_CHARS * 4)
+    if b"\x00" in data[:8192]:
+        return ""  # Binary content behind a text extension
+    return data.decode("utf-8", errors="replace")
+
+
+@extractor("html", "htm")
+def extract_html(source, deadline):
+    return _strip_markup(extract_plain_text(source, deadline))
+
+
+def _zip_members_text(source, deadline, pattern):
+    parts = []
+    with _open(source) as f, zipfile.ZipFile(f) as archive:
+        for name in sorted(n for n in archive.namelist() if re.fullmatch(pattern, n)):
+            _check(deadline)
+            parts.append(_strip_markup(archive.read(name).decode("utf-8", errors="replace")))
+    return "\n".join(parts)
+
+
+@extractor("docx")
+def extract_docx(source, deadline):
+    return _zip_members_text(source, deadline, r"word/(document|header\d*|footer\d*)\.xml")
+
+
+@extractor("pptx")
+def extract_pptx(source, deadline):
+    return _zip_members_text(source, deadline, r"ppt/slides/slide\d+\.xml")
+
+
+@extractor("xlsx")
+def extract_xlsx(source, deadline):
+    return _zip_members_text(source, deadline, r"xl/sharedStrings\.xml")
+
+
+@extractor("odt", "ods", "odp")
+def extract_opendocument(source, deadline):
+    return _zip_members_text(source, deadline, r"content\.xml")
+
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # PDF extraction is only available where pypdf is installed
+    PdfReader = None
+
+if PdfReader is not None:
+    @extractor("pdf")
+    def extract_pdf(source, deadline):
+        parts, size = [], 0
+        with _open(source) as f:
+            for page in PdfReader(f).pages:
+                _check(deadline)
+                text = page.extract_text() or ""
+                parts.append(text)
+                size += len(text)
+                if size >= EXTRACT_MAX_CHARS:
+                    break
+        return "\n".join(parts)
+
+
+def extract_text(filetype, source):
+    """Extract plain text from a file path or bytes. Runs in pool worker processes."""
+    func = EXTRACTORS.get(filetype)
+    if func is None:
+        return ""
+    text = func(source, time.monotonic() + EXTRACT_TIMEOUT)
+    return text[:EXTRACT_MAX_CHARS]
+
+
+def can_extract(filetype, size):
+    return filetype in EXTRACTORS and size <= EXTRACT_MAX_FILE_SIZE
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _recycle_pool(pool):
+    """Replace `pool` after one of its workers hung, killing its processes so they stop holding a slot.
+
+    Work still running on the old pool fails with BrokenProcessPool.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    processes = list((pool._processes or {}).values())  # The executor has no public way to stop a busy worker
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.terminate()
+
+
+def _cache_get(digest):
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            os.makedirs(os.path.dirname(EXTRACT_CACHE_PATH), exist_ok=True)
+            _cache = dbm.open(EXTRACT_CACHE_PATH, "c")
+        value = _cache.get(digest.encode())
+    return zlib.decompress(value).decode("utf-8") if value is not None else None
+
+
+def _cache_put(digest, text):
+    with _cache_lock:
+        _cache[digest.encode()] = zlib.compress(text.encode("utf-8"))
+
+
+def extract_cached(filetype, source, digest=None):
+    """Extract text through the pool under the time budget, reusing cached text for a known content hash.
+
+    Returns None when the file could not be extracted (timeout, corrupt file).
+    """
+    if digest is not None:
+        text = _cache_get(digest)
+        if text is not None:
+            return text
+    pool = _get_pool()
+    future = pool.submit(extract_text, filetype, source)
+    try:
+        text = future.result(timeout=EXTRACT_TIMEOUT + 5)
+    except FutureTimeoutError:
+        logging.warning(f"⏱️ Text extraction hung on a {filetype} file; restarting the extraction pool")
+        _recycle_pool(pool)
+        return None
+    except ExtractionTimeout:
+        logging.warning(f"⏱️ Text extraction timed out for a {filetype} file")
+        return None
+    except Exception as e:
+        logging.warning(f"Text extraction failed for a {filetype} file: {str(e)}")
+        return None
+    if digest is not None:
+        _cache_put(digest, text)
+    return text
+
+
+def extract_pending_files(user_id, writer):
+    """Index text content of the user's hashed local files whose current content has not been extracted yet.
+
+    `writer` is the shared EsBulkWriter. EXTRACT_WORKERS files are extracted at
+    once. A file whose worker hangs past the time budget is given up on (the pool
+    is restarted to free the worker) and left unmarked, so the next run retries it.
+    """
+    if not EXTRACTORS:
+        return 0
+    Session = sessionmaker(bind=db.engine)
+    reader, writer_session = Session(), Session()
+    table = IndexedFile.__table__
+    pool = _get_pool()
+    inflight = {}  # future -> ((row id, filepath, filetype, content hash, filename), deadline)
+    extracted = 0
+    batch = []
+
+    def flush():
+        nonlocal extracted
+        if not batch:
+            return
+        # Upserts, so a document the relay has not created yet gets its text too
+        result = writer.write(
+            _content_action(user_id, {"filepath": filepath, "filename": filename, "filetype": filetype,
+                                      "storage_type": "local"}, text)
+            for (_, filepath, filetype, _, filename), text in batch if text
+        )
+        if result.dead_lettered:
+            # Not known which ones failed: leave the batch unmarked, so it is redone (from cache) next run
+            logging.warning(f"⚠️ Extracted text of {len(batch)} files was not indexed; it is retried on the next run")
+        else:
+            writer_session.execute(
+                update(table).where(table.c.id == bindparam("b_id")).values(extracted_hash=bindparam("b_hash")),
+                [{"b_id": row_id, "b_hash": digest} for (row_id, _, _, digest, _), _ in batch],
+            )
+            writer_session.commit()
+            extracted += len(batch)
+        batch.clear()
+
+    def done(row, text):
+        batch.append((row, text))
+        if len(batch) >= EXTRACT_BATCH_SIZE:
+            flush()
+
+    def submit(row):
+        nonlocal pool
+        try:
+            future = pool.submit(extract_text, row[2], row[1])
+        except BrokenProcessPool:  # Restarted by another extraction
+            _recycle_pool(pool)
+            pool = _get_pool()
+            future = pool.submit(extract_text, row[2], row[1])
+        inflight[future] = (row, time.monotonic() + EXTRACT_TIMEOUT + 5)
+
+    def collect(futures):
+        for future in futures:
+            row, _ = inflight.pop(future)
+            try:
+                text = future.result()
+            except (ExtractionTimeout, BrokenProcessPool):
+                logging.warning(f"⏱️ Text extraction of {row[1]} did not finish; it is retried on the next run")
+                continue
+            except Exception as e:
+                logging.warning(f"Text extraction failed for {row[1]}: {str(e)}")
+                text = ""  # Marked as done so a corrupt file is not retried until its content changes
+            else:
+                _cache_put(row[3], text)
+            done(row, text)
+
+    def wait_for_one():
+        nonlocal pool
+        timeout = max(0.0, min(deadline for _, deadline in inflight.values()) - time.monotonic())
+        collect(wait(inflight, timeout=timeout, return_when=FIRST_COMPLETED).done)
+        now = time.monotonic()
+        hung = [future for future, (_, deadline) in inflight.items() if deadline <= now]
+        if not hung:
+            return
+        for future in hung:
+            row, _ = inflight.pop(future)
+            logging.warning(f"⏱️ Text extraction hung on {row[1]}; it is retried on the next run")
+        # Kill the stuck workers, then hand the files that were running beside them to the new pool
+        _recycle_pool(pool)
+        pool = _get_pool()
+        requeued = [row for row, _ in inflight.values()]
+        inflight.clear()
+        for row in requeued:
+            submit(row)
+
+    try:
+        rows = reader.execute(
+            select(IndexedFile.id, IndexedFile.filepath, IndexedFile.filetype, IndexedFile.content_hash,
+                   IndexedFile.filename).where(
+                IndexedFile.user_id == user_id,
+                IndexedFile.storage_type == "local",
+                IndexedFile.content_hash.is_not(None),
+                IndexedFile.extracted_hash.is_distinct_from(IndexedFile.content_hash),
+                IndexedFile.filetype.in_(list(EXTRACTORS)),
+            ),
+            execution_options={"yield_per": EXTRACT_BATCH_SIZE},
+        )
+        for row in rows:
+            row = tuple(row)
+            try:
+                too_big = os.path.getsize(row[1]) > EXTRACT_MAX_FILE_SIZE
+            except OSError:
+                continue
+            cached = None if too_big else _cache_get(row[3])
+            if too_big or cached is not None:
+                done(row, "" if too_big else cached)
+                continue
+            while len(inflight) >= EXTRACT_WORKERS:
+                wait_for_one()
+            submit(row)
+        while inflight:
+            wait_for_one()
+        flush()
+        logging.info(f"✅ Extracted text from {extracted} local files for user {user_id}")
+        return extracted
+
+    except Exception:
+        writer_session.rollback()
+        raise
+
+    finally:
+        reader.close()
+        writer_session.close()
+
+
+def _content_action(user_id, record, text):
+    """Upsert of a file's text into its file_index document, with enough metadata to create the document."""
+    return upsert_action(record["filepath"], {
+        "user_id": user_id,
+        "filename": record["filename"],
+        "filepath": record["filepath"],
+        "filetype": record["filetype"],
+        "storage_type": record["storage_type"],
+        "content": text,
+    })
+
+
+def index_downloaded_content(app, writer, user_id, record, path):
+    """Extract text from a cloud file that was just downloaded in full (spooled to `path`) and index it.
+
+    The text goes into the file's file_index document through `writer` (the shared
+    EsBulkWriter), so it is retried and dead-lettered like any other write. `path`
+    is removed afterwards.
+    """
+    try:
+        if not can_extract(record["filetype"], os.path.getsize(path)):
+            return
+        text = extract_cached(record["filetype"], path)
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    if not text:
+        return
+    with app.app_context():
+        writer.write([_content_action(user_id, record, text)])
@@ -1,34 +1,55 @@
 import os, io, logging
+import hashlib
+import tempfile
+import stat
 import logging
-from googleapiclient.http import MediaIoBaseDownload
+from googleapiclient.errors import HttpError
 import threading
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import db, IndexedFile
-from elasticsearch import Elasticsearch, helpers
+from elasticsearch import Elasticsearch
 from flask_cors import CORS
 from flask import current_app
 import time
-from flask import Blueprint, jsonify, send_file, current_app, request as flask_request
+from flask import Blueprint, Response, jsonify, send_file, current_app, request as flask_request
+import requests
 from sqlalchemy.orm import scoped_session, sessionmaker
 from flask import send_file
-from googleapiclient.discovery import build
-from googleapiclient.discovery import build_from_document
 import platform , subprocess
-from googleapiclient.discovery import build
-from google.oauth2.credentials import Credentials
 from datetime import datetime
+from collections import Counter
 import dropbox
 from dropbox.exceptions import AuthError
 from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy import select, update, delete, bindparam, or_, case, func, null
 
 import time
-from models import CloudStorageAccount
+from models import CloudStorageAccount, ExclusionRule
 import psutil
+from crawler import crawl, file_extension, topmost_paths, CrawlEntry, CrawlFrontier
+from exclusions import DEFAULT_EXCLUSIONS, load_exclusions, invalidate_exclusions, validate_rule
+from crawl_snapshot import load_snapshot, save_snapshot, delete_snapshot, snapshot_entries
+from local_watcher import ensure_local_watcher, local_watchers
+from index_pipeline import BatchPipeline
+from hashing import schedule_hashing, hash_pending_files
+from extraction import extract_pending_files, index_downloaded_content, can_extract, EXTRACT_MAX_FILE_SIZE
+from duplicates import find_duplicates
+from index_jobs import (create_index_job, cancel_index_job, has_active_job, claim_stale_jobs, latest_jobs,
+                        overall_status, JobRun)
+from scheduler import scheduler, sync_scheduler, INTERACTIVE, BACKGROUND
+from rate_limit import rate_limited
+from google_clients import google_clients
+from token_cache import token_cache
+from progress import ProgressCounters
+from es_writer import EsBulkWriter
+from bulk_upsert import bulk_upsert
+from outbox import enqueue_outbox, relay_outbox, notify_outbox, start_outbox_relay
 
 # Elasticsearch Setup
 ELASTICSEARCH_URL = os.getenv("ELASTICSEARCH_URL", "http://localhost:9200")
 es = Elasticsearch([ELASTICSEARCH_URL])
+es_writer = EsBulkWriter(es)  # Shared by every bulk write path
 
 DROPBOX_CLIENT_ID = os.getenv("DROPBOX_CLIENT_ID")
 DROPBOX_CLIENT_SECRET = os.getenv("DROPBOX_CLIENT_SECRET")
@@ -36,31 +57,58 @@ search_bp = Blueprint("search", __name__)
 CORS(search_bp, supports_credentials=True, origins=["http://localhost:5173"])
 
 logging.basicConfig(level=logging.INFO)
-indexing_status = {}
 
 
 AUTO_SYNC_INTERVAL_LOCAL = 30
 AUTO_SYNC_INTERVAL=30
 
-EXCLUDE_DIRS = {"AppData","node_modules", ".git", ".Trash", "System Volume Information",".venv",".gradle", "Library", ".cache", ".config", ".idea", ".vscode"}
-EXCLUDE_FILES = {".DS_Store", "thumbs.db"}
+LOCAL_WATCH_MODE = os.getenv("LOCAL_WATCH_MODE", "watch")  # "watch" (inotify, polling fallback) or "poll"
+KNOWN_PATHS_FETCH_SIZE = 10000  # Rows per server-side cursor fetch when preloading indexed paths
+PREFIX_DELETE_BATCH_SIZE = 500  # Deleted folders matched per DELETE statement
+DROPBOX_LONGPOLL = os.getenv("DROPBOX_LONGPOLL", "false").lower() == "true"  # Sync Dropbox as soon as it changes
+DROPBOX_LONGPOLL_TIMEOUT = 480  # Seconds a long-poll waits for changes (Dropbox allows 30-480)
 
-indexing_status = {}
+dropbox_longpolls = set()  # Account ids with a running long-poll thread
+dropbox_longpoll_lock = threading.Lock()
+
+account_sync_locks = {}  # (provider, account id) -> lock held while the account syncs
+account_sync_locks_lock = threading.Lock()
+
+DRIVE_MEDIA_URL = "https://www.googleapis.com/drive/v3/files/{file_id}?alt=media"
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", str(1024 ** 2)))  # Bytes read from Drive and sent per chunk
+DOWNLOAD_MAX_STREAMS = int(os.getenv("DOWNLOAD_MAX_STREAMS", "16"))  # Drive downloads streamed at once per worker
+download_slots = threading.BoundedSemaphore(DOWNLOAD_MAX_STREAMS)
+drive_downloads = requests.Session()  # Keeps TLS connections to Drive alive across downloads
+drive_downloads.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=DOWNLOAD_MAX_STREAMS))
+
+
+def discard(spooled):
+    """Close and delete a spooled download copy."""
+    spooled.close()
+    try:
+        os.remove(spooled.name)
+    except OSError:
+        pass
 
 
 auto_sync_started = False  # Global flag
 
 def start_auto_sync_threads(app):
-    """Start background threads for auto-syncing local storage, Google Drive, and Dropbox."""
-    global executor
-
-    if executor:
-        print("🔄 Stopping previous executor...")
-        executor.shutdown(wait=False)  # ✅ Properly stop previous threads before restarting
+    """Start background threads for auto-syncing local storage, Google Drive, and Dropbox.
 
-    executor = ThreadPoolExecutor(max_workers=5)  # ✅ Restart the executor
+    The threads only decide what is due; the syncs themselves run on the job scheduler.
+    """
     print("🚀 Auto-sync threads started.")
 
+    # ✅ Pick up indexing jobs left behind by a worker that stopped
+    resume_stale_jobs(app)
+
+    # ✅ Renew cloud access tokens before they expire
+    token_cache.start(app)
+
+    # ✅ Drain outbox rows left behind by a previous run
+    start_outbox_relay(app, es_writer)
+
     # ✅ Start local storage indexing thread
     local_indexing_thread = threading.Thread(target=auto_index_local_storage, args=(app,), daemon=True)
     local_indexing_thread.start()
@@ -88,42 +136,19 @@ def get_available_drives():
     
 def is_valid_file(file_path):
     """Check if the file should be indexed."""
-    file_name = os.path.basename(file_path).lower()
-    return (
-        file_name not in EXCLUDE_FILES
-    )
+    return not DEFAULT_EXCLUSIONS.skip_file(os.path.basename(file_path), file_path)
 
 def is_valid_dir(dir_path):
     """Check if the directory should be indexed."""
-    dir_name = os.path.basename(dir_path)
-    return dir_name not in EXCLUDE_DIRS
+    return not DEFAULT_EXCLUSIONS.skip_dir(os.path.basename(dir_path), dir_path)
 
 def get_user_dirs():
     """Get the current user's directory inside C:/Users."""
     user_home = os.path.expanduser("~")  # Automatically gets C:/Users/Username
     return [user_home] if os.path.exists(user_home) else []
 
-from concurrent.futures import ThreadPoolExecutor
-
-def auto_index_local_storage():
-    """Periodically check for new files and index only them, avoiding reindexing existing ones."""
-    while True:
-        with current_app.app_context():
-            users = db.session.query(IndexedFile.user_id).distinct().all()
-            user_dirs = get_user_dirs()
-
-            with ThreadPoolExecutor(max_workers=5) as executor:  # Limit threads to avoid overload
-                for (user_id,) in users:
-                    for user_dir in user_dirs:
-                        if is_valid_dir(user_dir):
-                            executor.submit(index_new_files_only, user_id, user_dir)
-
-        from concurrent.futures import ThreadPoolExecutor
-
-executor = None
 def auto_index_local_storage(app):
-    """Periodically check for new files and index only new ones."""
-    global executor
+    """Keep local indexes current: watch user directories for changes, polling hourly where watching is unavailable."""
     print("starting auto-indexing...")
     with app.app_context():  # ✅ Ensure we are inside Flask app context
         while threading.main_thread().is_alive():
@@ -133,16 +158,28 @@ def auto_index_local_storage(app):
                  # Debugging log
                 for (user_id,) in users:
                     for user_dir in user_dirs:
-                        if is_valid_dir(user_dir):
-                            executor.submit(index_new_files_only, user_id,app) # ✅ Submit safely
-                            print(f"Indexing new files for user {user_id} in {user_dir}")  # Debugging log
+                        if not is_valid_dir(user_dir):
+                            continue
+                        watcher = local_watchers.get((user_id, os.path.abspath(user_dir)))
+                        watched = watcher is not None and watcher.is_alive()
+                        if LOCAL_WATCH_MODE == "watch" and ensure_local_watcher(app, user_id, user_dir):
+                            if watched:
+                                continue  # Watcher already live, nothing to poll
+                            # Catch up once on changes made before the watcher started
+                        index_new_files_only(user_id, app)
+                        print(f"Indexing new files for user {user_id} in {user_dir}")  # Debugging log
 
             except RuntimeError as e:
-                if "cannot schedule new futures after shutdown" in str(e):
-                    print("🛑 Executor shutdown detected, stopping indexing thread.")
+                if scheduler.stopped:
+                    print("🛑 Scheduler shutdown detected, stopping indexing thread.")
                     break  # ✅ Exit loop if Flask is shutting down
                 print(f"❌ Error in auto-indexing: {str(e)}")
 
+            try:
+                es_writer.replay_dead_letters()  # ✅ Retry documents Elasticsearch rejected earlier
+            except Exception as e:
+                logging.error(f"❌ Error replaying dead-lettered documents: {str(e)}")
+
             time.sleep(3600)  # ✅ Prevent excessive CPU usage
 
         print("🛑 Auto-indexing stopped.")
@@ -166,7 +203,9 @@ def auto_index_google_drive(app):
                     
                     for (account_id,) in account_ids:
                         print(f"🔄 Syncing Google Drive for User {user_id}, Account {account_id}")
-                        sync_google_drive(account_id, user_id)  # ✅ Call your function
+                        sync_scheduler.submit(("google_drive", account_id), run_with_app_context, app,
+                                              run_account_sync, ("google_drive", account_id),
+                                              sync_google_drive, account_id, user_id)
 
                 except Exception as e:
                     logging.error(f"❌ Google Drive indexing error for User {user_id}: {str(e)}")
@@ -194,7 +233,11 @@ def auto_index_dropbox(app):
                     
                     for (account_id,) in account_ids:
                         print(f"🔄 Syncing Dropbox for User {user_id}, Account {account_id}")
-                        sync_dropbox(account_id, user_id)  # ✅ Call your function
+                        sync_scheduler.submit(("dropbox", account_id), run_with_app_context, app,
+                                              run_account_sync, ("dropbox", account_id),
+                                              sync_dropbox, account_id, user_id)
+                        if DROPBOX_LONGPOLL:
+                            ensure_dropbox_longpoll(app, account_id, user_id)
 
                 except Exception as e:
                     logging.error(f"❌ Dropbox indexing error for User {user_id}: {str(e)}")
@@ -206,7 +249,7 @@ def auto_index_dropbox(app):
 
 
 def index_new_files_only(user_id, app):
-    """Index only new files inside the current user's home directory."""
+    """Queue a background incremental index of the current user's home directory."""
     
     with app.app_context():  # ✅ Push application context using passed `app`
         print(f"🔄 Starting indexing for user: {user_id}")
@@ -219,87 +262,23 @@ def index_new_files_only(user_id, app):
 
         print(f"📂 Base directory for indexing: {user_home}")  # Debugging log
 
-        # ✅ Initialize a new database session
-        session = db.session
-
-        indexed_items = []
-        new_entries = []
-
-        try:
-            for root, dirs, files in os.walk(user_home):
-                # ✅ Exclude unnecessary directories
-                dirs[:] = [d for d in dirs if is_valid_dir(os.path.join(root, d))]
-
-                for file in files:
-                    file_path = os.path.join(root, file)
-
-                    # ✅ Exclude hidden/system files
-                    if not is_valid_file(file_path):
-                        continue
-                    if not is_valid_dir(file_path):
-                        continue
-
-                    # ✅ Skip already indexed files
-                    if session.query(IndexedFile).filter_by(filepath=file_path, user_id=user_id).first():
-                        continue  
-
-                    print(f"🆕 New file detected: {file_path}")  # Debugging log
-
-                    new_entries.append(IndexedFile(
-                        user_id=user_id,
-                        filename=file,
-                        filepath=file_path,
-                        is_folder=False
-                    ))
-                    indexed_items.append({
-                        "id": f"{user_id}_{file_path}",
-                        "user_id": user_id,
-                        "filename": file,
-                        "filepath": file_path,
-                        "is_folder": False
-                    })
-
-            # ✅ Commit new entries to DB
-            if new_entries:
-                session.bulk_save_objects(new_entries)
-                session.commit()
-                print(f"✅ Indexed {len(new_entries)} new files")
-
-            # ✅ Index in Elasticsearch
-            if indexed_items and es:
-                helpers.bulk(es, [{"_index": "file_index", "_id": item["id"], "_source": item} for item in indexed_items])
-                print(f"✅ Added {len(indexed_items)} new items to Elasticsearch")
-
-        except Exception as e:
-            logging.error(f"❌ Error during indexing new files: {str(e)}")
-            session.rollback()
-
-        finally:
-            session.close()
+        schedule_index_job(app, user_id, user_home, incremental=True, priority=BACKGROUND)
 
 def get_dropbox_access_token(account_id):
     """Fetch the access token for a specific Dropbox account."""
-    account = CloudStorageAccount.query.filter_by(id=account_id, provider="Dropbox").first()
-    return account.access_token if account else None
-
-def fetch_dropbox_files(dbx, path=""):
-    """Recursively fetch files from Dropbox."""
-    try:
-        result = dbx.files_list_folder(path, recursive=True)
-        files = []
+    return token_cache.get(account_id, "Dropbox")
 
-        while True:
-            for entry in result.entries:
-                if isinstance(entry, dropbox.files.FileMetadata):
-                    files.append(entry)
-            if not result.has_more:
-                break
-            result = dbx.files_list_folder_continue(result.cursor)
-
-        return files
-    except Exception as e:
-        logging.error(f"Dropbox API Error: {str(e)}")
-        return []
+def fetch_dropbox_pages(dbx, cursor=None):
+    """Yield (entries, cursor) per list_folder page, continuing from `cursor` or listing everything from scratch."""
+    if cursor:
+        result = rate_limited("dropbox", dbx.files_list_folder_continue, cursor)
+    else:
+        result = rate_limited("dropbox", dbx.files_list_folder, "", recursive=True)
+    while True:
+        yield result.entries, result.cursor
+        if not result.has_more:
+            break
+        result = rate_limited("dropbox", dbx.files_list_folder_continue, result.cursor)
     
 def get_dropbox_file_type(file_name):
     """Return the file extension as the file type."""
@@ -309,8 +288,58 @@ def get_dropbox_file_type(file_name):
         return file_name.split('.')[-1]  # Extract the file extension (e.g., 'pdf', 'jpg', etc.)
 
 
+# Provider-owned columns refreshed on sync; user-owned ones (is_favorite) are never overwritten
+DROPBOX_UPDATE_COLUMNS = ["filename", "mime_type", "content_hash", "size", "filetype", "last_modified"]
+DROPBOX_COMPARE_COLUMNS = ["last_modified", "content_hash"]  # A row is only rewritten when one of these changed
+
+
+def dropbox_file_record(user_id, account_id, file):
+    """Build the IndexedFile mapping of one Dropbox file."""
+    return {
+        "user_id": user_id,
+        "account_id": account_id,
+        "filename": file.name,
+        "filepath": f"dropbox://{file.path_display}",
+        "storage_type": "dropbox",
+        "filetype": get_dropbox_file_type(file.name),  # Save file extension as filetype
+        "cloud_file_id": file.id,
+        "mime_type": file.content_hash,  # This is a unique identifier for the file, not the MIME type
+        "content_hash": file.content_hash,  # Same scheme as local content hashes
+        "size": file.size,
+        "last_modified": file.server_modified,
+        "is_favorite": False,  # Default to False for new entries
+    }
+
+
+def delete_dropbox_paths(session, account_id, paths):
+    """Delete the rows of deleted Dropbox files and folders (with everything below them), returning the filepaths removed.
+
+    Dropbox paths are case-insensitive and deletions only carry the lowercased path.
+    """
+    removed = []
+    paths = [f"dropbox://{path}" for path in topmost_paths(paths)]  # Rows below a deleted folder go with it
+    filepath = func.lower(IndexedFile.filepath)
+    for start in range(0, len(paths), PREFIX_DELETE_BATCH_SIZE):
+        chunk = paths[start:start + PREFIX_DELETE_BATCH_SIZE]
+        removed.extend(session.scalars(
+            delete(IndexedFile)
+            .where(IndexedFile.account_id == account_id,
+                   # Served by the (account_id, lower(filepath) text_pattern_ops) index
+                   or_(filepath.in_(chunk), *(filepath.startswith(path + "/", autoescape=True) for path in chunk)))
+            .returning(IndexedFile.filepath)
+            .execution_options(synchronize_session=False)
+        ))
+    return removed
+
+
 def sync_dropbox(account_id, user_id):
-    """Sync Dropbox files for a specific user."""
+    """Sync Dropbox files for a specific user.
+
+    Pages of the list_folder feed are applied one at a time and committed with
+    the cursor they end on, so a sync continues where the last one (even an
+    interrupted one) stopped. Only the first sync, or one after Dropbox reset
+    the cursor, lists the whole account.
+    """
     access_token = get_dropbox_access_token(account_id)
     if not access_token:
         logging.error(f"No valid access token found for account {account_id}")
@@ -319,7 +348,7 @@ def sync_dropbox(account_id, user_id):
     dbx = dropbox.Dropbox(access_token)
 
     try:
-        dbx.users_get_current_account()
+        rate_limited("dropbox", dbx.users_get_current_account)
     except AuthError:
         logging.error("Invalid Dropbox access token")
         return
@@ -328,43 +357,55 @@ def sync_dropbox(account_id, user_id):
         session = scoped_session(sessionmaker(bind=db.engine))
 
         try:
-            files = fetch_dropbox_files(dbx)
-            update_count = 0
-
-            for file in files:
-                file_path = file.path_display
-                last_modified = file.server_modified
-
-                # Use the helper function to get the file extension as filetype
-                file_type = get_dropbox_file_type(file.name)
-
-                stmt = insert(IndexedFile).values(
-                    user_id=user_id,
-                    account_id=account_id,
-                    filename=file.name,
-                    filepath=f"dropbox://{file_path}",
-                    storage_type="dropbox",
-                    filetype=file_type,  # Save file extension as filetype
-                    cloud_file_id=file.id,
-                    mime_type=file.content_hash,  # This is a unique identifier for the file, not the MIME type
-                    last_modified=last_modified,
-                    is_favorite=False  # Default to False for new entries
-                ).on_conflict_do_update(
-                    index_elements=["filepath"],
-                    set_={
-                        "filename": file.name,
-                        "mime_type": file.content_hash,
-                        "filetype": file_type,  # Update filetype based on file extension
-                        "last_modified": last_modified,
-                        "is_favorite": False  # Default to False for updated entries
-                    }
-                )
-
-                session.execute(stmt)
-                update_count += 1
+            account = session.get(CloudStorageAccount, account_id)
+            cursor = account.sync_cursor
+            counts = Counter()
+            delete_count = 0
+            seen = None if cursor else set()  # A full listing also drops rows of files it did not see
 
+            try:
+                pages = fetch_dropbox_pages(dbx, cursor)
+                for entries, cursor in pages:
+                    records, deleted = [], []
+                    for entry in entries:
+                        if isinstance(entry, dropbox.files.FileMetadata):
+                            records.append(dropbox_file_record(user_id, account_id, entry))
+                        elif isinstance(entry, dropbox.files.DeletedMetadata):
+                            deleted.append(entry.path_lower)
+                    removed = delete_dropbox_paths(session, account_id, deleted)
+                    page_counts, written = bulk_upsert(session, records, DROPBOX_UPDATE_COLUMNS, DROPBOX_COMPARE_COLUMNS)
+                    enqueue_outbox(session, written + removed)
+                    if seen is not None:
+                        seen.update(record["filepath"] for record in records)
+                    account.sync_cursor = cursor
+                    session.commit()
+                    counts.update(page_counts)
+                    delete_count += len(removed)
+            except dropbox.exceptions.ApiError as e:
+                if not (isinstance(e.error, dropbox.files.ListFolderContinueError) and e.error.is_reset()):
+                    raise
+                session.rollback()
+                logging.info(f"Dropbox cursor of account {account_id} was reset; listing all files")
+                account.sync_cursor = None
+                session.commit()
+                session.remove()
+                return sync_dropbox(account_id, user_id)
+
+            if seen is not None:
+                known = session.scalars(
+                    select(IndexedFile.filepath).where(IndexedFile.account_id == account_id,
+                                                       IndexedFile.storage_type == "dropbox")
+                ).all()
+                removed = delete_cloud_paths(session, account_id, [path for path in known if path not in seen])
+                enqueue_outbox(session, removed)
+                delete_count += len(removed)
+
+            account.last_synced = datetime.utcnow()
             session.commit()
-            logging.info(f"✅ Synced {update_count} files (new + updated) from Dropbox (Account {account_id}) for user {user_id}")
+            notify_outbox(es_writer)
+            logging.info(f"✅ Synced Dropbox (Account {account_id}) for user {user_id}: {counts['inserted']} new, "
+                         f"{counts['updated']} updated, {counts['unchanged']} unchanged (skipped), {delete_count} removed")
+            return dict(counts, removed=delete_count)
 
         except Exception as e:
             session.rollback()
@@ -374,12 +415,69 @@ def sync_dropbox(account_id, user_id):
             session.remove()
 
 
+def longpoll_dropbox(app, account_id, user_id):
+    """Block on Dropbox long-polls for one account and queue a sync whenever its folder feed changes."""
+    try:
+        while True:
+            with app.app_context():
+                account = db.session.get(CloudStorageAccount, account_id)
+                cursor = account.sync_cursor if account else None
+                access_token = get_dropbox_access_token(account_id) if account else None
+                db.session.remove()
+            if access_token is None:
+                return  # Account unlinked
+
+            if not cursor:
+                # Nothing to poll on until the first sync stored a cursor
+                sync_scheduler.submit(("dropbox", account_id), run_with_app_context, app,
+                                      run_account_sync, ("dropbox", account_id), sync_dropbox, account_id, user_id)
+                time.sleep(DROPBOX_LONGPOLL_TIMEOUT)
+                continue
+
+            try:
+                result = dropbox.Dropbox(access_token).files_list_folder_longpoll(cursor, timeout=DROPBOX_LONGPOLL_TIMEOUT)
+            except Exception as e:
+                logging.error(f"❌ Dropbox long-poll error (Account {account_id}): {str(e)}")
+                time.sleep(60)
+                continue
+
+            if result.changes:
+                sync_scheduler.submit(("dropbox", account_id), run_with_app_context, app,
+                                      run_account_sync, ("dropbox", account_id), sync_dropbox, account_id, user_id)
+            if result.backoff:
+                time.sleep(result.backoff)
+            while sync_scheduler.is_pending(("dropbox", account_id)):
+                time.sleep(1)  # Poll again on the cursor the sync saves
+    finally:
+        with dropbox_longpoll_lock:
+            dropbox_longpolls.discard(account_id)
+
+
+def ensure_dropbox_longpoll(app, account_id, user_id):
+    """Start the long-poll thread of a Dropbox account unless it is already running."""
+    with dropbox_longpoll_lock:
+        if account_id in dropbox_longpolls:
+            return
+        dropbox_longpolls.add(account_id)
+    threading.Thread(target=longpoll_dropbox, args=(app, account_id, user_id), daemon=True,
+                     name=f"dropbox-longpoll-{account_id}").start()
+
+
 def run_with_app_context(app, func, *args):
     """Runs a function inside the Flask app context in a separate thread."""
     with app.app_context():
         func(*args)
 
 
+def run_account_sync(key, func, *args):
+    """Run a cloud account sync, waiting for any other sync of the same account (`key`) to finish first."""
+    key = (key[0], str(key[1]))  # Request bodies may carry the id as a string
+    with account_sync_locks_lock:
+        lock = account_sync_locks.setdefault(key, threading.Lock())
+    with lock:
+        return func(*args)
+
+
 
 def get_available_drives():
     """Return only the current user's directory in C drive."""
@@ -390,110 +488,495 @@ def sanitize_filepath(path):
     """Sanitize file paths to ensure consistency."""
     return os.path.abspath(path)
 
-def index_files_worker(user_id, base_directory):
-    """Index all folders and files recursively in a given drive/directory with prefix search support."""
-    from app import app
-    with app.app_context():
-        session = scoped_session(sessionmaker(bind=db.engine))  # New DB session
+def path_key(filepath):
+    """Compact 8-byte key for a filepath, used for in-memory dedup during crawls."""
+    return hashlib.blake2b(filepath.encode("utf-8", "surrogateescape"), digest_size=8).digest()
 
-        indexing_status[user_id] = "in_progress"
-        indexed_items = []
-        new_entries = []
 
-        try:
-            for root, dirs, files in os.walk(base_directory):
-                # Filter out excluded directories
-                dirs[:] = [d for d in dirs if d not in EXCLUDE_DIRS and not d.startswith(".")]
-                print(f"Scanning: {root}")  # Debugging log
-                
-                # Index Directories
-                for folder in dirs:
-                    folder_path = sanitize_filepath(os.path.join(root, folder))
-                    if session.query(IndexedFile).filter_by(filepath=folder_path, user_id=user_id).first():
-                        continue
-                    new_entries.append(IndexedFile(
-                        user_id=user_id,
-                        filename=folder,
-                        filepath=folder_path,
-                        is_folder=True,
-                        filetype="folder",
-                        storage_type="local",  # Set storage type to 'local' for local files
-                        is_favorite=False  # Default to False for new entries
-                    ))
-                    indexed_items.append({
-                        "id": f"{folder_path}",
-                        "user_id": user_id,
-                        "filename": folder,
-                        "filename_ngram": folder.lower(),  # 👈 Add ngram field for prefix search
-                        "filepath": folder_path,
-                        "is_folder": True,
-                        "filetype": "folder",
-                        "storage_type": "local",  # Set storage type to 'local' for local files
-                        "is_favorite": False  # Default to False for new entries
-                    })
-
-                # Index Files
-                for file in files:
-                    file_path = sanitize_filepath(os.path.join(root, file))
-                    if file in EXCLUDE_FILES or file.startswith("."):
-                        continue  # Skip hidden/system files
-
-                    print(f"Indexing file: {file_path}")  # Debugging log
-
-                    # Extract file extension as filetype (e.g., 'pdf', 'txt', 'jpg')
-                    _, file_extension = os.path.splitext(file)
-                    file_extension = file_extension.lower().strip('.')  # Remove the leading dot and convert to lowercase
-
-                    if session.query(IndexedFile).filter_by(filepath=file_path, user_id=user_id).first():
-                        continue
-                    
-                    new_entries.append(IndexedFile(
-                        user_id=user_id,
-                        filename=file,
-                        filepath=file_path,
-                        is_folder=False,
-                        filetype=file_extension,  # Save filetype (extension)
-                        storage_type="local",  # Set storage type to 'local' for local files
-                        is_favorite=False  # Default to False for new entries
-                    ))
-
-                    indexed_items.append({
-                        "id": f"{file_path}",
-                        "user_id": user_id,
-                        "filename": file,
-                        "filename_ngram": file.lower(),  # 👈 Add ngram field for prefix search
-                        "filepath": file_path,
-                        "is_folder": False,
-                        "filetype": file_extension,  # Include filetype (extension) for files
-                        "storage_type": "local" , # Set storage type to 'local' for local files
-                        "is_favorite": False  # Default to False for new entries
-                    })
-
-            # Commit new entries to the database
-            if new_entries:
-                session.bulk_save_objects(new_entries)
-                session.commit()
-                print(f"Committed {len(new_entries)} files/folders to DB")  # Debugging log
+def load_known_paths(session, user_id, base_directory):
+    """Load every indexed local path under `base_directory` once, keyed by `path_key`.
+
+    Rows are streamed through a server-side cursor so the whole table is never
+    materialized as ORM objects; only (row id, last_modified) is kept per path.
+    """
+    stmt = select(IndexedFile.id, IndexedFile.filepath, IndexedFile.last_modified).where(
+        IndexedFile.user_id == user_id,
+        IndexedFile.storage_type == "local",
+        # Up to a path separator, so /home/alice2 is not loaded for /home/alice
+        or_(IndexedFile.filepath == base_directory,
+            IndexedFile.filepath.startswith(base_directory.rstrip(os.sep) + os.sep, autoescape=True)),
+    )
+    known = {}
+    for row_id, filepath, last_modified in session.execute(stmt, execution_options={"yield_per": KNOWN_PATHS_FETCH_SIZE}):
+        known[path_key(filepath)] = (row_id, last_modified)
+    return known
+
+
+class CrawlDiff:
+    """New, changed and vanished paths found by one crawl of a local directory.
+
+    New and changed records are not kept: they are handed to `sink` (a
+    BatchPipeline) as they are found, and only counted in `progress`: "new"
+    (not in the index yet), "changed" (mtime/size/inode moved) and "renamed"
+    (matched to a vanished path by inode + size).
+    """
+
+    def __init__(self, root, sink, job=None):
+        self.root = root
+        self.sink = sink
+        self.job = job  # JobRun to checkpoint, if the crawl runs as a persisted job
+        self.frontier = CrawlFrontier() if job is not None else None
+        self.progress = job.progress if job is not None else ProgressCounters()
+        self.vanished = []  # filepaths of indexed paths no longer found on disk
+        self.snapshot = {}  # Directory snapshot recorded by this crawl
+        self.rules = DEFAULT_EXCLUSIONS  # Exclusion rules the crawl applied
+
+    def add_new(self, record):
+        self.progress.add("new")
+        self.sink.add(record)
+
+    def add_changed(self, record):
+        self.progress.add("changed")
+        self.sink.add(record)
+
+    def add_renamed(self, record, old_path):
+        self.progress.add("renamed")
+        self.sink.add(dict(record, renamed_from=old_path))
+
+    def summary(self):
+        totals = self.progress.totals()
+        return (f"{totals['files_seen']} seen, {totals['new']} new, {totals['changed']} changed, "
+                f"{totals['renamed']} renamed, {len(self.vanished)} vanished")
+
+    def maybe_checkpoint(self):
+        """Persist the crawl frontier once the job's checkpoint interval has passed.
+
+        The pipeline is drained first, so every entry the crawl handed out before
+        this point is committed and the saved frontier covers all the rest. After
+        a failed batch the frontier is not moved, so a resume retries from before it.
+        """
+        if self.job is None or not self.job.due():
+            return
+        self.sink.barrier()
+        self.job.checkpoint(self.frontier.paths() if self.sink.ok else None)
+
+
+def local_file_record(entry):
+    """Build the IndexedFile mapping for a crawled local file or folder."""
+    return {
+        "filename": entry.name,
+        "filepath": entry.path,
+        "is_folder": entry.is_folder,
+        # Extract file extension as filetype (e.g., 'pdf', 'txt', 'jpg')
+        "filetype": "folder" if entry.is_folder else file_extension(entry.name),
+        "storage_type": "local",
+        "size": None if entry.is_folder else entry.size,
+        "last_modified": datetime.utcfromtimestamp(entry.mtime),
+    }
+
+
+def diff_local_tree(session, user_id, base_directory, sink, incremental=False, job=None):
+    """Crawl `base_directory`, streaming what differs from the index into `sink`.
+
+    With `incremental`, the crawl replays unchanged directories from the last
+    saved snapshot and diffs against that snapshot; otherwise every directory is
+    listed and diffed against the user's indexed paths in the database.
+
+    With a `job`, progress is checkpointed as the crawl goes. A resumed job only
+    crawls the frontier it saved, diffing against the database, and only
+    reports vanished paths below that frontier.
+    """
+    base_directory = sanitize_filepath(base_directory)
+    diff = CrawlDiff(base_directory, sink, job)
+    diff.rules = load_exclusions(user_id, base_directory)
+    resumed = job is not None and job.resumed
+    previous = load_snapshot(user_id, base_directory, diff.rules.key) if incremental and not resumed else None
+    failed = []
+
+    if previous is not None:
+        previous_entries = snapshot_entries(previous)
+        by_inode = {(old.device, old.inode): old for old in previous_entries.values()}
+        diff.progress.expected = len(previous_entries)
+        for entry in crawl(base_directory, rules=diff.rules, snapshot=previous, record=diff.snapshot, failed=failed,
+                           frontier=diff.frontier, progress=diff.progress):
+            diff.progress.add("files_seen")
+            old = previous_entries.pop(entry.path, None)
+            if old is None:
+                old_path = find_renamed_from(entry, by_inode, previous_entries)
+                if old_path is not None:
+                    del previous_entries[old_path]
+                    diff.add_renamed(local_file_record(entry), old_path)
+                else:
+                    diff.add_new(local_file_record(entry))
+            elif (old.mtime, old.size, old.inode) != (entry.mtime, entry.size, entry.inode):
+                diff.add_changed(local_file_record(entry))
+            diff.maybe_checkpoint()
+
+        # Keep tracking what sat under unreadable directories until they can be listed again
+        for path, listing in previous.items():
+            if is_under_any(path, failed):
+                diff.snapshot.setdefault(path, listing)
+        diff.vanished = [path for path in previous_entries if not is_under_any(path, failed)]
+        return diff
+
+    roots = job.frontier if resumed else [base_directory]
+    known = load_known_paths(session, user_id, base_directory)
+    diff.progress.expected = len(known) or None  # Unknown on a first crawl
+    for entry in crawl(roots, rules=diff.rules, record=None if resumed else diff.snapshot, failed=failed,
+                       frontier=diff.frontier, progress=diff.progress):
+        diff.progress.add("files_seen")
+        record = local_file_record(entry)
+        existing = known.pop(path_key(entry.path), None)
+        if existing is None:
+            diff.add_new(record)
+        elif existing[1] != record["last_modified"]:
+            diff.add_changed(record)
+        diff.maybe_checkpoint()
+
+    vanished_ids = [row_id for row_id, _ in known.values()]
+    for start in range(0, len(vanished_ids), KNOWN_PATHS_FETCH_SIZE):
+        chunk = vanished_ids[start:start + KNOWN_PATHS_FETCH_SIZE]
+        diff.vanished.extend(path for path in session.scalars(select(IndexedFile.filepath).where(IndexedFile.id.in_(chunk)))
+                             if not is_under_any(path, failed)
+                             # Roots themselves were consumed with their parent before the resume
+                             and (not resumed or (path not in roots and is_under_any(path, roots))))
+    return diff
+
+
+def is_under_any(path, directories):
+    """True if `path` is one of `directories` or lies below one of them."""
+    return any(path == directory or path.startswith(directory + os.sep) for directory in directories)
+
+
+def find_renamed_from(entry, by_inode, previous_entries):
+    """Return the previous path of a new entry that is really a rename (same inode and size), else None."""
+    old = by_inode.get((entry.device, entry.inode))
+    if old is None or old.path not in previous_entries or old.is_folder != entry.is_folder:
+        return None  # Unknown inode, or the old path was already seen alive in this crawl
+    if not entry.is_folder and old.size != entry.size:
+        return None
+    try:
+        if os.lstat(old.path).st_ino == entry.inode:
+            return None  # Still there: a hard link, not a rename
+    except OSError:
+        pass
+    return old.path
+
+
+def tombstone_local_paths(session, user_id, paths):
+    """Bulk-delete indexed rows for exactly `paths`, returning the filepaths actually removed."""
+    removed = []
+    for start in range(0, len(paths), KNOWN_PATHS_FETCH_SIZE):
+        chunk = paths[start:start + KNOWN_PATHS_FETCH_SIZE]
+        removed.extend(session.scalars(
+            delete(IndexedFile)
+            .where(IndexedFile.user_id == user_id, IndexedFile.storage_type == "local",
+                   IndexedFile.filepath.in_(chunk))
+            .returning(IndexedFile.filepath)
+            .execution_options(synchronize_session=False)
+        ))
+    return removed
+
+
+def relay_now(doc_ids):
+    """Push just-committed outbox rows to Elasticsearch, returning the acknowledged count.
+
+    Whatever is not relayed here stays in the outbox for the background relay.
+    """
+    try:
+        return relay_outbox(es_writer, doc_ids)
+    except Exception as e:
+        logging.error(f"❌ Outbox relay error: {str(e)}")
+        notify_outbox(es_writer)
+        return 0
+
+
+def upsert_local_records(session, user_id, records):
+    """Insert or refresh local IndexedFile rows in one multi-row statement."""
+    stmt = insert(IndexedFile)
+    session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["filepath"],
+            set_={"filename": stmt.excluded.filename, "filetype": stmt.excluded.filetype,
+                  "is_folder": stmt.excluded.is_folder, "last_modified": stmt.excluded.last_modified,
+                  "size": stmt.excluded.size,
+                  # Modified content needs hashing again; extraction follows once the new hash differs
+                  "content_hash": case(
+                      (IndexedFile.last_modified.is_distinct_from(stmt.excluded.last_modified), null()),
+                      else_=IndexedFile.content_hash,
+                  )},
+            where=IndexedFile.user_id == user_id,
+        ),
+        [dict(((key, value) for key, value in record.items() if key != "renamed_from"),
+              user_id=user_id, is_favorite=False) for record in records],
+    )
+    enqueue_outbox(session, [record["filepath"] for record in records])
+
+
+def write_local_batch_db(user_id, records):
+    """Commit one batch of crawled records to Postgres in its own transaction, with their outbox rows.
+
+    Renamed paths rewrite their existing row first, so ids and favorites survive
+    the move; the upsert then refreshes metadata (or inserts if the row was missing).
+    """
+    session = scoped_session(sessionmaker(bind=db.engine))
+    try:
+        renames = [record for record in records if "renamed_from" in record]
+        if renames:
+            tombstone_local_paths(session, user_id, [record["filepath"] for record in renames])
+            table = IndexedFile.__table__
+            session.execute(
+                update(table)
+                .where(table.c.filepath == bindparam("b_old_path"), table.c.user_id == user_id)
+                .values(filepath=bindparam("b_new_path"), filename=bindparam("b_filename"), extracted_hash=None),
+                [{"b_old_path": record["renamed_from"], "b_new_path": record["filepath"],
+                  "b_filename": record["filename"]} for record in renames],
+            )
+            enqueue_outbox(session, [record["renamed_from"] for record in renames])
+        upsert_local_records(session, user_id, records)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.remove()
+
+
+def remove_vanished_paths(user_id, paths):
+    """Tombstone paths that disappeared from disk in Postgres and Elasticsearch."""
+    session = scoped_session(sessionmaker(bind=db.engine))
+    try:
+        removed = tombstone_local_paths(session, user_id, paths)
+        enqueue_outbox(session, removed)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.remove()
 
-            # Index in Elasticsearch
-            if indexed_items:
-                helpers.bulk(es, [{"_index": "file_index", "_id": item["id"], "_source": item} for item in indexed_items])
-                print(f"Indexed {len(indexed_items)} items in Elasticsearch")  # Debugging log
+    relay_now(removed)
+    return len(removed)
+
+
+def extract_user_content(user_id):
+    """Index the text content of the user's local files once their hashes are known."""
+    extract_pending_files(user_id, es_writer)
+
+
+def run_local_crawl(app, user_id, base_directory, incremental=False, job=None):
+    """Crawl one local root and stream its changes to Postgres and Elasticsearch in fixed-size batches.
+
+    Every batch is committed (with its outbox rows) as soon as it is full, then
+    relayed to Elasticsearch, so an interrupted run keeps its progress and a
+    `job` records how far it got. The snapshot for the next incremental run is
+    only saved when a complete crawl made it to the database.
+    """
+    session = scoped_session(sessionmaker(bind=db.engine))
+    progress = job.progress if job is not None else ProgressCounters()
+
+    def write_db(batch):
+        write_local_batch_db(user_id, batch)
+        progress.add("rows_written", len(batch))
+        paths = [record["filepath"] for record in batch]
+        paths.extend(record["renamed_from"] for record in batch if "renamed_from" in record)
+        progress.add("docs_indexed", relay_now(paths))
+
+    pipeline = BatchPipeline({"db": write_db}, app=app)
+
+    try:
+        diff = diff_local_tree(session, user_id, base_directory, pipeline, incremental, job)
+    finally:
+        pipeline.close()
+        session.remove()
+
+    removed = remove_vanished_paths(user_id, diff.vanished) if diff.vanished else 0
+    progress.add("deleted", removed)
+
+    print(f"Crawled {diff.root}: {diff.summary()}, {pipeline.written['db']} rows written, "
+          f"{progress.totals()['docs_indexed']} docs indexed, {removed} rows removed")  # Debugging log
+    if job is not None and job.resumed:
+        delete_snapshot(user_id, diff.root)  # Only part of the tree was crawled; diff the database next time
+    elif pipeline.ok:
+        save_snapshot(user_id, diff.root, diff.snapshot, diff.rules.key)
+    return diff
+
+
+def entry_for_path(path):
+    """Stat a single path into a CrawlEntry, or None if it is gone."""
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return None
+    return CrawlEntry(os.path.basename(path), path, stat.S_ISDIR(st.st_mode), st.st_size, st.st_mtime,
+                      st.st_ino, st.st_dev, 0)
+
+
+def delete_local_paths(session, user_id, paths):
+    """Delete indexed rows for `paths` and everything below them, returning the removed filepaths."""
+    removed = []
+    paths = topmost_paths(paths)  # Rows below a deleted folder go with it
+    for start in range(0, len(paths), PREFIX_DELETE_BATCH_SIZE):
+        chunk = paths[start:start + PREFIX_DELETE_BATCH_SIZE]
+        removed.extend(session.scalars(
+            delete(IndexedFile)
+            .where(
+                IndexedFile.user_id == user_id,
+                IndexedFile.storage_type == "local",
+                # Each prefix LIKE is served by the filepath text_pattern_ops index
+                or_(IndexedFile.filepath.in_(chunk),
+                    *(IndexedFile.filepath.startswith(path + os.sep, autoescape=True) for path in chunk)),
+            )
+            .returning(IndexedFile.filepath)
+            .execution_options(synchronize_session=False)
+        ))
+    return removed
+
+
+def move_local_path(session, user_id, src, dest):
+    """Rewrite the indexed rows of a renamed file or folder in place, keeping favorites and ids."""
+    table = IndexedFile.__table__
+    rows = session.execute(
+        update(table)
+        .where(
+            table.c.user_id == user_id,
+            table.c.storage_type == "local",
+            or_(table.c.filepath == src, table.c.filepath.startswith(src + os.sep, autoescape=True)),
+        )
+        .values(
+            filepath=func.concat(dest, func.substr(table.c.filepath, len(src) + 1)),
+            filename=case((table.c.filepath == src, os.path.basename(dest)), else_=table.c.filename),
+            extracted_hash=None,  # Re-indexed under the new id without its text
+        )
+        .returning(table.c.filename, table.c.filepath, table.c.is_folder, table.c.filetype)
+    ).mappings().all()
+    return [dict(row) for row in rows]
+
+
+def apply_local_changes(user_id, root, moves, upserts, deletes, stats=()):
+    """Apply one debounced batch of watched filesystem changes to the database and Elasticsearch.
+
+    `upserts` are new or moved-in paths (folders are crawled, once per topmost
+    folder); `stats` only refresh the row of the path itself, e.g. the
+    destination of a move whose rows were already rewritten in place.
+    """
+    session = scoped_session(sessionmaker(bind=db.engine))
+    changed = []  # Filepaths whose file_index documents must follow
+    upserts, stats = list(upserts), set(stats)
+
+    try:
+        for src, dest in moves:
+            # A rename over an existing path replaces it
+            changed.extend(delete_local_paths(session, user_id, [dest]))
+            moved = move_local_path(session, user_id, src, dest)
+            for record in moved:
+                changed.append(src + record["filepath"][len(dest):])
+                changed.append(record["filepath"])
+            if not moved:
+                # Nothing indexed under the old path yet: index it as new
+                upserts.append(dest)
+                stats.discard(dest)
+
+        changed.extend(delete_local_paths(session, user_id, deletes))
+
+        rules = load_exclusions(user_id, root)
+        records = {}
+        folders = []
+        upserts = topmost_paths(upserts)
+        for path in upserts + sorted(stats.difference(upserts)):
+            entry = entry_for_path(path)
+            if entry is None or (not entry.is_folder and rules.skip_file(entry.name, path, entry.size)):
+                continue
+            records[path] = local_file_record(entry)
+            if entry.is_folder and path not in stats:
+                folders.append(path)
+        if folders:
+            # New or moved-in folders (unzip, git checkout) may already be populated
+            records.update((child.path, local_file_record(child)) for child in crawl(folders, rules=rules))
+        records = list(records.values())
+        if records:
+            upsert_local_records(session, user_id, records)
+        enqueue_outbox(session, changed)
+
+        session.commit()
+        print(f"👀 Applied watched changes for user {user_id}: {len(moves)} moved, {len(deletes)} deleted, {len(records)} upserted")
+
+        if changed or records:
+            notify_outbox(es_writer)
+
+        # The snapshot no longer matches the index; the next poll re-diffs against the database
+        delete_snapshot(user_id, root)
+        schedule_hashing(current_app._get_current_object(), user_id, then=extract_user_content)
+
+    except Exception:
+        session.rollback()
+        raise
+
+    finally:
+        session.remove()
+
+
+def run_index_job(app, job_id):
+    """Run a persisted local indexing job, resuming from its last checkpoint if it has one."""
+    with app.app_context():
+        job = JobRun(job_id)
+        job.start()
+        if job.resumed:
+            print(f"🔁 Resuming index job {job.id} for user {job.user_id}: {len(job.frontier)} directories left")
+
+        try:
+            run_local_crawl(app, job.user_id, job.root, job.incremental, job=job)
+            job.set_phase("hashing")
+            hash_pending_files(job.user_id, job.progress)
+            job.set_phase("extracting")
+            extract_user_content(job.user_id)
+            job.finish("completed")
 
         except Exception as e:
             logging.error(f"Error during indexing: {str(e)}")
+            job.finish("failed", error=str(e))
+
+
+def schedule_index_job(app, user_id, root, incremental=False, priority=INTERACTIVE, job_id=None):
+    """Queue a local indexing job on the scheduler, unless the same root is already being indexed.
+
+    Returns the job id, or None when nothing was queued. Pass `job_id` to queue
+    an existing (claimed) job instead of creating one.
+    """
+    root = sanitize_filepath(root)
+    key = ("index", str(user_id), root)
+    if job_id is None:
+        if scheduler.is_pending(key) or has_active_job(user_id, root):
+            return None
+        job_id = create_index_job(user_id, root, incremental)
+    if not scheduler.submit(key, run_index_job, app, job_id, user_id=str(user_id), priority=priority):
+        cancel_index_job(job_id, "Another job for this directory is already queued")
+        return None
+    return job_id
 
-        finally:
-            session.remove()
-            indexing_status[user_id] = "completed"
+
+def reconcile_local_root(app, user_id, root):
+    """Re-diff a watched root against the database after its watcher lost events. Returns the job id, or None."""
+    delete_snapshot(user_id, root)  # Without it the crawl would trust unchanged directory mtimes
+    return schedule_index_job(app, user_id, root, incremental=True, priority=BACKGROUND)
+
+
+def resume_stale_jobs(app, user_id=None):
+    """Claim indexing jobs whose worker died and queue them to continue from their checkpoint."""
+    try:
+        claimed = claim_stale_jobs(user_id)
+    except Exception as e:
+        logging.error(f"❌ Could not check for interrupted index jobs: {str(e)}")
+        return
+    for job_id, job_user_id, root, incremental in claimed:
+        schedule_index_job(app, job_user_id, root, incremental, BACKGROUND if incremental else INTERACTIVE, job_id)
 
 from sqlalchemy.dialects.postgresql import insert
 
 
 def get_access_token(account_id):
     """Fetch the access token for a specific Google Drive account."""
-    account = CloudStorageAccount.query.filter_by(id=account_id, provider="Google Drive").first()
-    return account.access_token if account else None
+    return token_cache.get(account_id, "Google Drive")
 
 def get_file_type_from_mime(mime_type):
     """Map MIME type to a simplified file type (e.g., 'pdf', 'image', 'docx', etc.)"""
@@ -517,8 +1000,118 @@ def get_file_type_from_mime(mime_type):
     return mime_type_mapping.get(mime_type, "folder")  # Default to 'unknown' if not found
 
 
+# Gmail attachments and Photos items carry no modification time (last_modified is when they were first seen),
+# so they are only rewritten when their descriptive columns change
+MESSAGE_UPDATE_COLUMNS = ["filename", "filetype", "mime_type"]
+DRIVE_FILE_FIELDS = "id, name, mimeType, modifiedTime, size, md5Checksum, trashed"
+DRIVE_PAGE_SIZE = 1000  # Maximum the Drive API allows for files().list and changes().list
+
+
+DRIVE_UPDATE_COLUMNS = ["filename", "mime_type", "content_hash", "size", "filetype", "last_modified"]
+DRIVE_COMPARE_COLUMNS = ["last_modified", "content_hash", "filename"]  # Renames keep the file id and modifiedTime
+
+
+def drive_file_record(user_id, account_id, file):
+    """Build the IndexedFile mapping of one Drive file."""
+    file_id = file["id"]
+    mime_type = file["mimeType"]
+    return {
+        "user_id": user_id,
+        "account_id": account_id,
+        "filename": file["name"],
+        "filepath": f"drive://{file_id}",
+        "storage_type": "google_drive",
+        "filetype": get_file_type_from_mime(mime_type),  # Use the worker function to get the simplified file type
+        "cloud_file_id": file_id,
+        "mime_type": mime_type,
+        # Drive only exposes MD5, prefixed to keep it apart from content hashes
+        "content_hash": f"md5:{file['md5Checksum']}" if "md5Checksum" in file else None,
+        "size": int(file["size"]) if "size" in file else None,  # Google Docs have no size
+        "last_modified": datetime.strptime(file["modifiedTime"], "%Y-%m-%dT%H:%M:%S.%fZ"),
+        "is_favorite": False,  # Default to False for new entries
+    }
+
+
+def delete_cloud_paths(session, account_id, paths):
+    """Delete the indexed rows of an account's removed cloud files, returning the filepaths removed."""
+    removed = []
+    for start in range(0, len(paths), KNOWN_PATHS_FETCH_SIZE):
+        removed.extend(session.scalars(
+            delete(IndexedFile)
+            .where(IndexedFile.account_id == account_id,
+                   IndexedFile.filepath.in_(paths[start:start + KNOWN_PATHS_FETCH_SIZE]))
+            .returning(IndexedFile.filepath)
+            .execution_options(synchronize_session=False)
+        ))
+    return removed
+
+
+def list_drive_files(session, service, user_id, account_id):
+    """Full listing: upsert every Drive file and drop rows of files that are gone. Returns (counts, removed)."""
+    counts = Counter()
+    seen = set()
+    page_token = None
+    while True:
+        response = rate_limited("google_drive", service.files().list(
+            q="trashed = false",
+            fields=f"nextPageToken, files({DRIVE_FILE_FIELDS})",
+            pageSize=DRIVE_PAGE_SIZE,
+            pageToken=page_token
+        ).execute)
+        records = [drive_file_record(user_id, account_id, file) for file in response.get("files", [])]
+        page_counts, written = bulk_upsert(session, records, DRIVE_UPDATE_COLUMNS, DRIVE_COMPARE_COLUMNS)
+        enqueue_outbox(session, written)
+        counts.update(page_counts)
+        seen.update(record["filepath"] for record in records)
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            break
+
+    known = session.scalars(
+        select(IndexedFile.filepath).where(IndexedFile.account_id == account_id,
+                                           IndexedFile.storage_type == "google_drive")
+    ).all()
+    removed = delete_cloud_paths(session, account_id, [path for path in known if path not in seen])
+    enqueue_outbox(session, removed)
+    return counts, len(removed)
+
+
+def apply_drive_changes(session, service, user_id, account_id, page_token):
+    """Apply every change since `page_token`. Returns (counts, removed, the token to resume from next time)."""
+    counts = Counter()
+    removed = 0
+    while True:
+        response = rate_limited("google_drive", service.changes().list(
+            pageToken=page_token,
+            spaces="drive",
+            includeRemoved=True,
+            fields=f"nextPageToken, newStartPageToken, changes(fileId, removed, file({DRIVE_FILE_FIELDS}))",
+            pageSize=DRIVE_PAGE_SIZE
+        ).execute)
+        records, gone = [], []
+        for change in response.get("changes", []):
+            file = change.get("file")
+            if change.get("removed") or file is None or file.get("trashed"):
+                gone.append(f"drive://{change['fileId']}")
+            else:
+                records.append(drive_file_record(user_id, account_id, file))
+        gone = delete_cloud_paths(session, account_id, gone)
+        page_counts, written = bulk_upsert(session, records, DRIVE_UPDATE_COLUMNS, DRIVE_COMPARE_COLUMNS)
+        enqueue_outbox(session, written + gone)
+        counts.update(page_counts)
+        removed += len(gone)
+        if "newStartPageToken" in response:
+            return counts, removed, response["newStartPageToken"]
+        page_token = response["nextPageToken"]
+
+
 def sync_google_drive(account_id, user_id):
-    """Sync only the specified Google Drive account for a user, resolving conflicts properly."""
+    """Sync only the specified Google Drive account for a user, resolving conflicts properly.
+
+    The first sync lists the whole Drive and saves a Changes API start token on
+    the account; later syncs only fetch and apply what changed since (including
+    removals and trashing). A full listing runs again if Drive rejects the token.
+    """
     access_token = get_access_token(account_id)
     if not access_token:
         logging.error(f"No valid access token found for account {account_id}")
@@ -527,65 +1120,39 @@ def sync_google_drive(account_id, user_id):
     with current_app.app_context():
         session = scoped_session(sessionmaker(bind=db.engine))
 
-        creds = Credentials(token=access_token)
-        service = build("drive", "v3", credentials=creds)
+        service = google_clients.checkout(account_id, access_token, "drive", "v3")
 
         try:
-            files = []
-            page_token = None
-
-            # Fetch all files using pagination
-            while True:
-                response = service.files().list(
-                    fields="nextPageToken, files(id, name, mimeType, modifiedTime)",
-                    pageSize=100,  # Fetch in batches of 100
-                    pageToken=page_token
-                ).execute()
-                files.extend(response.get("files", []))
-                page_token = response.get("nextPageToken")
-                if not page_token:
-                    break
-
-            new_entries = []
-            update_count = 0
-
-            for file in files:
-                file_id = file["id"]
-                last_modified = datetime.strptime(file["modifiedTime"], "%Y-%m-%dT%H:%M:%S.%fZ")
-                mime_type = file["mimeType"]
-
-                # Use the worker function to get the simplified file type
-                file_type = get_file_type_from_mime(mime_type)
-                print(f"File Type: {file_type}")  # Debugging log
-
-                # Prepare the insert statement with ON CONFLICT handling
-                stmt = insert(IndexedFile).values(
-                    user_id=user_id,
-                    account_id=account_id,
-                    filename=file["name"],
-                    filepath=f"drive://{file_id}",
-                    storage_type="google_drive",
-                    filetype=file_type,  # Correct column name
-                    cloud_file_id=file_id,
-                    mime_type=mime_type,
-                    last_modified=last_modified,
-                    is_favorite=False  # Default to False for new entries
-                ).on_conflict_do_update(
-                    index_elements=["filepath"],  # This ensures the filepath uniqueness constraint is respected
-                    set_={
-                        "filename": file["name"],
-                        "mime_type": mime_type,
-                        "filetype": file_type,  # Correct column name
-                        "last_modified": last_modified,
-                        "is_favorite": False  # Default to False for updated entries
-                    }
-                )
-                
-                session.execute(stmt)
-                update_count += 1
+            account = session.get(CloudStorageAccount, account_id)
+            page_token = account.sync_cursor
+            changes = None
+
+            if page_token:
+                try:
+                    changes = apply_drive_changes(session, service, user_id, account_id, page_token)
+                except HttpError as e:
+                    if e.resp.status not in (400, 404, 410):
+                        raise
+                    session.rollback()
+                    logging.info(f"Drive change token of account {account_id} is no longer valid; listing all files")
+
+            if changes is not None:
+                counts, removed, page_token = changes
+                mode = "changes"
+            else:
+                # Taken before listing, so changes made during the listing are picked up next time
+                page_token = rate_limited("google_drive", service.changes().getStartPageToken().execute)["startPageToken"]
+                counts, removed = list_drive_files(session, service, user_id, account_id)
+                mode = "full listing"
 
+            account.sync_cursor = page_token
+            account.last_synced = datetime.utcnow()
             session.commit()
-            logging.info(f"✅ Synced {update_count} files (new + updated) from Google Drive (Account {account_id}) for user {user_id}")
+            notify_outbox(es_writer)
+            logging.info(f"✅ Synced Google Drive (Account {account_id}) for user {user_id} by {mode}: "
+                         f"{counts['inserted']} new, {counts['updated']} updated, {counts['unchanged']} unchanged (skipped), "
+                         f"{removed} removed")
+            return dict(counts, removed=removed)
 
         except Exception as e:
             session.rollback()
@@ -593,9 +1160,128 @@ def sync_google_drive(account_id, user_id):
 
         finally:
             session.remove()
+            google_clients.checkin(service)
+
+
+GMAIL_BATCH_SIZE = int(os.getenv("GMAIL_BATCH_SIZE", "100"))  # messages().get calls per batch HTTP request (max 100)
+GMAIL_LIST_PAGE_SIZE = 500  # Maximum messages().list and history().list allow
+GMAIL_PART_FIELDS = "filename,mimeType,body/attachmentId"
+# Only what attachment rows need; parts nest (multipart/mixed inside multipart/alternative, forwarded mail)
+GMAIL_MESSAGE_FIELDS = (f"id,internalDate,payload({GMAIL_PART_FIELDS},parts({GMAIL_PART_FIELDS},"
+                        f"parts({GMAIL_PART_FIELDS},parts)))")
+
+
+def gmail_attachment_records(user_id, account_id, message):
+    """Build the IndexedFile mappings of every attachment in a Gmail message."""
+    received = datetime.utcfromtimestamp(int(message.get("internalDate", 0)) / 1000)
+    records, parts = [], [message.get("payload", {})]
+    while parts:
+        part = parts.pop()
+        parts.extend(part.get("parts", []))
+        if part.get("filename") and "attachmentId" in part.get("body", {}):
+            filename = part["filename"]
+            attachment_id = part["body"]["attachmentId"]
+            records.append({
+                "user_id": user_id,
+                "account_id": account_id,
+                "filename": filename,
+                "filepath": f"gmail://{message['id']}/{attachment_id}",
+                "storage_type": "gmail",
+                "filetype": filename.split(".")[-1] if "." in filename else "unknown",
+                "cloud_file_id": attachment_id,
+                "mime_type": part.get("mimeType", "application/octet-stream"),
+                "last_modified": received,
+            })
+    return records
+
+
+def fetch_gmail_batch(service, message_ids):
+    """Fetch up to 100 messages in one batch HTTP request. Deleted ones are skipped."""
+    messages, errors = [], []
+
+    def collect(request_id, response, exception):
+        if exception is None:
+            messages.append(response)
+        elif not (isinstance(exception, HttpError) and exception.resp.status == 404):
+            errors.append(exception)
+
+    batch = service.new_batch_http_request(callback=collect)
+    for message_id in message_ids:
+        batch.add(service.users().messages().get(userId="me", id=message_id, format="full",
+                                                 fields=GMAIL_MESSAGE_FIELDS))
+    batch.execute()
+    if errors:
+        raise errors[0]  # A rate-limited part retries the whole batch
+    return messages
+
+
+def fetch_gmail_messages(service, message_ids):
+    """Fetch messages through the batch endpoint, GMAIL_BATCH_SIZE per HTTP request."""
+    messages = []
+    for start in range(0, len(message_ids), GMAIL_BATCH_SIZE):
+        chunk = message_ids[start:start + GMAIL_BATCH_SIZE]
+        messages.extend(rate_limited("gmail", fetch_gmail_batch, service, chunk, cost=len(chunk)))
+    return messages
+
+
+def list_gmail_pages(service):
+    """Yield the ids of messages with attachments, one listing page at a time."""
+    page_token = None
+    while True:
+        response = rate_limited("gmail", service.users().messages().list(
+            userId="me", q="has:attachment", maxResults=GMAIL_LIST_PAGE_SIZE,
+            fields="nextPageToken,messages/id", pageToken=page_token
+        ).execute)
+        yield [message["id"] for message in response.get("messages", [])]
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            break
+
+
+def gmail_history_pages(service, history_id):
+    """Yield (added ids, deleted ids, latest historyId) per page of mailbox history since `history_id`."""
+    page_token = None
+    while True:
+        response = rate_limited("gmail", service.users().history().list(
+            userId="me", startHistoryId=history_id, historyTypes=["messageAdded", "messageDeleted"],
+            maxResults=GMAIL_LIST_PAGE_SIZE, pageToken=page_token,
+            fields="nextPageToken,historyId,history(messagesAdded/message/id,messagesDeleted/message/id)"
+        ).execute)
+        added, deleted = [], []
+        for record in response.get("history", []):
+            added.extend(item["message"]["id"] for item in record.get("messagesAdded", []))
+            deleted.extend(item["message"]["id"] for item in record.get("messagesDeleted", []))
+        yield added, deleted, response.get("historyId", history_id)
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            break
+
+
+def delete_gmail_messages(session, account_id, message_ids):
+    """Delete the attachment rows of deleted Gmail messages, returning the filepaths removed."""
+    removed = []
+    prefixes = [f"gmail://{message_id}/" for message_id in set(message_ids)]
+    for start in range(0, len(prefixes), PREFIX_DELETE_BATCH_SIZE):
+        chunk = prefixes[start:start + PREFIX_DELETE_BATCH_SIZE]
+        removed.extend(session.scalars(
+            delete(IndexedFile)
+            .where(IndexedFile.account_id == account_id,
+                   # Each prefix LIKE is served by the filepath text_pattern_ops index
+                   or_(*(IndexedFile.filepath.startswith(prefix, autoescape=True) for prefix in chunk)))
+            .returning(IndexedFile.filepath)
+            .execution_options(synchronize_session=False)
+        ))
+    return removed
 
 
 def sync_gmail_attachments(account_id, user_id):
+    """Sync Gmail attachments of one Google account.
+
+    The first sync pages through every message with attachments; later ones
+    replay the mailbox history since the saved historyId, so only added and
+    deleted messages are fetched. Messages are fetched in batch requests with
+    only the fields attachment rows need. Each page is committed as it is done.
+    """
     print("entered gmail attacjments")
     access_token = get_access_token(account_id)
     if not access_token:
@@ -603,42 +1289,59 @@ def sync_gmail_attachments(account_id, user_id):
         return
     with current_app.app_context():
         session = scoped_session(sessionmaker(bind=db.engine))
-        creds = Credentials(token=access_token)
-        service = build("gmail", "v1", credentials=creds)
+        service = google_clients.checkout(account_id, access_token, "gmail", "v1")
 
         try:
-            messages = service.users().messages().list(userId="me", q="has:attachment").execute().get("messages", [])
-
-            for msg in messages:
-                message = service.users().messages().get(userId="me", id=msg["id"]).execute()
-                payload = message.get("payload", {})
-                parts = payload.get("parts", [])
-
-                for part in parts:
-                    if part.get("filename") and "attachmentId" in part.get("body", {}):
-                        filename = part["filename"]
-                        filetype = filename.split(".")[-1] if "." in filename else "unknown"
-                        attachment_id = part["body"]["attachmentId"]
-
-                        stmt = insert(IndexedFile).values(
-                            user_id=user_id,
-                            account_id=account_id,
-                            filename=filename,
-                            filepath=f"gmail://{msg['id']}/{attachment_id}",
-                            storage_type="gmail",
-                            filetype=filetype,
-                            cloud_file_id=attachment_id,
-                            mime_type=part.get("mimeType", "application/octet-stream"),
-                            last_modified=datetime.utcnow()
-                        ).on_conflict_do_update(
-                            index_elements=["filepath"],
-                            set_={"last_modified": datetime.utcnow()}
-                        )
-
-                        db.session.execute(stmt)
-
-            db.session.commit()
-            logging.info(f"✅ Synced Gmail attachments for user {user_id}")
+            account = session.get(CloudStorageAccount, account_id)
+            history_id = account.gmail_history_id
+            counts = Counter()
+            removed = 0
+
+            def apply_page(added, deleted):
+                nonlocal removed
+                gone = delete_gmail_messages(session, account_id, deleted)
+                records = [record for message in fetch_gmail_messages(service, added)
+                           for record in gmail_attachment_records(user_id, account_id, message)]
+                page_counts, written = bulk_upsert(session, records, MESSAGE_UPDATE_COLUMNS, MESSAGE_UPDATE_COLUMNS)
+                enqueue_outbox(session, written + gone)
+                session.commit()
+                counts.update(page_counts)
+                removed += len(gone)
+                return records
+
+            full = history_id is None
+            if not full:
+                try:
+                    for added, deleted, latest in gmail_history_pages(service, history_id):
+                        apply_page(added, deleted)
+                        history_id = latest
+                except HttpError as e:
+                    if e.resp.status != 404:
+                        raise
+                    session.rollback()
+                    logging.info(f"Gmail history of account {account_id} expired; listing all messages")
+                    full = True
+
+            if full:
+                # Taken before listing, so messages arriving during the listing are replayed next time
+                history_id = rate_limited("gmail", service.users().getProfile(userId="me").execute)["historyId"]
+                seen = set()
+                for message_ids in list_gmail_pages(service):
+                    seen.update(record["filepath"] for record in apply_page(message_ids, []))
+                known = session.scalars(
+                    select(IndexedFile.filepath).where(IndexedFile.account_id == account_id,
+                                                       IndexedFile.storage_type == "gmail")
+                ).all()
+                gone = delete_cloud_paths(session, account_id, [path for path in known if path not in seen])
+                enqueue_outbox(session, gone)
+                removed += len(gone)
+
+            account.gmail_history_id = str(history_id)
+            session.commit()
+            notify_outbox(es_writer)
+            logging.info(f"✅ Synced Gmail attachments for user {user_id}: {counts['inserted']} new, "
+                         f"{counts['updated']} updated, {counts['unchanged']} unchanged (skipped), {removed} removed")
+            return dict(counts, removed=removed)
 
         except Exception as e:
             session.rollback()
@@ -646,8 +1349,62 @@ def sync_gmail_attachments(account_id, user_id):
         
         finally:
             session.remove()
+            google_clients.checkin(service)
+
+PHOTOS_PAGE_SIZE = 100  # Maximum the Photos Library API allows
+PHOTOS_UPDATE_COLUMNS = MESSAGE_UPDATE_COLUMNS + ["last_modified"]  # last_modified is the item's creation time
+
+
+def parse_photos_time(value):
+    """Parse a Photos RFC 3339 timestamp (up to nanoseconds, "Z" suffix) into a naive UTC datetime."""
+    value = value.rstrip("Z")
+    if "." in value:
+        value, fraction = value.split(".", 1)
+        value = f"{value}.{fraction[:6]}"
+    return datetime.fromisoformat(value)
+
+
+def photos_item_record(user_id, account_id, item):
+    """Build the IndexedFile mapping of one Photos media item."""
+    filename = item.get("filename")
+    photo_id = item.get("id")
+    created = item.get("mediaMetadata", {}).get("creationTime")
+    return {
+        "user_id": user_id,
+        "account_id": account_id,
+        "filename": filename,
+        "filepath": f"photos://{photo_id}",
+        "storage_type": "google_photos",
+        "filetype": filename.split(".")[-1] if "." in filename else "image",
+        "cloud_file_id": photo_id,
+        "mime_type": item.get("mimeType", "image/jpeg"),
+        "last_modified": parse_photos_time(created) if created else datetime.utcnow(),
+    }
+
+
+def photos_pages(service, since=None):
+    """Yield pages of media items, newest first. With `since`, only days from then on are searched."""
+    body = {"pageSize": PHOTOS_PAGE_SIZE}
+    if since is not None:
+        body["filters"] = {"dateFilter": {"ranges": [{
+            "startDate": {"year": since.year, "month": since.month, "day": since.day},
+            "endDate": {"year": 9999, "month": 12, "day": 31},
+        }]}}
+    while True:
+        response = rate_limited("google_photos", service.mediaItems().search(body=body).execute)
+        yield response.get("mediaItems", [])
+        body["pageToken"] = response.get("nextPageToken")
+        if not body["pageToken"]:
+            break
+
 
 def sync_google_photos(account_id, user_id):
+    """Sync Google Photos media items of one Google account.
+
+    Every page is written in bulk as soon as it arrives. The newest creation
+    time seen is saved as a watermark, and later syncs stop paging at the first
+    item created before it, so an unchanged library costs a single request.
+    """
     access_token = get_access_token(account_id)
     if not access_token:
         logging.error(f"No valid access token for Google Photos (Account {account_id})")
@@ -655,53 +1412,32 @@ def sync_google_photos(account_id, user_id):
 
     with current_app.app_context():
         session = scoped_session(sessionmaker(bind=db.engine))
-        creds = Credentials(token=access_token)
-
-
-        photos_api_discovery_url = "https://photoslibrary.googleapis.com/$discovery/rest?version=v1"
-        service = build("photoslibrary", "v1", credentials=creds, discoveryServiceUrl=photos_api_discovery_url)
-
+        service = google_clients.checkout(account_id, access_token, "photoslibrary", "v1")
 
         try:
-            media_items = []
-            next_page_token = None
-
-            while True:
-                response = service.mediaItems().list(
-                    pageSize=100,
-                    pageToken=next_page_token
-                ).execute()
-
-                media_items.extend(response.get("mediaItems", []))
-                next_page_token = response.get("nextPageToken")
-                if not next_page_token:
-                    break
-
-            for item in media_items:
-                filename = item.get("filename")
-                mime_type = item.get("mimeType", "image/jpeg")
-                photo_id = item.get("id")
-                filetype = filename.split(".")[-1] if "." in filename else "image"
-
-                stmt = insert(IndexedFile).values(
-                    user_id=user_id,
-                    account_id=account_id,
-                    filename=filename,
-                    filepath=f"photos://{photo_id}",
-                    storage_type="google_photos",
-                    filetype=filetype,
-                    cloud_file_id=photo_id,
-                    mime_type=mime_type,
-                    last_modified=datetime.utcnow()
-                ).on_conflict_do_update(
-                    index_elements=["filepath"],
-                    set_={"last_modified": datetime.utcnow()}
-                )
-
-                db.session.execute(stmt)
-
-            db.session.commit()
-            logging.info(f"✅ Synced Google Photos for user {user_id}")
+            account = session.get(CloudStorageAccount, account_id)
+            watermark = account.photos_synced_until
+            newest = watermark
+            counts = Counter()
+
+            for items in photos_pages(service, watermark):
+                records = [photos_item_record(user_id, account_id, item) for item in items]
+                fresh = [record for record in records if watermark is None or record["last_modified"] > watermark]
+                page_counts, written = bulk_upsert(session, fresh, PHOTOS_UPDATE_COLUMNS, PHOTOS_UPDATE_COLUMNS)
+                enqueue_outbox(session, written)
+                session.commit()
+                counts.update(page_counts)
+                if fresh:
+                    newest = max([record["last_modified"] for record in fresh] + ([newest] if newest else []))
+                if len(fresh) < len(records):
+                    break  # Reached items the last sync already saw
+
+            account.photos_synced_until = newest
+            session.commit()
+            notify_outbox(es_writer)
+            logging.info(f"✅ Synced Google Photos for user {user_id}: {counts['inserted']} new, "
+                         f"{counts['updated']} updated, {counts['unchanged']} unchanged (skipped)")
+            return dict(counts)
 
         except Exception as e:
             session.rollback()
@@ -709,6 +1445,7 @@ def sync_google_photos(account_id, user_id):
         
         finally:
             session.remove()
+            google_clients.checkin(service)
 
 
 @search_bp.route("/index-files", methods=["POST"])
@@ -721,30 +1458,33 @@ def index_files():
         return jsonify({"error": "Elasticsearch is not available"}), 500
 
     drives = get_available_drives()
-    indexing_status[user_id] = "starting"
-
-    for drive in drives:
-        threading.Thread(target=index_files_worker, args=(user_id, drive)).start()
+    app = current_app._get_current_object()
+    started = [drive for drive in drives if schedule_index_job(app, user_id, drive) is not None]
 
-    return jsonify({"message": f"Indexing started for drives: {drives}"}), 202
+    if not started:
+        return jsonify({"message": f"Indexing already in progress for drives: {drives}",
+                        "queue": scheduler.stats(user_id)}), 200
+    return jsonify({"message": f"Indexing started for drives: {started}", "queue": scheduler.stats(user_id)}), 202
 
 
 
 @search_bp.route("/index-status", methods=["GET"])
 @jwt_required()
 def get_index_status():
-    """Check indexing status for the user."""
+    """Check indexing status for the user, from the persisted jobs so any worker can answer."""
     user_id = get_jwt_identity()
-    status = indexing_status.get(user_id, "not_started")
-    return jsonify({"status": status})
+    resume_stale_jobs(current_app._get_current_object(), user_id)
+    jobs = latest_jobs(user_id)
+    return jsonify({"status": overall_status(jobs), "jobs": jobs, "queue": scheduler.stats(user_id)})
 
 @search_bp.route("/search-files", methods=["GET"])
 @jwt_required()
 def search_files():
-    """Search files with fuzzy matching and pagination from both Elasticsearch and DB."""
+    """Search files with fuzzy matching and pagination in Elasticsearch, falling back to the DB if it fails.
 
-    if not check_elasticsearch():
-        return jsonify({"error": "Search service unavailable"}), 500
+    The outbox keeps file_index in step with the database, so ES alone answers
+    the query and pages through its hits.
+    """
 
     user_id = get_jwt_identity()
     query = request.args.get("q", "").strip()
@@ -757,12 +1497,6 @@ def search_files():
     if not query:
         return jsonify({"error": "Search query is required"}), 400
 
-    all_results = []
-    seen_keys = set()
-
-    def get_unique_key(storage_type, path):
-        return f"{storage_type}::{path}"
-
     # 1️⃣ Elasticsearch results
     try:
         should_clauses = []
@@ -809,6 +1543,13 @@ def search_files():
                             "case_insensitive": True
                         }
                     }
+                },
+                {
+                    "match": {
+                        "content": {
+                            "query": query
+                        }
+                    }
                 }
             ]
 
@@ -819,13 +1560,18 @@ def search_files():
                     "minimum_should_match": 1,
                     "filter": [
                         {"term": {"user_id": user_id}}
+                    ],
+                    "must_not": [
+                        {"exists": {"field": "id"}}  # Legacy "{user_id}_{filepath}" documents until purged
                     ]
                 }
             },
-            "size": 100  # Get max possible, pagination happens after merge
+            "from": offset,
+            "size": limit,
+            "track_total_hits": True
         }
 
-        if service_filter and service_filter != "local":
+        if service_filter:
             es_query["query"]["bool"]["filter"].append({
                 "term": {"storage_type": service_filter}
             })
@@ -836,64 +1582,128 @@ def search_files():
             })
 
         es_results = es.search(index="file_index", body=es_query)
-        for hit in es_results["hits"]["hits"]:
-            doc = hit["_source"]
-            path = doc.get("filepath") or doc.get("cloud_file_id")
-            key = get_unique_key(doc.get("storage_type"), path)
-            if key not in seen_keys:
-                all_results.append(doc)
-                seen_keys.add(key)
-            
+        results = [hit["_source"] for hit in es_results["hits"]["hits"]]
+        total_results = es_results["hits"]["total"]["value"]
 
     except Exception as e:
         logging.error(f"Elasticsearch error: {str(e)}")
 
-    # 2️⃣ DB fallback (always run alongside ES)
-    try:
-        with current_app.app_context():
-            session = scoped_session(sessionmaker(bind=db.engine))
+        # 2️⃣ DB fallback (only while Elasticsearch is failing)
+        try:
+            with current_app.app_context():
+                session = scoped_session(sessionmaker(bind=db.engine))
+
+                filters = [IndexedFile.user_id == user_id]
+
+                if query:
+                    filters.append(IndexedFile.filename.ilike(f"%{query.strip('*')}%"))
+                if service_filter:
+                    filters.append(IndexedFile.storage_type == service_filter)
+                if filetype_filter:
+                    filters.append(IndexedFile.filetype == filetype_filter)
+
+                db_query = session.query(IndexedFile).filter(*filters)
+                total_results = db_query.count()
+                db_files = db_query.order_by(IndexedFile.id).offset(offset).limit(limit).all()
+                session.remove()
+
+                results = [{
+                    "filename": file.filename,
+                    "cloud_file_id": file.cloud_file_id,
+                    "storage_type": file.storage_type,
+                    "filepath": file.filepath,
+                    "is_favorite": file.is_favorite,
+                } for file in db_files]
+        except Exception as e:
+            logging.error(f"DB fallback error: {str(e)}")
+            return jsonify({"error": "Search service unavailable"}), 500
 
-            filters = [IndexedFile.user_id == user_id]
+    print(f"Total results: {total_results}, Paginated results: {len(results)}")  # Debugging log
+    has_more = offset + len(results) < total_results
 
-            if query:
-                filters.append(IndexedFile.filename.ilike(f"%{query.strip('*')}%"))
-            if service_filter:
-                filters.append(IndexedFile.storage_type == service_filter)
-            if filetype_filter:
-                filters.append(IndexedFile.filetype == filetype_filter)
+    return jsonify({
+        "results": results,
+        "offset": offset + len(results),
+        "limit": limit,
+        "has_more": has_more
+    }), 200
 
-            db_files = session.query(IndexedFile).filter(*filters).all()
-            session.remove()
 
-            for file in db_files:
-                path = file.filepath or file.cloud_file_id
-                key = get_unique_key(file.storage_type, path)
-                if key not in seen_keys:
-                    all_results.append({
-                        "filename": file.filename,
-                        "cloud_file_id": file.cloud_file_id,
-                        "storage_type": file.storage_type,
-                        "filepath": file.filepath,
-                        "is_favorite": file.is_favorite,
-                    })
-                    seen_keys.add(key)
-    except Exception as e:
-        logging.error(f"DB fallback error: {str(e)}")
+@search_bp.route("/duplicates", methods=["GET"])
+@jwt_required()
+def get_duplicates():
+    """Report groups of identical files across local storage, Google Drive and Dropbox."""
+    user_id = get_jwt_identity()
+    limit = request.args.get("limit", 50, type=int)
+    offset = request.args.get("offset", 0, type=int)
 
-    # 3️⃣ Pagination after merging
-    total_results = len(all_results)
-    paginated = all_results[offset:offset + limit]
-    print(f"Total results: {total_results}, Paginated results: {len(paginated)}")  # Debugging log
-    has_more = offset + limit < total_results
+    try:
+        groups = find_duplicates(user_id)
+    except Exception as e:
+        logging.error(f"Duplicate search error: {str(e)}")
+        db.session.rollback()
+        return jsonify({"error": "Failed to find duplicates"}), 500
 
+    paginated = groups[offset:offset + limit]
     return jsonify({
-        "results": paginated,
+        "groups": [{
+            "size": files[0].size,
+            "wasted_bytes": files[0].size * (len(files) - 1),
+            "files": [file.to_dict() for file in files],
+        } for files in paginated],
+        "total_groups": len(groups),
         "offset": offset + len(paginated),
         "limit": limit,
-        "has_more": has_more
+        "has_more": offset + limit < len(groups)
     }), 200
 
 
+@search_bp.route("/exclusions", methods=["GET"])
+@jwt_required()
+def list_exclusions():
+    """List the exclusion rules applied to the user's crawls (global rules included)."""
+    user_id = get_jwt_identity()
+    rules = ExclusionRule.query.filter(
+        (ExclusionRule.user_id == user_id) | (ExclusionRule.user_id.is_(None))
+    ).order_by(ExclusionRule.id).all()
+    return jsonify({"rules": [rule.to_dict() for rule in rules]}), 200
+
+
+@search_bp.route("/exclusions", methods=["POST"])
+@jwt_required()
+def add_exclusion():
+    """Add an exclusion rule: a glob, max_size (bytes), allow_ext, deny_ext or max_depth."""
+    user_id = get_jwt_identity()
+    data = request.json or {}
+    kind = data.get("kind")
+    value = str(data.get("value") or "").strip()
+
+    error = validate_rule(kind, value)
+    if error:
+        return jsonify({"error": error}), 400
+
+    rule = ExclusionRule(user_id=user_id, kind=kind, value=value)
+    db.session.add(rule)
+    db.session.commit()
+    invalidate_exclusions(user_id)  # Crawl snapshots made under the old rules are ignored from now on
+    return jsonify(rule.to_dict()), 201
+
+
+@search_bp.route("/exclusions/<int:rule_id>", methods=["DELETE"])
+@jwt_required()
+def delete_exclusion(rule_id):
+    """Delete one of the user's exclusion rules."""
+    user_id = get_jwt_identity()
+    rule = ExclusionRule.query.filter_by(id=rule_id, user_id=user_id).first()
+    if not rule:
+        return jsonify({"error": "Rule not found"}), 404
+
+    db.session.delete(rule)
+    db.session.commit()
+    invalidate_exclusions(user_id)
+    return jsonify({"message": "Rule deleted"}), 200
+
+
 @search_bp.route("/open-file", methods=["POST"])
 @jwt_required()
 def open_file():
@@ -968,9 +1778,9 @@ def sync_google_drive_account():
         return jsonify({"error": "Account ID is required"}), 400
 
     try:
-        sync_google_drive(account_id, user_id)
+        counts = run_account_sync(("google_drive", account_id), sync_google_drive, account_id, user_id)
         print("synced gdrive");
-        return jsonify({"message": f"Google Drive sync started for account {account_id}"}), 200
+        return jsonify({"message": f"Google Drive sync started for account {account_id}", "counts": counts}), 200
     except Exception as e:
         logging.error(f"Error syncing Google Drive (Account {account_id}): {str(e)}")
         return jsonify({"error": "Failed to sync Google Drive"}), 500
@@ -989,9 +1799,9 @@ def sync_gmail():
 
     try:
 
-        sync_gmail_attachments(account_id,user_id)
+        counts = run_account_sync(("gmail", account_id), sync_gmail_attachments, account_id, user_id)
         print("sync gmail")
-        return jsonify({"message": f"Google Drive sync started for account {account_id}"}), 200
+        return jsonify({"message": f"Google Drive sync started for account {account_id}", "counts": counts}), 200
     except Exception as e:
         logging.error(f"Error syncing Google Drive (Account {account_id}): {str(e)}")
         return jsonify({"error": "Failed to sync Google Drive"}), 500
@@ -1010,9 +1820,9 @@ def sync_gphotos():
 
     try:
 
-        sync_google_photos(account_id,user_id)
+        counts = run_account_sync(("google_photos", account_id), sync_google_photos, account_id, user_id)
         print("synced google photos")
-        return jsonify({"message": f"Google Drive sync started for account {account_id}"}), 200
+        return jsonify({"message": f"Google Drive sync started for account {account_id}", "counts": counts}), 200
     except Exception as e:
         logging.error(f"Error syncing Google Drive (Account {account_id}): {str(e)}")
         return jsonify({"error": "Failed to sync Google Drive"}), 500
@@ -1036,8 +1846,8 @@ def sync_dropbox_account():
         return jsonify({"error": "Account ID is required"}), 400
 
     try:
-        sync_dropbox(account_id, user_id)
-        return jsonify({"message": f"Dropbox sync started for account {account_id}"}), 200
+        counts = run_account_sync(("dropbox", account_id), sync_dropbox, account_id, user_id)
+        return jsonify({"message": f"Dropbox sync started for account {account_id}", "counts": counts}), 200
     except Exception as e:
         logging.error(f"Error syncing Dropbox (Account {account_id}): {str(e)}")
         return jsonify({"error": "Failed to sync Dropbox"}), 500
@@ -1067,30 +1877,80 @@ def download_file():
     if not account:
         return jsonify({"error": "No linked Google Drive account"}), 400
 
-    access_token = account.access_token
+    access_token = get_access_token(account.id)
     if not access_token:
         return jsonify({"error": "Invalid Google Drive access token"}), 400
 
-    drive_service = build("drive", "v3", credentials=Credentials(token=access_token))
-    file_id = file_record.cloud_file_id
-
+    # Bounded memory: each stream holds one chunk at a time, and only DOWNLOAD_MAX_STREAMS run at once
+    if not download_slots.acquire(blocking=False):
+        response = jsonify({"error": "Too many downloads in progress, please retry shortly"})
+        response.headers["Retry-After"] = "5"
+        return response, 503
+
+    # Stream from Drive as bytes arrive, forwarding Range so downloads can resume and media can seek
+    headers = {"Authorization": f"Bearer {access_token}", "Accept-Encoding": "identity"}
+    range_header = flask_request.headers.get("Range")
+    if range_header:
+        headers["Range"] = range_header
     try:
-        drive_request = drive_service.files().get_media(fileId=file_id)
-        file_stream = io.BytesIO()
-        downloader = MediaIoBaseDownload(file_stream, drive_request)
-        done = False
-        while not done:
-            _, done = downloader.next_chunk()
-        file_stream.seek(0)
-        return send_file(
-            file_stream,
-            as_attachment=True,
-            download_name=file_record.filename,
-            mimetype=file_record.mime_type or "application/octet-stream"
-        )
+        upstream = drive_downloads.get(DRIVE_MEDIA_URL.format(file_id=file_record.cloud_file_id), headers=headers,
+                                       stream=True, timeout=(10, 60))
     except Exception as e:
+        download_slots.release()
         logging.error(f"Failed to download file from Google Drive: {str(e)}")
         return jsonify({"error": f"Failed to download file from Google Drive: {str(e)}"}), 500
+
+    if upstream.status_code not in (200, 206):
+        upstream.close()
+        download_slots.release()
+        logging.error(f"Failed to download file from Google Drive: HTTP {upstream.status_code}")
+        status = 416 if upstream.status_code == 416 else 502
+        return jsonify({"error": f"Failed to download file from Google Drive: HTTP {upstream.status_code}"}), status
+
+    # A complete download of an extractable file is also kept to index its text afterwards
+    keep = upstream.status_code == 200 and can_extract(file_record.filetype, file_record.size or 0)
+    record = {
+        "filepath": file_record.filepath,
+        "filename": file_record.filename,
+        "filetype": file_record.filetype,
+        "storage_type": file_record.storage_type,
+    }
+    app = current_app._get_current_object()
+
+    def generate():
+        # The copy is spooled to disk, so it costs no memory and reaches the extraction pool as a path
+        kept = tempfile.NamedTemporaryFile(prefix="download-", delete=False) if keep else None
+        try:
+            for chunk in upstream.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                if kept is not None:
+                    kept.write(chunk)
+                    if kept.tell() > EXTRACT_MAX_FILE_SIZE:
+                        discard(kept)  # Bigger than the index metadata said; stop keeping it
+                        kept = None
+                yield chunk
+            if kept is not None:
+                kept.close()
+                # Index the text of the downloaded file while we have it; the thread removes the copy
+                threading.Thread(target=index_downloaded_content, args=(app, es_writer, user_id, record, kept.name),
+                                 daemon=True).start()
+                kept = None
+        finally:
+            if kept is not None:
+                discard(kept)  # Client went away before the end
+
+    def close():
+        upstream.close()
+        download_slots.release()
+
+    response = Response(generate(), status=upstream.status_code,
+                        mimetype=file_record.mime_type or "application/octet-stream")
+    for name in ("Content-Length", "Content-Range"):
+        if name in upstream.headers:
+            response.headers[name] = upstream.headers[name]
+    response.headers["Accept-Ranges"] = "bytes"
+    response.headers.set("Content-Disposition", "attachment", filename=file_record.filename)
+    response.call_on_close(close)
+    return response
     
 
 
@@ -1110,7 +1970,9 @@ def toggle_favorite(file_path):
 
 
     file.is_favorite = not file.is_favorite
+    enqueue_outbox(db.session, [file.filepath])
     db.session.commit()
+    relay_now([file.filepath])  # Search shows the new state right away
 
     return jsonify({"message": "Favorite status updated", "file": file.to_dict()})
 
@@ -0,0 +1,129 @@
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+import httplib2
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+
+# APIs whose discovery document is not bundled with googleapiclient
+DISCOVERY_URLS = {
+    ("photoslibrary", "v1"): "https://photoslibrary.googleapis.com/$discovery/rest?version=v1",
+}
+DISCOVERY_CACHE_DIR = os.getenv("DISCOVERY_CACHE_DIR", os.path.join(tempfile.gettempdir(), "discovery-cache"))
+DISCOVERY_CACHE_SECONDS = 24 * 3600  # Downloaded documents are refreshed after a day
+GOOGLE_CLIENT_POOL_SIZE = int(os.getenv("GOOGLE_CLIENT_POOL_SIZE", "64"))  # Idle clients kept across all accounts
+GOOGLE_CLIENT_IDLE_SECONDS = float(os.getenv("GOOGLE_CLIENT_IDLE_SECONDS", "600"))  # Idle clients are closed after this
+
+_documents = {}  # (api, version) -> parsed discovery document
+_documents_lock = threading.Lock()
+
+
+def discovery_document(api, version):
+    """The parsed discovery document of an API: bundled, else from the disk cache, else downloaded once."""
+    key = (api, version)
+    with _documents_lock:
+        document = _documents.get(key)
+    if document is not None:
+        return document
+
+    content = get_static_doc(api, version)
+    if content is None:
+        path = os.path.join(DISCOVERY_CACHE_DIR, f"{api}.{version}.json")
+        try:
+            if time.time() - os.path.getmtime(path) < DISCOVERY_CACHE_SECONDS:
+                with open(path, encoding="utf-8") as f:
+                    content = f.read()
+        except OSError:
+            pass
+        if content is None:
+            response, body = httplib2.Http(timeout=30).request(DISCOVERY_URLS[key])
+            if response.status != 200:
+                raise RuntimeError(f"Could not fetch the {api} {version} discovery document: HTTP {response.status}")
+            content = body.decode("utf-8")
+            try:
+                os.makedirs(DISCOVERY_CACHE_DIR, exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(content)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logging.warning(f"Could not cache the {api} discovery document: {str(e)}")
+
+    document = json.loads(content)
+    with _documents_lock:
+        _documents[key] = document
+    return document
+
+
+class GoogleClientPool:
+    """Authorized Google API clients kept per (account, API) so their keep-alive connections are reused.
+
+    A client (and its httplib2 connection) serves one thread at a time: it is
+    checked out for a sync or a download and checked back in afterwards. Idle
+    clients are closed after `idle_seconds` and, beyond `size`, least recently
+    used first. A client built with an older access token is never handed out.
+    """
+
+    def __init__(self, size=GOOGLE_CLIENT_POOL_SIZE, idle_seconds=GOOGLE_CLIENT_IDLE_SECONDS):
+        self.size = size
+        self.idle_seconds = idle_seconds
+        self.idle = OrderedDict()  # id(client) -> (key, access token, checked in at, client), oldest first
+        self.checked_out = {}  # id(client) -> (key, access token)
+        self.lock = threading.Lock()
+
+    def checkout(self, account_id, access_token, api, version):
+        key = (str(account_id), api, version)
+        stale = []
+        client = None
+        with self.lock:
+            for client_id, (idle_key, token, _, idle_client) in list(self.idle.items()):
+                if idle_key != key:
+                    continue
+                del self.idle[client_id]
+                if token == access_token:
+                    client = idle_client
+                    break
+                stale.append(idle_client)
+        self._close(stale)
+        if client is None:
+            client = build_from_document(discovery_document(api, version),
+                                         credentials=Credentials(token=access_token))
+        with self.lock:
+            self.checked_out[id(client)] = (key, access_token)
+        return client
+
+    def checkin(self, client):
+        now = time.monotonic()
+        evicted = []
+        with self.lock:
+            key, token = self.checked_out.pop(id(client))
+            self.idle[id(client)] = (key, token, now, client)
+            for client_id, (_, _, since, idle_client) in list(self.idle.items()):
+                if len(self.idle) > self.size or now - since > self.idle_seconds:
+                    del self.idle[client_id]
+                    evicted.append(idle_client)
+        self._close(evicted)
+
+    def evict(self, account_id):
+        """Close the idle clients of an account (e.g. after it was unlinked)."""
+        with self.lock:
+            evicted = [client_id for client_id, (key, _, _, _) in self.idle.items() if key[0] == str(account_id)]
+            evicted = [self.idle.pop(client_id)[3] for client_id in evicted]
+        self._close(evicted)
+
+    @staticmethod
+    def _close(clients):
+        for client in clients:
+            try:
+                client.close()
+            except Exception:
+                pass
+
+
+google_clients = GoogleClientPool()
@@ -0,0 +1,271 @@
+import os
+import dbm
+import hashlib
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from sqlalchemy import select, update, bindparam
+from sqlalchemy.orm import sessionmaker
+
+from models import db, IndexedFile
+
+HASH_BLOCK_SIZE = 4 * 1024 * 1024  # Read size, and the block size of the Dropbox content-hash scheme
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+HASH_MAX_FILE_SIZE = int(os.getenv("HASH_MAX_FILE_SIZE", str(1024 ** 3)))  # Background hashing skips bigger files
+HASH_MAX_INFLIGHT_BYTES = int(os.getenv("HASH_MAX_INFLIGHT_BYTES", str(256 * 1024 ** 2)))  # Bytes being hashed at once
+HASH_BATCH_SIZE = 500  # Hashes written per UPDATE
+HASH_PARTIAL_BYTES = 64 * 1024  # Read from each end of a file for its partial hash
+HASH_CACHE_PATH = os.getenv("HASH_CACHE_PATH", os.path.join("instance", "hash_cache"))
+
+_pool = None
+_pool_lock = threading.Lock()
+_cache = None
+_cache_lock = threading.Lock()
+_running = {}  # user_id -> background hashing thread
+_requested = {}  # user_id -> {"then": callbacks, "paths": {algorithm: paths}} not yet served by a run
+_running_lock = threading.Lock()
+
+
+def content_hash(path):
+    """Hash a file with the Dropbox content-hash scheme: SHA-256 over the SHA-256 of each 4 MiB block.
+
+    Runs in pool worker processes, so it must stay a plain module-level function.
+    """
+    overall = hashlib.sha256()
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            block = f.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            overall.update(hashlib.sha256(block).digest())
+    return overall.hexdigest()
+
+
+def md5_hash(path):
+    """Plain MD5 of a file, for comparing local files with Google Drive's md5Checksum."""
+    digest = hashlib.md5()
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            block = f.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            digest.update(block)
+    return f"md5:{digest.hexdigest()}"
+
+
+def partial_hash(path):
+    """Hash the first and last HASH_PARTIAL_BYTES of a file, to rule out most same-size files cheaply."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        digest.update(f.read(HASH_PARTIAL_BYTES))
+        if os.fstat(f.fileno()).st_size > 2 * HASH_PARTIAL_BYTES:
+            f.seek(-HASH_PARTIAL_BYTES, os.SEEK_END)
+            digest.update(f.read(HASH_PARTIAL_BYTES))
+    return f"partial:{digest.hexdigest()}"
+
+
+_ALGORITHMS = {"content": content_hash, "md5": md5_hash, "partial": partial_hash}
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: the web process is full of threads and open sockets
+            _pool = ProcessPoolExecutor(max_workers=HASH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _cache_key(st, algorithm="content"):
+    prefix = "" if algorithm == "content" else f"{algorithm}:"
+    return f"{prefix}{st.st_dev}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}".encode()
+
+
+def _cache_get(st, algorithm="content"):
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            os.makedirs(os.path.dirname(HASH_CACHE_PATH), exist_ok=True)
+            _cache = dbm.open(HASH_CACHE_PATH, "c")
+        value = _cache.get(_cache_key(st, algorithm))
+    return value.decode() if value else None
+
+
+def _cache_put(st, digest, algorithm="content"):
+    with _cache_lock:
+        _cache[_cache_key(st, algorithm)] = digest.encode()
+
+
+def cached_hash(path, algorithm="content"):
+    """The cached hash of a file hashed before with the same (device, inode, size, mtime), else None.
+
+    `algorithm` is "content" (the content_hash scheme), "md5" or "partial".
+    """
+    return _cache_get(os.stat(path), algorithm)
+
+
+def hash_paths(paths, algorithm="content"):
+    """Hash files on the pool into the cache, skipping cached ones and ones over HASH_MAX_FILE_SIZE. Returns bytes read."""
+    pool = _get_pool()
+    inflight = {}  # future -> stat
+    inflight_bytes = 0
+    bytes_hashed = 0
+
+    def collect(done):
+        nonlocal inflight_bytes, bytes_hashed
+        for future in done:
+            st = inflight.pop(future)
+            inflight_bytes -= st.st_size
+            try:
+                digest = future.result()
+            except OSError:
+                continue
+            bytes_hashed += st.st_size
+            _cache_put(st, digest, algorithm)
+
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if st.st_size > HASH_MAX_FILE_SIZE or _cache_get(st, algorithm) is not None:
+            continue
+        while inflight and inflight_bytes + st.st_size > HASH_MAX_INFLIGHT_BYTES:
+            collect(wait(inflight, return_when=FIRST_COMPLETED).done)
+        inflight[pool.submit(_ALGORITHMS[algorithm], path)] = st
+        inflight_bytes += st.st_size
+    collect(wait(inflight).done)
+    return bytes_hashed
+
+
+def _flush(session, updates):
+    if not updates:
+        return
+    table = IndexedFile.__table__
+    session.execute(
+        update(table).where(table.c.id == bindparam("b_id")).values(content_hash=bindparam("b_hash")),
+        [{"b_id": row_id, "b_hash": digest} for row_id, digest in updates],
+    )
+    session.commit()
+    updates.clear()
+
+
+def hash_pending_files(user_id, progress=None):
+    """Fill content_hash for the user's local files that do not have one yet. Returns bytes read.
+
+    Bytes read are also counted as "bytes_hashed" on `progress` (a ProgressCounters), if given.
+    """
+    Session = sessionmaker(bind=db.engine)
+    reader, writer = Session(), Session()  # Committing must not close the streaming cursor
+    pool = _get_pool()
+    inflight = {}  # future -> (row id, stat)
+    inflight_bytes = 0
+    bytes_hashed = 0
+    updates = []
+
+    def collect(done):
+        nonlocal inflight_bytes, bytes_hashed
+        for future in done:
+            row_id, st = inflight.pop(future)
+            inflight_bytes -= st.st_size
+            try:
+                digest = future.result()
+            except OSError:
+                continue  # Deleted or unreadable since it was indexed
+            bytes_hashed += st.st_size
+            if progress is not None:
+                progress.add("bytes_hashed", st.st_size)
+            _cache_put(st, digest)
+            updates.append((row_id, digest))
+
+    try:
+        rows = reader.execute(
+            select(IndexedFile.id, IndexedFile.filepath).where(
+                IndexedFile.user_id == user_id,
+                IndexedFile.storage_type == "local",
+                IndexedFile.is_folder.is_(False),
+                IndexedFile.content_hash.is_(None),
+            ),
+            execution_options={"yield_per": HASH_BATCH_SIZE},
+        )
+
+        for row_id, filepath in rows:
+            try:
+                st = os.stat(filepath)
+            except OSError:
+                continue
+            if st.st_size > HASH_MAX_FILE_SIZE:
+                continue  # Too big to hash
+            digest = _cache_get(st)
+            if digest is not None:
+                updates.append((row_id, digest))
+            else:
+                # Throttle by size: keep the bytes being hashed at once under budget
+                while inflight and inflight_bytes + st.st_size > HASH_MAX_INFLIGHT_BYTES:
+                    done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                    collect(done)
+                inflight[pool.submit(content_hash, filepath)] = (row_id, st)
+                inflight_bytes += st.st_size
+                collect([future for future in inflight if future.done()])
+            if len(updates) >= HASH_BATCH_SIZE:
+                _flush(writer, updates)
+
+        collect(wait(inflight).done)
+        _flush(writer, updates)
+        logging.info(f"✅ Hashed local files for user {user_id}: {bytes_hashed} bytes read")
+        return bytes_hashed
+
+    except Exception:
+        writer.rollback()
+        raise
+
+    finally:
+        reader.close()
+        writer.close()
+
+
+def schedule_hashing(app, user_id, then=None, paths=None):
+    """Run hash_pending_files for the user in the background, at most once at a time per user.
+
+    `paths` ({algorithm: paths}) are also hashed into the cache, partial hashes
+    first. `then(user_id)` runs in the same thread once hashing is done, for stages
+    that need the hashes. Requests made while the user's hashing runs are merged
+    and served by one more run after it.
+    """
+    def run():
+        with app.app_context():
+            while True:
+                with _running_lock:
+                    request = _requested.pop(user_id, None)
+                    if request is None:
+                        _running.pop(user_id, None)
+                        return
+                try:
+                    if request["paths"].get("partial"):
+                        hash_paths(sorted(request["paths"]["partial"]), algorithm="partial")
+                    hash_pending_files(user_id)
+                    for algorithm, requested in request["paths"].items():
+                        if algorithm != "partial" and requested:
+                            hash_paths(sorted(requested), algorithm=algorithm)
+                except Exception as e:
+                    logging.error(f"❌ Error hashing files for user {user_id}: {str(e)}")
+                    continue
+                for callback in request["then"]:
+                    try:
+                        callback(user_id)
+                    except Exception as e:
+                        logging.error(f"❌ Error after hashing files for user {user_id}: {str(e)}")
+
+    with _running_lock:
+        request = _requested.setdefault(user_id, {"then": [], "paths": {}})
+        if then is not None and then not in request["then"]:
+            request["then"].append(then)
+        for algorithm, requested in (paths or {}).items():
+            request["paths"].setdefault(algorithm, set()).update(requested)
+        if user_id in _running:
+            return  # The running thread picks the request up when it is done
+        thread = threading.Thread(target=run, daemon=True, name=f"hashing-{user_id}")
+        _running[user_id] = thread
+    thread.start()
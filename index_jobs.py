@@ -0,0 +1,233 @@
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import select, update
+from sqlalchemy.orm import sessionmaker
+
+from models import db, IndexJob
+from progress import ProgressCounters
+
+JOB_CHECKPOINT_SECONDS = float(os.getenv("JOB_CHECKPOINT_SECONDS", "30"))  # Crawl progress persisted this often
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "15"))
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "120"))  # No heartbeat for this long: the worker is gone
+JOB_STATUS_LIMIT = 10  # Most recent jobs reported by /index-status
+
+ACTIVE_STATUSES = ("queued", "running")
+
+_owned = set()  # Ids of the jobs this process has queued or is running
+live_progress = {}  # job id -> ProgressCounters of the jobs running in this process
+_owned_lock = threading.Lock()
+_heartbeat_thread = None
+
+
+def _session():
+    return sessionmaker(bind=db.engine)()
+
+
+def _heartbeat(app):
+    """Keep every job owned by this process fresh with one UPDATE per interval, queued ones included."""
+    with app.app_context():
+        while True:
+            time.sleep(JOB_HEARTBEAT_SECONDS)
+            with _owned_lock:
+                job_ids = list(_owned)
+            if not job_ids:
+                continue
+            session = _session()
+            try:
+                session.execute(update(IndexJob).where(IndexJob.id.in_(job_ids))
+                                .values(updated_at=datetime.utcnow())
+                                .execution_options(synchronize_session=False))
+                session.commit()
+            except Exception as e:
+                logging.error(f"❌ Index job heartbeat failed: {str(e)}")
+            finally:
+                session.close()
+
+
+def _own(job_id):
+    global _heartbeat_thread
+    with _owned_lock:
+        _owned.add(job_id)
+        if _heartbeat_thread is None:
+            _heartbeat_thread = threading.Thread(target=_heartbeat, args=(current_app._get_current_object(),),
+                                                 daemon=True, name="index-job-heartbeat")
+            _heartbeat_thread.start()
+
+
+def _release(job_id):
+    with _owned_lock:
+        _owned.discard(job_id)
+
+
+def create_index_job(user_id, root, incremental=False):
+    """Persist a queued indexing job for one local root and return its id."""
+    session = _session()
+    try:
+        job = IndexJob(user_id=user_id, root=root, incremental=incremental, status="queued")
+        session.add(job)
+        session.commit()
+        _own(job.id)
+        return job.id
+    finally:
+        session.close()
+
+
+def has_active_job(user_id, root):
+    """True if a live worker is already indexing `root` for the user."""
+    session = _session()
+    try:
+        cutoff = datetime.utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+        return session.scalar(select(IndexJob.id).where(
+            IndexJob.user_id == user_id, IndexJob.root == root,
+            IndexJob.status.in_(ACTIVE_STATUSES), IndexJob.updated_at >= cutoff,
+        ).limit(1)) is not None
+    finally:
+        session.close()
+
+
+def claim_stale_jobs(user_id=None):
+    """Take over jobs whose worker stopped sending heartbeats. Returns (id, user_id, root, incremental) rows.
+
+    Each job is claimed with a compare-and-set on its heartbeat, so when several
+    workers look at the same stale job only one of them resumes it.
+    """
+    session = _session()
+    claimed = []
+    try:
+        cutoff = datetime.utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+        stmt = select(IndexJob.id, IndexJob.user_id, IndexJob.root, IndexJob.incremental, IndexJob.updated_at).where(
+            IndexJob.status.in_(ACTIVE_STATUSES), IndexJob.updated_at < cutoff)
+        if user_id is not None:
+            stmt = stmt.where(IndexJob.user_id == user_id)
+        for job_id, job_user_id, root, incremental, seen in session.execute(stmt).all():
+            result = session.execute(
+                update(IndexJob)
+                .where(IndexJob.id == job_id, IndexJob.updated_at == seen)
+                .values(status="running", updated_at=datetime.utcnow())
+                .execution_options(synchronize_session=False)
+            )
+            session.commit()
+            if result.rowcount == 1:
+                _own(job_id)
+                claimed.append((job_id, job_user_id, root, incremental))
+        return claimed
+    finally:
+        session.close()
+
+
+def latest_jobs(user_id, limit=JOB_STATUS_LIMIT):
+    """The user's most recent jobs, with live counters for those running in this process.
+
+    Jobs running elsewhere report the counters of their last checkpoint.
+    """
+    session = _session()
+    try:
+        jobs = session.scalars(
+            select(IndexJob).where(IndexJob.user_id == user_id).order_by(IndexJob.id.desc()).limit(limit)
+        ).all()
+        jobs = [job.to_dict() for job in jobs]
+    finally:
+        session.close()
+    for job in jobs:
+        progress = live_progress.get(job["id"])
+        if progress is not None:
+            job["counters"] = progress.report()
+    return jobs
+
+
+def overall_status(jobs):
+    """Collapse the latest jobs of a user into the single status /index-status always returned."""
+    jobs = [job for job in jobs if job["status"] != "cancelled"]
+    if not jobs:
+        return "not_started"
+    statuses = {job["status"] for job in jobs}
+    if "running" in statuses:
+        return "in_progress"
+    if "queued" in statuses:
+        return "starting"
+    return jobs[0]["status"]
+
+
+class JobRun:
+    """The running side of one IndexJob: periodic checkpoints and the final status.
+
+    `frontier` holds what the last checkpoint saved, so a resumed run restarts
+    its crawl from there, and `progress` keeps counting from the saved counters.
+    """
+
+    def __init__(self, job_id):
+        session = _session()
+        try:
+            job = session.get(IndexJob, job_id)
+            self.id = job.id
+            self.user_id = job.user_id
+            self.root = job.root
+            self.incremental = job.incremental
+            self.frontier = job.frontier
+            self.progress = ProgressCounters(job.counters)
+        finally:
+            session.close()
+        self.last_checkpoint = time.monotonic()
+
+    @property
+    def resumed(self):
+        return self.frontier is not None
+
+    def _update(self, **values):
+        session = _session()
+        try:
+            session.execute(update(IndexJob).where(IndexJob.id == self.id)
+                            .values(updated_at=datetime.utcnow(), **values)
+                            .execution_options(synchronize_session=False))
+            session.commit()
+        finally:
+            session.close()
+
+    def start(self):
+        _own(self.id)
+        live_progress[self.id] = self.progress
+        self._update(status="running")
+
+    def due(self):
+        return time.monotonic() - self.last_checkpoint >= JOB_CHECKPOINT_SECONDS
+
+    def checkpoint(self, frontier=None):
+        """Persist the counters and the directories left to crawl. Everything outside them must already be written.
+
+        With `frontier` None only the counters are saved and the resume point stays where it was.
+        """
+        self.last_checkpoint = time.monotonic()
+        if frontier is None:
+            self._update(counters=self.progress.snapshot())
+        else:
+            self._update(frontier=frontier, counters=self.progress.snapshot())
+
+    def set_phase(self, phase):
+        self.progress.phase = phase
+        self.checkpoint()
+
+    def finish(self, status, error=None):
+        _release(self.id)
+        live_progress.pop(self.id, None)
+        self.progress.phase = status
+        self._update(status=status, frontier=None, counters=self.progress.snapshot(),
+                     finished_at=datetime.utcnow(), error=error)
+
+
+def cancel_index_job(job_id, reason):
+    """Close a job that will not run, e.g. because the same root is already being indexed."""
+    _release(job_id)
+    session = _session()
+    try:
+        session.execute(update(IndexJob).where(IndexJob.id == job_id)
+                        .values(status="cancelled", error=reason, frontier=None,
+                                updated_at=datetime.utcnow(), finished_at=datetime.utcnow())
+                        .execution_options(synchronize_session=False))
+        session.commit()
+    finally:
+        session.close()
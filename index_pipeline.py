@@ -0,0 +1,95 @@
+import logging
+import queue
+import threading
+
+INDEX_BATCH_SIZE = 1000  # Records per DB transaction / ES bulk request
+INDEX_QUEUE_BATCHES = 4  # Batches buffered per writer before the crawl blocks
+
+_CLOSE = object()
+
+
+class BatchPipeline:
+    """Fan fixed-size batches of records out to concurrent writer threads through bounded queues.
+
+    `writers` maps a name to a callable taking one batch (a list). Each writer runs
+    in its own thread, inside `app.app_context()` when an app is given. A batch
+    that fails is logged and counted, and the writer moves on, so one bad batch
+    never loses the rest of the run. Because the queues are bounded, `add`
+    blocks when writers fall behind and memory stays flat however large the input.
+    """
+
+    def __init__(self, writers, app=None, batch_size=INDEX_BATCH_SIZE, queue_batches=INDEX_QUEUE_BATCHES):
+        self.app = app
+        self.batch_size = batch_size
+        self.buffer = []
+        self.written = {name: 0 for name in writers}
+        self.failed = {name: 0 for name in writers}
+        self.queues = {name: queue.Queue(maxsize=queue_batches) for name in writers}
+        self.threads = [
+            threading.Thread(target=self._run, args=(name, writer), daemon=True, name=f"index-writer-{name}")
+            for name, writer in writers.items()
+        ]
+        self.closed = False
+        for thread in self.threads:
+            thread.start()
+
+    def _run(self, name, writer):
+        if self.app is not None:
+            with self.app.app_context():
+                self._drain(name, writer)
+        else:
+            self._drain(name, writer)
+
+    def _drain(self, name, writer):
+        q = self.queues[name]
+        while True:
+            batch = q.get()
+            if batch is _CLOSE:
+                return
+            if isinstance(batch, threading.Event):
+                batch.set()  # Barrier marker: every batch queued before it is done
+                continue
+            try:
+                writer(batch)
+                self.written[name] += len(batch)
+            except Exception as e:
+                self.failed[name] += len(batch)
+                logging.error(f"❌ {name} writer failed on a batch of {len(batch)}: {str(e)}")
+
+    def add(self, record):
+        self.buffer.append(record)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        batch, self.buffer = self.buffer, []
+        for q in self.queues.values():
+            q.put(batch)
+
+    def barrier(self):
+        """Flush and block until every writer has finished everything added so far."""
+        self.flush()
+        markers = []
+        for q in self.queues.values():
+            marker = threading.Event()
+            q.put(marker)
+            markers.append(marker)
+        for marker in markers:
+            marker.wait()
+
+    def close(self):
+        """Flush the last partial batch and wait for every writer to finish."""
+        if self.closed:
+            return
+        self.closed = True
+        self.flush()
+        for q in self.queues.values():
+            q.put(_CLOSE)
+        for thread in self.threads:
+            thread.join()
+
+    @property
+    def ok(self):
+        return not any(self.failed.values())
@@ -0,0 +1,430 @@
+import os
+import errno
+import ctypes
+import select
+import struct
+import logging
+import threading
+import time
+
+from watchdog.events import (FileSystemEventHandler, FileCreatedEvent, DirCreatedEvent, FileModifiedEvent,
+                             FileDeletedEvent, DirDeletedEvent, FileMovedEvent, DirMovedEvent)
+from watchdog.observers import Observer
+
+from exclusions import load_exclusions
+
+try:
+    from watchdog.observers.inotify_c import InotifyConstants, inotify_init, inotify_add_watch, inotify_rm_watch
+except Exception:  # Not Linux: watchdog's native observer watches a whole tree through one handle
+    inotify_init = None
+
+WATCH_DEBOUNCE_SECONDS = 2.0  # Quiet period that closes a burst of events
+WATCH_MAX_BATCH_DELAY = 10.0  # Flush a never-ending burst at least this often
+WATCH_MOVE_PAIR_SECONDS = 0.5  # A move-out not followed by its move-in this quickly left the tree
+WATCH_RECONCILE_RETRY_SECONDS = 30  # Retry queuing a catch-up crawl this often while one is already running
+
+local_watchers = {}  # (user_id, root) -> LocalWatcher
+local_watchers_lock = threading.Lock()
+
+
+class _ChangeCollector(FileSystemEventHandler):
+    """Coalesce raw filesystem events into one pending batch of moves, upserts and deletes."""
+
+    def __init__(self, root, rules):
+        self.root = root
+        self.rules = rules  # Callable returning the ExclusionRules the crawler applies to this root
+        self.lock = threading.Lock()
+        self.pending = {}  # path -> "upsert" | "stat" | "delete"
+        self.moves = []  # (src, dest) of indexed paths
+        self.first_event_at = None
+        self.last_event_at = None
+
+    def _touch(self):
+        now = time.monotonic()
+        if self.first_event_at is None:
+            self.first_event_at = now
+        self.last_event_at = now
+
+    def _covered_by_move(self, src, dest):
+        """True for the per-child move events watchdog emits after a folder rename."""
+        for moved_src, moved_dest in self.moves:
+            if src.startswith(moved_src + os.sep) and dest == moved_dest + src[len(moved_src):]:
+                return True
+        return False
+
+    def on_any_event(self, event):
+        if event.event_type not in ("created", "modified", "deleted", "moved"):
+            return  # opened/closed events carry no index change
+        if event.event_type == "modified" and event.is_directory:
+            return  # Children report their own events
+
+        src = os.fsdecode(event.src_path)
+        rules = self.rules()
+        with self.lock:
+            if event.event_type == "moved":
+                dest = os.fsdecode(event.dest_path)
+                src_excluded, dest_excluded = rules.excludes_path(src), rules.excludes_path(dest)
+                previous = None
+                if not src_excluded:
+                    if self._covered_by_move(src, dest):
+                        return  # Its rows move with the folder
+                    previous = self.pending.pop(src, None)
+                    self._move_pending(src, None if dest_excluded else dest)
+                    if dest_excluded:
+                        self.pending[src] = "delete"
+                    else:
+                        self.moves.append((src, dest))
+                if not dest_excluded:
+                    # Rows moved in place only need the destination refreshed; paths new to the index are crawled
+                    self.pending[dest] = "upsert" if src_excluded or previous == "upsert" else "stat"
+            elif rules.excludes_path(src):
+                return
+            elif event.event_type == "deleted":
+                self.pending[src] = "delete"
+            else:
+                self.pending[src] = "upsert"
+            self._touch()
+
+    def _move_pending(self, src, dest):
+        """Carry pending paths below a moved folder over to its destination (or drop them if it left the index)."""
+        prefix = src + os.sep
+        for path in [path for path in self.pending if path.startswith(prefix)]:
+            action = self.pending.pop(path)
+            if dest is not None:
+                self.pending[dest + path[len(src):]] = action
+
+    def take_batch(self):
+        """Return (moves, upserts, stats, deletes) once the burst has settled, otherwise None."""
+        with self.lock:
+            if self.last_event_at is None:
+                return None
+            now = time.monotonic()
+            if (now - self.last_event_at < WATCH_DEBOUNCE_SECONDS
+                    and now - self.first_event_at < WATCH_MAX_BATCH_DELAY):
+                return None
+            moves, pending = self.moves, self.pending
+            self.moves, self.pending = [], {}
+            self.first_event_at = self.last_event_at = None
+        upserts = [path for path, action in pending.items() if action == "upsert"]
+        stats = [path for path, action in pending.items() if action == "stat"]
+        deletes = [path for path, action in pending.items() if action == "delete"]
+        return moves, upserts, stats, deletes
+
+
+class PrunedInotify:
+    """inotify watches on exactly the directories a crawl of the root lists.
+
+    Excluded trees (node_modules, .git, caches) get no watch at all, so they
+    neither use up the inotify watch limit nor flood the collector with events
+    the rules would throw away. Watches follow folders as they are created,
+    moved and deleted. Events are handed to `handler` as watchdog events;
+    `on_lost` is called when events were lost (queue overflow, watch limit hit
+    on a new folder) and the index must be reconciled by a crawl.
+    """
+
+    MASK = (InotifyConstants.IN_MODIFY | InotifyConstants.IN_ATTRIB | InotifyConstants.IN_CREATE
+            | InotifyConstants.IN_DELETE | InotifyConstants.IN_MOVED_FROM | InotifyConstants.IN_MOVED_TO
+            | InotifyConstants.IN_DELETE_SELF | InotifyConstants.IN_MOVE_SELF | InotifyConstants.IN_ONLYDIR
+            | InotifyConstants.IN_DONT_FOLLOW | InotifyConstants.IN_EXCL_UNLINK) if inotify_init else 0
+    READ_SIZE = 64 * 1024
+
+    def __init__(self, root, rules, handler, on_lost):
+        self.root = root
+        self.rules = rules  # Callable returning the ExclusionRules of the root
+        self.handler = handler
+        self.on_lost = on_lost
+        self.fd = None
+        self.wakeup = None  # (read end, write end) of the pipe that interrupts the reader
+        self.paths = {}  # watch descriptor -> directory
+        self.wds = {}  # directory -> watch descriptor
+        self.moved_from = {}  # cookie -> (path, is directory, seen at) awaiting its IN_MOVED_TO
+        self.thread = threading.Thread(target=self._run, daemon=True, name="local-watcher-inotify")
+
+    def start(self):
+        """Watch the pruned tree. Raises OSError when inotify watch/instance limits are exhausted."""
+        fd = inotify_init()
+        if fd == -1:
+            raise self._error()
+        self.fd = fd
+        self.wakeup = os.pipe()
+        try:
+            self.watch_tree(self.root, self.rules())
+        except OSError:
+            self._close()
+            raise
+        self.thread.start()
+
+    def stop(self):
+        wakeup = self.wakeup
+        if wakeup is not None and self.thread.is_alive():
+            try:
+                os.write(wakeup[1], b"!")
+            except OSError:
+                pass  # Already closed by the reader
+
+    def is_alive(self):
+        return self.thread.is_alive()
+
+    @staticmethod
+    def _error(path=None):
+        err = ctypes.get_errno()
+        return OSError(err, os.strerror(err), path)
+
+    def _close(self):
+        fds, self.wakeup = (self.fd, *(self.wakeup or ())), None
+        for fd in fds:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def _add(self, path):
+        wd = inotify_add_watch(self.fd, os.fsencode(path), self.MASK)
+        if wd == -1:
+            e = self._error(path)
+            if e.errno in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                return False  # Gone, replaced or unreadable: a crawl would skip it too
+            raise e
+        self.paths[wd] = path
+        self.wds[path] = wd
+        return True
+
+    def watch_tree(self, top, rules):
+        """Watch `top` and every directory below it that the rules let a crawl list."""
+        if top != self.root and (rules.excludes_path(top) or not rules.descend(rules.depth(top))):
+            return
+        stack = [top]
+        while stack:
+            path = stack.pop()
+            if not self._add(path):
+                continue
+            depth = rules.depth(path) + 1
+            if not rules.descend(depth):
+                continue
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False) and not rules.skip_dir(entry.name, entry.path):
+                            stack.append(entry.path)
+            except OSError:
+                continue
+
+    def unwatch_tree(self, top):
+        for path in [path for path in self.wds if path == top or path.startswith(top + os.sep)]:
+            wd = self.wds.pop(path)
+            self.paths.pop(wd, None)
+            inotify_rm_watch(self.fd, wd)
+
+    def rename_tree(self, src, dest):
+        for path in [path for path in self.wds if path == src or path.startswith(src + os.sep)]:
+            wd = self.wds.pop(path)
+            new = dest + path[len(src):]
+            self.wds[new] = wd
+            self.paths[wd] = new
+
+    def _run(self):
+        try:
+            while True:
+                readable, _, _ = select.select([self.fd, self.wakeup[0]], [], [], WATCH_MOVE_PAIR_SECONDS)
+                if self.wakeup[0] in readable:
+                    return
+                if self.fd in readable:
+                    if not self._handle(os.read(self.fd, self.READ_SIZE)):
+                        return
+                self._expire_moves()
+        except Exception as e:
+            logging.error(f"❌ Watching {self.root} stopped: {str(e)}")
+            self.on_lost()
+        finally:
+            self._close()
+
+    def _expire_moves(self, everything=False):
+        now = time.monotonic()
+        for cookie, (path, is_dir, seen_at) in list(self.moved_from.items()):
+            if everything or now - seen_at >= WATCH_MOVE_PAIR_SECONDS:
+                del self.moved_from[cookie]
+                if is_dir:
+                    self.unwatch_tree(path)  # Moved out of the tree; the watches would follow it
+                self.handler.dispatch(DirDeletedEvent(path) if is_dir else FileDeletedEvent(path))
+
+    def _handle(self, buffer):
+        """Translate one read of inotify events. Returns False once the root itself is gone."""
+        rules = self.rules()
+        offset = 0
+        while offset + 16 <= len(buffer):
+            wd, mask, cookie, length = struct.unpack_from("iIII", buffer, offset)
+            name = os.fsdecode(buffer[offset + 16:offset + 16 + length].rstrip(b"\0"))
+            offset += 16 + length
+
+            if mask & InotifyConstants.IN_Q_OVERFLOW:
+                logging.warning(f"⚠️ inotify queue overflowed watching {self.root}; events were lost")
+                self._expire_moves(everything=True)
+                self.on_lost()
+                continue
+            if mask & InotifyConstants.IN_IGNORED:
+                path = self.paths.pop(wd, None)
+                if path is not None and self.wds.get(path) == wd:
+                    del self.wds[path]
+                continue
+            directory = self.paths.get(wd)
+            if directory is None:
+                continue
+            path = os.path.join(directory, name) if name else directory
+            is_dir = bool(mask & InotifyConstants.IN_ISDIR)
+
+            if mask & (InotifyConstants.IN_DELETE_SELF | InotifyConstants.IN_MOVE_SELF):
+                if path == self.root:
+                    logging.warning(f"⚠️ Watched root {self.root} was removed or moved")
+                    self.on_lost()
+                    return False
+                continue  # The parent directory reports it
+            try:
+                if mask & InotifyConstants.IN_MOVED_FROM:
+                    self.moved_from[cookie] = (path, is_dir, time.monotonic())
+                elif mask & InotifyConstants.IN_MOVED_TO:
+                    moved = self.moved_from.pop(cookie, None)
+                    if moved is None:
+                        self.handler.dispatch(DirCreatedEvent(path) if is_dir else FileCreatedEvent(path))
+                        if is_dir:
+                            self.watch_tree(path, rules)
+                        continue
+                    src = moved[0]
+                    self.handler.dispatch(DirMovedEvent(src, path) if is_dir else FileMovedEvent(src, path))
+                    if is_dir:
+                        watched = src in self.wds
+                        self.rename_tree(src, path)
+                        if rules.excludes_path(path):
+                            self.unwatch_tree(path)
+                        elif not watched:
+                            self.watch_tree(path, rules)  # Moved in from an excluded folder
+                elif mask & InotifyConstants.IN_CREATE:
+                    self.handler.dispatch(DirCreatedEvent(path) if is_dir else FileCreatedEvent(path))
+                    if is_dir:
+                        self.watch_tree(path, rules)  # Its contents so far are picked up by crawling it
+                elif mask & InotifyConstants.IN_DELETE:
+                    self.handler.dispatch(DirDeletedEvent(path) if is_dir else FileDeletedEvent(path))
+                elif mask & (InotifyConstants.IN_MODIFY | InotifyConstants.IN_ATTRIB) and not is_dir:
+                    self.handler.dispatch(FileModifiedEvent(path))
+            except OSError as e:
+                if e.errno != errno.ENOSPC:
+                    raise
+                # A new folder could not be watched: stop, so the root is polled instead
+                logging.warning(f"⚠️ inotify limits exhausted watching {self.root}, falling back to polling")
+                self.on_lost()
+                return False
+        return True
+
+
+class LocalWatcher:
+    """Real-time indexer for one user's local root, fed by inotify (watchdog's observer elsewhere).
+
+    When events are lost (a batch fails to apply, the inotify queue overflows)
+    the root's snapshot is dropped and an incremental crawl is queued, which
+    re-diffs the whole tree against the database.
+    """
+
+    def __init__(self, app, user_id, root):
+        self.app = app
+        self.user_id = user_id
+        self.root = os.path.abspath(root)
+        self.collector = _ChangeCollector(self.root, self.rules)
+        self.observer = None
+        self.stopped = threading.Event()
+        self.reconcile_needed = threading.Event()
+        self.reconcile_tried_at = None
+        self.flush_thread = threading.Thread(target=self._flush_loop, daemon=True,
+                                             name=f"local-watcher-{user_id}")
+
+    def rules(self):
+        with self.app.app_context():
+            return load_exclusions(self.user_id, self.root)
+
+    def start(self):
+        """Start watching. Raises OSError when inotify watch/instance limits are exhausted."""
+        if inotify_init is not None:
+            self.observer = PrunedInotify(self.root, self.rules, self.collector, self.reconcile_needed.set)
+        else:
+            self.observer = Observer()
+            self.observer.schedule(self.collector, self.root, recursive=True)
+        self.observer.start()
+        self.flush_thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        try:
+            self.observer.stop()
+        except Exception:
+            pass
+
+    def is_alive(self):
+        return (not self.stopped.is_set() and self.observer is not None and self.observer.is_alive()
+                and self.flush_thread.is_alive())
+
+    def _reconcile(self):
+        from file_search import reconcile_local_root
+
+        now = time.monotonic()
+        if self.reconcile_tried_at is not None and now - self.reconcile_tried_at < WATCH_RECONCILE_RETRY_SECONDS:
+            return
+        self.reconcile_tried_at = now
+        with self.app.app_context():
+            try:
+                if reconcile_local_root(self.app, self.user_id, self.root) is None:
+                    return  # A crawl of the root is already queued or running; try again after it
+            except Exception as e:
+                logging.error(f"❌ Could not queue a catch-up crawl of {self.root}: {str(e)}")
+                return
+        self.reconcile_needed.clear()
+        self.reconcile_tried_at = None
+
+    def _flush_loop(self):
+        from file_search import apply_local_changes
+
+        while not self.stopped.wait(0.5):
+            if self.reconcile_needed.is_set():
+                self._reconcile()
+            batch = self.collector.take_batch()
+            if batch is None:
+                continue
+            moves, upserts, stats, deletes = batch
+            with self.app.app_context():
+                try:
+                    apply_local_changes(self.user_id, self.root, moves, upserts, deletes, stats)
+                except Exception as e:
+                    logging.error(f"❌ Error applying watched changes for user {self.user_id}: {str(e)}")
+                    self.reconcile_needed.set()  # The batch is lost; a crawl picks its changes up
+
+
+def ensure_local_watcher(app, user_id, root):
+    """Make sure a live watcher covers `root` for the user. Returns False if polling must be used instead."""
+    key = (user_id, os.path.abspath(root))
+    with local_watchers_lock:
+        watcher = local_watchers.get(key)
+        if watcher is not None and watcher.is_alive():
+            return True
+        if watcher is not None:
+            watcher.stop()
+
+        watcher = LocalWatcher(app, user_id, root)
+        try:
+            watcher.start()
+        except OSError as e:
+            watcher.stop()
+            local_watchers.pop(key, None)
+            if e.errno in (errno.ENOSPC, errno.EMFILE):
+                logging.warning(f"⚠️ inotify limits exhausted watching {root}, falling back to polling")
+            else:
+                logging.error(f"❌ Could not watch {root}: {str(e)}")
+            return False
+
+        local_watchers[key] = watcher
+        print(f"👀 Watching {root} for user {user_id}")
+        return True
+
+
+def stop_local_watchers():
+    """Stop every running watcher."""
+    with local_watchers_lock:
+        for watcher in local_watchers.values():
+            watcher.stop()
+        local_watchers.clear()
@@ -0,0 +1,28 @@
+"""seeded index outbox
+
+Revision ID: 3b7e5f0a2c94
+Revises: a6e0c9d3f58b
+Create Date: 2026-10-18 19:02:47.118305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b7e5f0a2c94'
+down_revision = 'a6e0c9d3f58b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Rows indexed before the outbox existed (cloud rows were never in file_index) are relayed once
+    op.execute(
+        "INSERT INTO index_outbox (doc_id, created_at) "
+        "SELECT filepath, CURRENT_TIMESTAMP FROM indexed_file"
+    )
+
+
+def downgrade():
+    pass
@@ -69,6 +69,12 @@ from datetime import datetime
 from models import db
 
 class IndexedFile(db.Model):
+    __table_args__ = (
+        db.Index("ix_indexed_file_user_id_size", "user_id", "size"),
+        # Serves "filepath LIKE 'folder/%'" (deletes and renames of whole folders)
+        db.Index("ix_indexed_file_filepath_pattern", "filepath", postgresql_ops={"filepath": "text_pattern_ops"}),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # ForeignKey for user association
     account_id = db.Column(db.Integer, db.ForeignKey('cloud_storage_account.id'), nullable=True)  # ForeignKey for cloud storage account
@@ -76,7 +82,9 @@ class IndexedFile(db.Model):
     filepath = db.Column(db.String(512), nullable=False, unique=True)  # Local or cloud path
     filetype = db.Column(db.String(500), nullable=False)  # Ensure this field exists
     is_folder = db.Column(db.Boolean, nullable=False, default=False)  
+    size = db.Column(db.BigInteger, nullable=True)  # Bytes, when known
     content_hash = db.Column(db.String(64), nullable=True)  # Optional for text search
+    extracted_hash = db.Column(db.String(64), nullable=True)  # content_hash whose text is in file_index
     created_at = db.Column(db.DateTime, default=datetime.utcnow)  # Timestamp
     
     is_favorite = db.Column(db.Boolean, nullable=False, default=False)
@@ -101,6 +109,7 @@ class IndexedFile(db.Model):
         "filepath": self.filepath,
         "filetype": self.filetype,
         "is_folder": self.is_folder,
+        "size": self.size,
         "storage_type": self.storage_type,
         "cloud_file_id": self.cloud_file_id,
         "mime_type": self.mime_type,
@@ -110,6 +119,21 @@ class IndexedFile(db.Model):
         }
 
 
+# Serves Dropbox deletes, which only carry the lowercased path: "lower(filepath) LIKE 'dropbox://folder/%'" per account
+db.Index("ix_indexed_file_account_id_filepath_lower", IndexedFile.account_id,
+         db.func.lower(IndexedFile.filepath).label("filepath_lower"),
+         postgresql_ops={"filepath_lower": "text_pattern_ops"})
+
+
+class FileSizeGroup(db.Model):
+    # Duplicate candidates (non-empty files of the storage types duplicates.py compares) per user and size,
+    # kept up to date by statement triggers on indexed_file (created by migration 1e6b9d4a7c38)
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    size = db.Column(db.BigInteger, primary_key=True, autoincrement=False)
+    file_count = db.Column(db.Integer, nullable=False, default=0)
+    version = db.Column(db.BigInteger, nullable=False, default=0)  # Bumped whenever a member is added, removed, modified or hashed
+
+
 class CloudStorageAccount(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # Associate with user
@@ -117,8 +141,12 @@ class CloudStorageAccount(db.Model):
     email = db.Column(db.String(100), nullable=False)
     access_token = db.Column(db.String(20000), nullable=False)  # Short-lived access token
     refresh_token = db.Column(db.String(1000), nullable=True)  # Store refresh token
+    token_expires_at = db.Column(db.DateTime, nullable=True)  # When access_token expires (UTC), if known
     permissions = db.Column(db.Text, nullable=True)
     last_synced = db.Column(db.DateTime, nullable=True)
+    sync_cursor = db.Column(db.Text, nullable=True)  # Provider change token (Drive startPageToken, Dropbox cursor) to sync deltas from
+    gmail_history_id = db.Column(db.String(32), nullable=True)  # Gmail history the attachments are synced up to
+    photos_synced_until = db.Column(db.DateTime, nullable=True)  # Creation time of the newest synced Photos item
 
     def to_dict(self):
         return {
@@ -128,3 +156,65 @@ class CloudStorageAccount(db.Model):
             "permissions": self.permissions.split(",") if self.permissions else [],
             "lastSynced": self.last_synced.isoformat() if self.last_synced else None
         }
+
+
+class IndexJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    root = db.Column(db.String(1024), nullable=False)  # Local directory being crawled
+    incremental = db.Column(db.Boolean, nullable=False, default=False)
+    status = db.Column(db.String(20), nullable=False, default="queued")  # queued, running, completed, failed
+    frontier = db.Column(db.JSON, nullable=True)  # Directories still to crawl at the last checkpoint
+    counters = db.Column(db.JSON, nullable=True)  # Progress counters at the last checkpoint
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)  # Heartbeat of the worker running the job
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "root": self.root,
+            "incremental": self.incremental,
+            "status": self.status,
+            "counters": self.counters or {},
+            "pending_directories": len(self.frontier or []),
+            "error": self.error,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class ExclusionRule(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)  # NULL for rules applying to everyone
+    kind = db.Column(db.String(20), nullable=False)  # glob, max_size, allow_ext, deny_ext, max_depth
+    value = db.Column(db.String(1024), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "value": self.value,
+            "global": self.user_id is None,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+        }
+
+
+class EsDeadLetter(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    op_type = db.Column(db.String(10), nullable=False)  # index, create, update, delete
+    index = db.Column(db.String(255), nullable=True)
+    doc_id = db.Column(db.String(1024), nullable=True)
+    action = db.Column(db.Text, nullable=False)  # JSON of the bulk action line and source, for replay
+    status = db.Column(db.Integer, nullable=True)  # HTTP status of the last failure, if any
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class IndexOutbox(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    doc_id = db.Column(db.String(512), nullable=False, index=True)  # filepath of the IndexedFile / file_index document
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
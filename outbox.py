@@ -0,0 +1,158 @@
+import os
+import logging
+import threading
+
+from flask import current_app
+from sqlalchemy import select, delete, insert
+from sqlalchemy.orm import sessionmaker
+
+from models import db, IndexedFile, IndexOutbox
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "500"))  # Outbox rows relayed per transaction
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "5"))  # Relay wakes up this often without a notify
+
+_relay_thread = None
+_relay_lock = threading.Lock()
+_wakeup = threading.Event()
+
+
+def enqueue_outbox(session, filepaths):
+    """Record that the file_index documents of `filepaths` must catch up with their IndexedFile rows.
+
+    Call it in the transaction that changed the rows, so the outbox commits (or
+    rolls back) together with them.
+    """
+    paths = list(dict.fromkeys(filepaths))
+    for start in range(0, len(paths), OUTBOX_BATCH_SIZE):
+        session.execute(insert(IndexOutbox), [{"doc_id": path} for path in paths[start:start + OUTBOX_BATCH_SIZE]])
+
+
+def es_document(file):
+    """The file_index document of an IndexedFile row. Its id is the filepath, so relaying it twice is harmless."""
+    return {
+        "user_id": file.user_id,
+        "filename": file.filename,
+        "filename_ngram": file.filename.lower(),  # 👈 Add ngram field for prefix search
+        "filepath": file.filepath,
+        "is_folder": file.is_folder,
+        "filetype": file.filetype,
+        "storage_type": file.storage_type,
+        "cloud_file_id": file.cloud_file_id,
+        "mime_type": file.mime_type,
+        "size": file.size,
+        "last_modified": file.last_modified.isoformat() if file.last_modified else None,
+        "is_favorite": file.is_favorite,
+    }
+
+
+# Merges the fields into the document (keeping its extracted content) and drops the "id" field that documents
+# written before the outbox carry, which search_files filters out
+_UPSERT_SCRIPT = "ctx._source.putAll(params.doc); ctx._source.remove('id')"
+
+
+def upsert_action(doc_id, doc):
+    """Bulk action that creates the file_index document `doc_id` or merges `doc` into it."""
+    return {"_op_type": "update", "_index": "file_index", "_id": doc_id,
+            "script": {"source": _UPSERT_SCRIPT, "lang": "painless", "params": {"doc": doc}}, "upsert": doc}
+
+
+def _relay_batch(session, writer, stmt):
+    rows = session.execute(stmt.with_for_update(skip_locked=True)).all()
+    if not rows:
+        return None
+    paths = {doc_id for _, doc_id in rows}
+    files = {file.filepath: file for file in session.scalars(select(IndexedFile).where(IndexedFile.filepath.in_(paths)))}
+    # Each document is reconciled with the row as it is now: present means upsert, gone means delete
+    result = writer.write(
+        upsert_action(path, es_document(files[path])) if path in files else
+        {"_op_type": "delete", "_index": "file_index", "_id": path}
+        for path in paths
+    )
+    session.execute(delete(IndexOutbox).where(IndexOutbox.id.in_([row_id for row_id, _ in rows])))
+    session.commit()
+    return result.acknowledged
+
+
+def _statements(doc_ids):
+    stmt = select(IndexOutbox.id, IndexOutbox.doc_id)
+    if doc_ids is None:
+        while True:
+            yield stmt.order_by(IndexOutbox.id).limit(OUTBOX_BATCH_SIZE)
+    doc_ids = list(dict.fromkeys(doc_ids))
+    for start in range(0, len(doc_ids), OUTBOX_BATCH_SIZE):
+        yield stmt.where(IndexOutbox.doc_id.in_(doc_ids[start:start + OUTBOX_BATCH_SIZE]))
+
+
+def relay_outbox(writer, doc_ids=None):
+    """Drain outbox rows to Elasticsearch through `writer` (an EsBulkWriter). Returns the acknowledged count.
+
+    With `doc_ids`, only the rows of those documents are relayed, e.g. right
+    after the transaction that queued them. Rows are claimed with SKIP LOCKED,
+    so several relays (threads or processes) can drain the outbox at once.
+    """
+    Session = sessionmaker(bind=db.engine)
+    acknowledged = 0
+    for stmt in _statements(doc_ids):
+        session = Session()
+        try:
+            count = _relay_batch(session, writer, stmt)
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        if count is None and doc_ids is None:
+            break  # Outbox drained
+        acknowledged += count or 0
+    return acknowledged
+
+
+def _relay_loop(app, writer):
+    purged = False
+    with app.app_context():
+        while True:
+            if not purged:
+                purged = purge_legacy_documents(writer.es)  # Retried every poll until it succeeds
+            try:
+                relay_outbox(writer)
+            except Exception as e:
+                logging.error(f"❌ Outbox relay error: {str(e)}")
+            _wakeup.wait(OUTBOX_POLL_SECONDS)
+            _wakeup.clear()
+
+
+def _start_relay(app, writer):
+    global _relay_thread
+    with _relay_lock:
+        if _relay_thread is None:
+            _relay_thread = threading.Thread(target=_relay_loop, args=(app, writer), daemon=True, name="outbox-relay")
+            _relay_thread.start()
+
+
+def start_outbox_relay(app, writer):
+    """Start the background relay at startup, so outbox rows left by a previous run drain without a notify."""
+    _start_relay(app, writer)
+
+
+def notify_outbox(writer):
+    """Wake the background relay (starting it on first use) after committing outbox rows."""
+    _start_relay(current_app._get_current_object(), writer)
+    _wakeup.set()
+
+
+def purge_legacy_documents(es):
+    """Delete file_index documents still carrying the "id" field of the pre-outbox indexer. Returns True on success.
+
+    These include "{user_id}_{filepath}" documents that no outbox row ever rewrites.
+    Relayed writes drop the field, so a document the relay has updated is not
+    matched; one deleted before its relay is re-created by it.
+    """
+    try:
+        response = es.delete_by_query(index="file_index", query={"exists": {"field": "id"}},
+                                      conflicts="proceed", ignore_unavailable=True)
+        if response.get("deleted"):
+            logging.info(f"Deleted {response['deleted']} legacy file_index document(s)")
+        return True
+    except Exception as e:
+        logging.error(f"❌ Could not delete legacy file_index documents: {str(e)}")
+        return False
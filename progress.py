@@ -0,0 +1,69 @@
+import time
+import threading
+from collections import Counter, defaultdict, deque
+
+PROGRESS_RATE_WINDOW = 30.0  # Seconds of samples behind the reported throughput
+
+
+class ProgressCounters:
+    """Named counters bumped from many threads without locking, summed when read.
+
+    Each thread increments a dict of its own (a plain `+=` on a dict only the
+    owner writes), so the crawler and writer hot loops never contend on a lock;
+    the lock is only taken once per thread to register its dict, and on read.
+    """
+
+    def __init__(self, seed=None):
+        self.base = Counter({name: value for name, value in (seed or {}).items() if isinstance(value, int)})
+        self.expected = None  # Items the crawl is expected to see, when known, for the ETA
+        self.phase = "crawling"
+        self.started = time.monotonic()
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+        self._samples = defaultdict(lambda: deque(maxlen=64))  # counter name -> (time, total)
+
+    def add(self, name, n=1):
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._local.shard = defaultdict(int)
+            with self._lock:
+                self._shards.append(shard)
+        shard[name] += n
+
+    def totals(self):
+        with self._lock:
+            shards = list(self._shards)
+        totals = Counter(self.base)
+        for shard in shards:
+            totals.update(dict(shard))
+        return totals
+
+    def rate(self, name, total):
+        """Per-second rate of a counter over the last PROGRESS_RATE_WINDOW seconds of reads."""
+        now = time.monotonic()
+        samples = self._samples[name]
+        samples.append((now, total))
+        while len(samples) > 2 and now - samples[0][0] > PROGRESS_RATE_WINDOW:
+            samples.popleft()
+        since, start = samples[0]
+        if now - since < 1.0:
+            since, start = self.started, self.base[name]  # Not enough history yet: average since the start
+        elapsed = now - since
+        return (total - start) / elapsed if elapsed > 0 else 0.0
+
+    def snapshot(self):
+        """Plain totals for persisting."""
+        return dict(self.totals(), phase=self.phase)
+
+    def report(self):
+        """Totals plus current throughput and, when the crawl size is known, an ETA."""
+        totals = self.totals()
+        items_per_sec = self.rate("files_seen", totals["files_seen"])
+        report = dict(totals, phase=self.phase, items_per_sec=round(items_per_sec, 1),
+                      bytes_hashed_per_sec=round(self.rate("bytes_hashed", totals["bytes_hashed"])),
+                      eta_seconds=None)
+        if self.phase == "crawling" and self.expected and items_per_sec > 0:
+            report["eta_seconds"] = round(max(0, self.expected - totals["files_seen"]) / items_per_sec)
+        return report
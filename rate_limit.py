@@ -0,0 +1,105 @@
+import os
+import json
+import time
+import random
+import logging
+import threading
+
+import dropbox
+from googleapiclient.errors import HttpError
+
+RATE_LIMIT_MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", "6"))  # Retries of a rate-limited call before giving up
+RATE_LIMIT_INITIAL_BACKOFF = 1.0  # Seconds, doubled per retry
+RATE_LIMIT_MAX_BACKOFF = 64.0
+
+# Requests per second (and burst) each provider gets from this process, shared by all accounts
+PROVIDER_RATES = {
+    "google_drive": float(os.getenv("GOOGLE_DRIVE_REQUESTS_PER_SECOND", "10")),
+    "gmail": float(os.getenv("GMAIL_REQUESTS_PER_SECOND", "40")),
+    "google_photos": float(os.getenv("GOOGLE_PHOTOS_REQUESTS_PER_SECOND", "5")),
+    "dropbox": float(os.getenv("DROPBOX_REQUESTS_PER_SECOND", "10")),
+}
+
+GOOGLE_RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, holding at most `burst`."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Block until `tokens` are available.
+
+        A cost above the burst waits for a full bucket and leaves it in debt, so
+        large batches still average out to `rate`.
+        """
+        needed = min(tokens, self.burst)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= needed:
+                    self.tokens -= tokens
+                    return
+                wait = (needed - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+provider_buckets = {provider: TokenBucket(rate) for provider, rate in PROVIDER_RATES.items()}
+
+
+def retry_after(error):
+    """Seconds to wait before retrying a rate-limited call, None if `error` is not a rate limit (0: no hint)."""
+    if isinstance(error, dropbox.exceptions.RateLimitError):
+        return error.backoff or 0
+    if isinstance(error, HttpError):
+        status = error.resp.status
+        if status == 403:
+            try:
+                reasons = {item.get("reason") for item in json.loads(error.content)["error"].get("errors", [])}
+            except (ValueError, KeyError, TypeError, AttributeError):
+                return None
+            if not reasons & GOOGLE_RATE_LIMIT_REASONS:
+                return None  # A real permission error
+        elif status != 429:
+            return None
+        try:
+            return float(error.resp.get("retry-after", 0))
+        except ValueError:
+            return 0
+    return None
+
+
+def _backoff(attempt):
+    delay = min(RATE_LIMIT_MAX_BACKOFF, RATE_LIMIT_INITIAL_BACKOFF * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def rate_limited(provider, func, *args, cost=1, **kwargs):
+    """Call a provider API through its token bucket, retrying rate-limit responses.
+
+    429s, Google 403 rate-limit reasons and Dropbox RateLimitError are retried
+    after their Retry-After hint, or with jittered exponential backoff, up to
+    RATE_LIMIT_MAX_RETRIES times. Other errors are raised straight away.
+    """
+    bucket = provider_buckets[provider]
+    attempt = 0
+    while True:
+        bucket.acquire(cost)
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            wait = retry_after(e)
+            if wait is None or attempt >= RATE_LIMIT_MAX_RETRIES:
+                raise
+            delay = wait + random.uniform(0, 1) if wait else _backoff(attempt)  # Jitter spreads out the retries
+            logging.warning(f"⏳ {provider} rate limit hit; retrying in {delay:.1f}s")
+            time.sleep(delay)
+            attempt += 1
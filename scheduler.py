@@ -0,0 +1,153 @@
+import os
+import heapq
+import logging
+import threading
+import itertools
+from collections import defaultdict
+
+SCHEDULER_WORKERS = int(os.getenv("SCHEDULER_WORKERS", "4"))  # Jobs running at once in this process
+SCHEDULER_PER_USER = int(os.getenv("SCHEDULER_PER_USER", "1"))  # Jobs of one user running at once
+SYNC_WORKERS = int(os.getenv("SYNC_WORKERS", "8"))  # Cloud account syncs running at once in this process
+
+# Priority classes: lower runs first
+INTERACTIVE = 0  # Started by the user (re-index, resumed interactive jobs)
+BACKGROUND = 10  # Auto-sync
+
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+
+class _Task:
+    __slots__ = ("priority", "seq", "key", "user_id", "func", "args")
+
+    def __init__(self, priority, seq, key, user_id, func, args):
+        self.priority = priority
+        self.seq = seq
+        self.key = key
+        self.user_id = user_id
+        self.func = func
+        self.args = args
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class JobScheduler:
+    """A bounded pool of worker threads running keyed jobs by priority.
+
+    A job is identified by its `key`: submitting a key that is already queued or
+    running is a no-op (a queued one is only raised to the higher priority), so
+    repeated requests never stack up identical work. No user has more than
+    `per_user` jobs running at once; their other jobs wait while jobs of other
+    users go ahead.
+    """
+
+    def __init__(self, workers=SCHEDULER_WORKERS, per_user=SCHEDULER_PER_USER, name="scheduler"):
+        self.name = name
+        self.workers = max(1, workers)
+        self.per_user = max(1, per_user)
+        self.heap = []
+        self.queued = {}  # key -> _Task
+        self.running = {}  # key -> _Task
+        self.user_running = defaultdict(int)
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.threads = []
+        self.stopped = False
+
+    def _start(self):
+        while len(self.threads) < self.workers:
+            thread = threading.Thread(target=self._work, daemon=True, name=f"{self.name}-{len(self.threads)}")
+            self.threads.append(thread)
+            thread.start()
+
+    def submit(self, key, func, *args, user_id=None, priority=BACKGROUND):
+        """Queue `func(*args)` under `key`. Returns False if the same job is already queued or running."""
+        with self.cond:
+            if self.stopped:
+                raise RuntimeError("Scheduler is shut down")
+            if key in self.running:
+                return False
+            task = self.queued.get(key)
+            if task is not None:
+                if priority < task.priority:
+                    task.priority = priority
+                    heapq.heapify(self.heap)
+                return False
+            task = _Task(priority, next(self.seq), key, user_id, func, args)
+            self.queued[key] = task
+            heapq.heappush(self.heap, task)
+            self._start()
+            self.cond.notify()
+            return True
+
+    def is_pending(self, key):
+        with self.cond:
+            return key in self.queued or key in self.running
+
+    def _take(self):
+        """Pop the best queued task whose user is under the per-user limit (called under the lock)."""
+        deferred, task = [], None
+        while self.heap:
+            candidate = heapq.heappop(self.heap)
+            if candidate.user_id is None or self.user_running[candidate.user_id] < self.per_user:
+                task = candidate
+                break
+            deferred.append(candidate)
+        for candidate in deferred:
+            heapq.heappush(self.heap, candidate)
+        return task
+
+    def _work(self):
+        while True:
+            with self.cond:
+                task = self._take()
+                while task is None:
+                    if self.stopped:
+                        return
+                    self.cond.wait()
+                    task = self._take()
+                del self.queued[task.key]
+                self.running[task.key] = task
+                if task.user_id is not None:
+                    self.user_running[task.user_id] += 1
+
+            try:
+                task.func(*task.args)
+            except Exception as e:
+                logging.error(f"❌ Scheduled job {task.key} failed: {str(e)}")
+            finally:
+                with self.cond:
+                    del self.running[task.key]
+                    if task.user_id is not None:
+                        self.user_running[task.user_id] -= 1
+                        if not self.user_running[task.user_id]:
+                            del self.user_running[task.user_id]
+                    self.cond.notify_all()  # A deferred job of this user may be runnable now
+
+    def stats(self, user_id=None):
+        """Queue depth by priority class and running jobs, for everyone or for one user."""
+        with self.cond:
+            queued = [task for task in self.queued.values() if user_id is None or task.user_id == user_id]
+            running = [task for task in self.running.values() if user_id is None or task.user_id == user_id]
+            by_priority = defaultdict(int)
+            for task in queued:
+                by_priority[PRIORITY_NAMES.get(task.priority, str(task.priority))] += 1
+            return {
+                "workers": self.workers,
+                "running": len(running),
+                "queued": len(queued),
+                "queued_by_priority": dict(by_priority),
+            }
+
+    def shutdown(self):
+        """Drop queued jobs and let the workers exit once their current job is done."""
+        with self.cond:
+            self.stopped = True
+            self.heap.clear()
+            self.queued.clear()
+            self.cond.notify_all()
+
+
+scheduler = JobScheduler()
+# Cloud syncs are network-bound: accounts sync side by side (one job per account key), paced by provider rate limits
+sync_scheduler = JobScheduler(workers=SYNC_WORKERS, name="sync")
@@ -0,0 +1,51 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+# The sync paths rely on Postgres (ON CONFLICT, RETURNING, xmax), so the tests need a throwaway Postgres database
+TEST_DATABASE_URI = os.getenv("TEST_DATABASE_URI")
+
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ["DATABASE_URI"] = TEST_DATABASE_URI or "sqlite://"
+
+
+@pytest.fixture(scope="session")
+def app():
+    if not TEST_DATABASE_URI:
+        pytest.skip("TEST_DATABASE_URI is not set")
+    from app import app as flask_app
+    from models import db
+
+    with flask_app.app_context():
+        db.create_all()
+        yield flask_app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def db(app):
+    from models import db
+
+    yield db
+    db.session.remove()
+    for table in reversed(db.metadata.sorted_tables):
+        db.session.execute(table.delete())
+    db.session.commit()
+
+
+@pytest.fixture
+def drive_account(db):
+    """A user with a linked Google Drive account whose access token is still valid."""
+    from models import User, CloudStorageAccount
+
+    user = User(username="tester", email="tester@example.com", password="password123")
+    db.session.add(user)
+    db.session.flush()
+    account = CloudStorageAccount(user_id=user.id, provider="Google Drive", email="tester@example.com",
+                                  access_token="test-token", refresh_token="test-refresh",
+                                  token_expires_at=datetime.utcnow() + timedelta(hours=1))
+    db.session.add(account)
+    db.session.commit()
+    return account
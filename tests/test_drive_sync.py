@@ -0,0 +1,205 @@
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+from googleapiclient.discovery_cache import get_static_doc
+
+import google_clients
+import file_search
+from models import IndexedFile, CloudStorageAccount
+
+
+class FakeDrive:
+    """In-memory Drive: files by id plus a change log whose positions are the page tokens."""
+
+    page_size = 2  # Small pages, so every listing pages through nextPageToken
+
+    def __init__(self):
+        self.files = {}
+        self.changes = []  # (file id, removed)
+        self.invalid_tokens = {}  # page token -> HTTP status changes.list answers with
+        self.calls = []
+
+    def put(self, file_id, name, mime_type="text/plain", modified="2026-01-01T00:00:00.000Z", md5=None, size=None,
+            trashed=False):
+        file = {"id": file_id, "name": name, "mimeType": mime_type, "modifiedTime": modified, "trashed": trashed}
+        if md5 is not None:
+            file["md5Checksum"] = md5
+        if size is not None:
+            file["size"] = str(size)
+        self.files[file_id] = file
+        self.changes.append((file_id, False))
+
+    def remove(self, file_id):
+        del self.files[file_id]
+        self.changes.append((file_id, True))
+
+    def start_page_token(self):
+        return str(len(self.changes))
+
+    def list_files(self, params):
+        files = [file for file in self.files.values() if not file["trashed"]]
+        start = int(params.get("pageToken", "0"))
+        body = {"files": files[start:start + self.page_size]}
+        if start + self.page_size < len(files):
+            body["nextPageToken"] = str(start + self.page_size)
+        return 200, body
+
+    def list_changes(self, params):
+        token = params["pageToken"]
+        if token in self.invalid_tokens:
+            status = self.invalid_tokens[token]
+            return status, {"error": {"code": status, "message": "Invalid page token"}}
+        start = int(token)
+        changes = []
+        for file_id, removed in self.changes[start:start + self.page_size]:
+            change = {"fileId": file_id, "removed": removed}
+            if not removed:
+                change["file"] = self.files.get(file_id)
+            changes.append(change)
+        body = {"changes": changes}
+        if start + self.page_size < len(self.changes):
+            body["nextPageToken"] = str(start + self.page_size)
+        else:
+            body["newStartPageToken"] = self.start_page_token()
+        return 200, body
+
+
+@pytest.fixture
+def fake_drive(monkeypatch):
+    """A local HTTP server answering discovery, files.list, changes.list and changes.getStartPageToken."""
+    drive = FakeDrive()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            drive.calls.append(url.path)
+            if url.path == "/discovery/v1/apis/drive/v3/rest":
+                status, body = 200, json.loads(get_static_doc("drive", "v3").replace("https://www.googleapis.com/", root_url))
+            elif url.path == "/drive/v3/files":
+                status, body = drive.list_files(params)
+            elif url.path == "/drive/v3/changes/startPageToken":
+                status, body = 200, {"startPageToken": drive.start_page_token()}
+            elif url.path == "/drive/v3/changes":
+                status, body = drive.list_changes(params)
+            else:
+                status, body = 404, {"error": {"code": 404, "message": "Not found"}}
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    root_url = f"http://127.0.0.1:{server.server_address[1]}/"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    # The Drive discovery document is bundled with googleapiclient; serve it from the fake with its root swapped
+    documents = {}
+
+    def discovery_document(api, version):
+        if (api, version) not in documents:
+            response = google_clients.httplib2.Http().request(f"{root_url}discovery/v1/apis/{api}/{version}/rest")
+            documents[(api, version)] = json.loads(response[1])
+        return documents[(api, version)]
+
+    monkeypatch.setattr(google_clients, "discovery_document", discovery_document)
+    monkeypatch.setattr(file_search, "notify_outbox", lambda writer: None)
+    yield drive
+    server.shutdown()
+    server.server_close()
+
+
+def indexed(db, account):
+    rows = db.session.query(IndexedFile).filter_by(account_id=account.id).all()
+    return {row.cloud_file_id: row for row in rows}
+
+
+def outbox(db):
+    from models import IndexOutbox
+
+    return {row.doc_id for row in db.session.query(IndexOutbox).all()}
+
+
+def sync(db, account):
+    counts = file_search.sync_google_drive(account.id, account.user_id)
+    db.session.expire_all()
+    return counts
+
+
+def test_first_sync_lists_all_files_and_stores_the_change_token(db, drive_account, fake_drive):
+    fake_drive.put("a", "report.pdf", "application/pdf", md5="aaa", size=10)
+    fake_drive.put("b", "notes", "application/vnd.google-apps.document")  # Google Docs have no md5 or size
+    fake_drive.put("c", "Photos", "application/vnd.google-apps.folder")
+    fake_drive.put("t", "old.pdf", "application/pdf", md5="ttt", size=5, trashed=True)
+    # Indexed by an earlier sync but no longer in Drive
+    db.session.add(IndexedFile(user_id=drive_account.user_id, account_id=drive_account.id, filename="gone.pdf",
+                               filepath="drive://gone", storage_type="google_drive", filetype="pdf",
+                               cloud_file_id="gone"))
+    db.session.commit()
+
+    counts = sync(db, drive_account)
+
+    assert counts == {"inserted": 3, "updated": 0, "unchanged": 0, "removed": 1}
+    rows = indexed(db, drive_account)
+    assert set(rows) == {"a", "b", "c"}
+    assert rows["a"].content_hash == "md5:aaa" and rows["a"].size == 10
+    assert rows["b"].content_hash is None and rows["b"].size is None
+    assert db.session.get(CloudStorageAccount, drive_account.id).sync_cursor == fake_drive.start_page_token()
+    assert "/drive/v3/changes" not in fake_drive.calls
+    assert outbox(db) == {"drive://a", "drive://b", "drive://c", "drive://gone"}
+
+    # Nothing changed: the next sync reads the change log only and writes nothing
+    fake_drive.calls.clear()
+    assert sync(db, drive_account) == {"inserted": 0, "updated": 0, "unchanged": 0, "removed": 0}
+    assert "/drive/v3/files" not in fake_drive.calls
+
+
+def test_changes_apply_edits_removals_and_trashing(db, drive_account, fake_drive):
+    for file_id in "abcd":
+        fake_drive.put(file_id, f"{file_id}.txt", md5=file_id, size=1)
+    sync(db, drive_account)
+    fake_drive.calls.clear()
+
+    fake_drive.put("a", "renamed.txt", md5="a", size=1)  # Renames keep modifiedTime
+    fake_drive.put("b", "b.txt", modified="2026-02-01T00:00:00.000Z", md5="b2", size=2)
+    fake_drive.put("c", "c.txt", md5="c", size=1, trashed=True)
+    fake_drive.remove("d")
+    fake_drive.put("e", "e.txt", md5="e", size=1)
+
+    counts = sync(db, drive_account)
+
+    assert counts == {"inserted": 1, "updated": 2, "unchanged": 0, "removed": 2}
+    rows = indexed(db, drive_account)
+    assert set(rows) == {"a", "b", "e"}
+    assert rows["a"].filename == "renamed.txt"
+    assert rows["b"].content_hash == "md5:b2" and rows["b"].size == 2
+    assert db.session.get(CloudStorageAccount, drive_account.id).sync_cursor == fake_drive.start_page_token()
+    assert "/drive/v3/files" not in fake_drive.calls
+    assert {"drive://c", "drive://d", "drive://e"} <= outbox(db)
+
+
+@pytest.mark.parametrize("status", [400, 404, 410])
+def test_rejected_change_token_falls_back_to_a_full_listing(db, drive_account, fake_drive, status):
+    fake_drive.put("a", "a.txt", md5="a", size=1)
+    sync(db, drive_account)
+    fake_drive.put("b", "b.txt", md5="b", size=1)
+    fake_drive.remove("a")
+    drive_account = db.session.get(CloudStorageAccount, drive_account.id)
+    fake_drive.invalid_tokens[drive_account.sync_cursor] = status
+    fake_drive.calls.clear()
+
+    counts = sync(db, drive_account)
+
+    assert counts == {"inserted": 1, "updated": 0, "unchanged": 0, "removed": 1}
+    assert set(indexed(db, drive_account)) == {"b"}
+    assert db.session.get(CloudStorageAccount, drive_account.id).sync_cursor == fake_drive.start_page_token()
+    assert "/drive/v3/changes" in fake_drive.calls and "/drive/v3/files" in fake_drive.calls
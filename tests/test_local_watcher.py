@@ -0,0 +1,76 @@
+import os
+import shutil
+import time
+
+import pytest
+
+from exclusions import ExclusionRules
+from local_watcher import PrunedInotify, inotify_init, WATCH_MOVE_PAIR_SECONDS
+
+pytestmark = pytest.mark.skipif(inotify_init is None, reason="inotify is Linux-only")
+
+
+class Recorder:
+    def __init__(self):
+        self.events = []
+
+    def dispatch(self, event):
+        self.events.append(event)
+
+    def seen(self, event_type, path):
+        return any(event.event_type == event_type and event.src_path == path for event in self.events)
+
+
+def eventually(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return condition()
+
+
+@pytest.fixture
+def watched(tmp_path):
+    """A watched root holding newdir/sub, with a recorder for the events and a list of lost-event calls."""
+    root = tmp_path / "root"
+    (root / "newdir" / "sub").mkdir(parents=True)
+    recorder, lost = Recorder(), []
+    inotify = PrunedInotify(str(root), lambda: ExclusionRules(str(root)), recorder, lambda: lost.append(True))
+    inotify.start()
+    yield inotify, root, recorder, lost
+    inotify.stop()
+    inotify.thread.join(timeout=5)
+
+
+def assert_still_watching(inotify, root, recorder):
+    (root / "after.txt").write_text("x")
+    assert eventually(lambda: recorder.seen("created", str(root / "after.txt")))
+    assert inotify.is_alive()
+
+
+def test_renamed_folder_moved_out_is_unwatched(watched, tmp_path):
+    inotify, root, recorder, lost = watched
+    os.rename(root / "newdir", root / "moved")
+    assert eventually(lambda: recorder.seen("moved", str(root / "newdir")))
+    assert inotify.wds.keys() == {str(root), str(root / "moved"), str(root / "moved" / "sub")}
+    assert all(inotify.paths[wd] == path for path, wd in inotify.wds.items())
+
+    os.rename(root / "moved", tmp_path / "outside")
+    time.sleep(WATCH_MOVE_PAIR_SECONDS)
+    assert eventually(lambda: recorder.seen("deleted", str(root / "moved")))
+    assert eventually(lambda: set(inotify.wds) == {str(root)})
+    assert_still_watching(inotify, root, recorder)
+    assert not lost
+
+
+def test_renamed_folder_removed_is_unwatched(watched):
+    inotify, root, recorder, lost = watched
+    os.rename(root / "newdir", root / "moved")
+    assert eventually(lambda: recorder.seen("moved", str(root / "newdir")))
+
+    shutil.rmtree(root / "moved")
+    assert eventually(lambda: recorder.seen("deleted", str(root / "moved")))
+    assert eventually(lambda: set(inotify.wds) == {str(root)} and set(inotify.paths.values()) == {str(root)})
+    assert_still_watching(inotify, root, recorder)
+    assert not lost
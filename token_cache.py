@@ -0,0 +1,200 @@
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+
+import requests
+from sqlalchemy import or_
+
+from models import db, CloudStorageAccount
+
+GOOGLE_TOKEN_URL = "https://oauth2.googleapis.com/token"
+DROPBOX_TOKEN_URL = "https://api.dropbox.com/oauth2/token"
+
+TOKEN_REFRESH_MARGIN = timedelta(seconds=int(os.getenv("TOKEN_REFRESH_MARGIN", "300")))  # Renew this long before expiry
+TOKEN_REFRESH_INTERVAL = 60  # Seconds between background scans for tokens about to expire
+TOKEN_DEFAULT_LIFETIME = 3600  # Seconds, when the provider does not say
+
+
+def refresh_access_token(refresh_token):
+    """Refresh Google OAuth Access Token using the stored refresh token. Returns (token, expires in seconds)."""
+    data = {
+        "client_id": os.getenv("CLIENT_ID"),
+        "client_secret": os.getenv("CLIENT_SECRET"),
+        "refresh_token": refresh_token,
+        "grant_type": "refresh_token",
+    }
+    try:
+        response_data = requests.post(GOOGLE_TOKEN_URL, data=data, timeout=30).json()
+        if "access_token" in response_data:
+            return response_data["access_token"], response_data.get("expires_in", TOKEN_DEFAULT_LIFETIME)
+        return None, None
+    except Exception as e:
+        print(f"Error refreshing Google token: {e}")
+        return None, None
+
+
+def refresh_dropbox_access_token(refresh_token):
+    """Refresh Dropbox Access Token using the stored refresh token. Returns (token, expires in seconds)."""
+    data = {
+        "client_id": os.getenv("DROPBOX_CLIENT_ID"),
+        "client_secret": os.getenv("DROPBOX_CLIENT_SECRET"),
+        "refresh_token": refresh_token,
+        "grant_type": "refresh_token",
+    }
+    try:
+        response_data = requests.post(DROPBOX_TOKEN_URL, data=data, timeout=30).json()
+        if "access_token" in response_data:
+            return response_data["access_token"], response_data.get("expires_in", TOKEN_DEFAULT_LIFETIME)
+        return None, None
+    except Exception as e:
+        print(f"Error refreshing Dropbox token: {e}")
+        return None, None
+
+
+REFRESHERS = {"Google Drive": refresh_access_token, "Dropbox": refresh_dropbox_access_token}
+
+
+def expires_at(expires_in):
+    """Absolute (UTC) expiry of a token the provider says lives `expires_in` seconds."""
+    return datetime.utcnow() + timedelta(seconds=int(expires_in or TOKEN_DEFAULT_LIFETIME))
+
+
+class _Entry:
+    __slots__ = ("provider", "token", "expires_at")
+
+    def __init__(self, provider, token, expires_at):
+        self.provider = provider
+        self.token = token
+        self.expires_at = expires_at
+
+    def fresh(self):
+        # An unknown expiry is due: the token may already be dead
+        return (self.token is not None and self.expires_at is not None and
+                self.expires_at - TOKEN_REFRESH_MARGIN > datetime.utcnow())
+
+
+class TokenCache:
+    """Access tokens of cloud accounts by account id, with their expiry.
+
+    `get` hands out a cached token while it is fresh and refreshes it once it is
+    within TOKEN_REFRESH_MARGIN of expiring. Refreshes of the same account are
+    coalesced: callers arriving while one is in flight wait for its result
+    instead of calling the token endpoint again. The background refresher keeps
+    tokens renewed ahead of time, so callers rarely wait at all. Refreshed
+    tokens and expiries are written back to the account row.
+    """
+
+    def __init__(self):
+        self.entries = {}  # account id -> _Entry
+        self.inflight = {}  # account id -> threading.Event set when its refresh is done
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def get(self, account_id, provider=None):
+        """A valid access token for the account (refreshing it if needed), or None."""
+        account_id = int(account_id)
+        with self.lock:
+            entry = self.entries.get(account_id)
+        if entry is None:
+            entry = self._load(account_id)
+            if entry is None:
+                return None
+        if provider is not None and entry.provider != provider:
+            return None
+        if entry.fresh():
+            return entry.token
+        return self.refresh(account_id)
+
+    def _load(self, account_id):
+        account = db.session.get(CloudStorageAccount, account_id)
+        if account is None:
+            return None
+        return self.put(account.id, account.provider, account.access_token, account.token_expires_at)
+
+    def put(self, account_id, provider, token, token_expires_at):
+        entry = _Entry(provider, token, token_expires_at)
+        with self.lock:
+            self.entries[int(account_id)] = entry
+        return entry
+
+    def evict(self, account_id):
+        with self.lock:
+            self.entries.pop(int(account_id), None)
+
+    def refresh(self, account_id):
+        """Refresh one account's token, or wait for the refresh already in flight. Returns the token."""
+        account_id = int(account_id)
+        with self.lock:
+            done = self.inflight.get(account_id)
+            leader = done is None
+            if leader:
+                done = self.inflight[account_id] = threading.Event()
+        if not leader:
+            done.wait()
+            with self.lock:
+                entry = self.entries.get(account_id)
+            return entry.token if entry else None
+
+        try:
+            account = db.session.get(CloudStorageAccount, account_id)
+            if account is None:
+                self.evict(account_id)
+                return None
+            refresher = REFRESHERS.get(account.provider)
+            token, expires_in = refresher(account.refresh_token) if refresher and account.refresh_token else (None, None)
+            if token is None:
+                # Keep serving the stored token; the provider may still accept it. One of unknown
+                # expiry is tried again after the refresh interval rather than on every call.
+                retry_at = datetime.utcnow() + TOKEN_REFRESH_MARGIN + timedelta(seconds=TOKEN_REFRESH_INTERVAL)
+                self.put(account_id, account.provider, account.access_token, account.token_expires_at or retry_at)
+                return account.access_token
+            account.access_token = token
+            account.token_expires_at = expires_at(expires_in)
+            db.session.commit()
+            self.put(account_id, account.provider, token, account.token_expires_at)
+            return token
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            with self.lock:
+                del self.inflight[account_id]
+            done.set()
+
+    def refresh_due(self):
+        """Refresh every refreshable token that expires within the margin (or whose expiry is unknown)."""
+        due = db.session.query(CloudStorageAccount.id).filter(
+            CloudStorageAccount.refresh_token.isnot(None),
+            CloudStorageAccount.provider.in_(list(REFRESHERS)),
+            or_(CloudStorageAccount.token_expires_at.is_(None),
+                CloudStorageAccount.token_expires_at < datetime.utcnow() + TOKEN_REFRESH_MARGIN),
+        ).all()
+        for (account_id,) in due:
+            try:
+                self.refresh(account_id)
+            except Exception as e:
+                logging.error(f"❌ Token refresh failed for account {account_id}: {str(e)}")
+
+    def _run(self, app):
+        while True:
+            with app.app_context():
+                try:
+                    self.refresh_due()
+                except Exception as e:
+                    logging.error(f"❌ Token refresher error: {str(e)}")
+                finally:
+                    db.session.remove()
+            time.sleep(TOKEN_REFRESH_INTERVAL)
+
+    def start(self, app):
+        """Start the background refresher once per process."""
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run, args=(app,), daemon=True, name="token-refresher")
+        self.thread.start()
+
+
+token_cache = TokenCache()